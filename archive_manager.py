@@ -3,7 +3,7 @@ import zipfile
 import datetime
 import logging
 import json
-from utils import get_db_connection, logger
+from utils import get_db_connection, logger, discipline_key
 
 class CourseWorkArchiveManager:
     MAX_ARCHIVE_SIZE = 45 * 1024 * 1024  # 45MB (оставляем запас до лимита Telegram в 50MB)
@@ -34,27 +34,49 @@ class CourseWorkArchiveManager:
             conn.commit()
 
     def _get_course_works(self, discipline):
-        """Получает список всех курсовых работ по дисциплине"""
+        """
+        Получает список всех курсовых работ по дисциплине из хранилища.
+        Returns: список (file_path, arcname); одинаковые файлы попадают в архив один раз,
+        имена в архиве - исходные имена файлов, без повторов
+        """
         with get_db_connection() as conn:
             cursor = conn.cursor()
-            cursor.execute(
-                'SELECT file_path FROM course_works WHERE TRIM(LOWER(discipline))=TRIM(LOWER(?))', 
-                (discipline,)
-            )
-            return [row[0] for row in cursor.fetchall() if row[0] and os.path.isfile(row[0])]
+            cursor.execute('''
+                SELECT cw.file_path, f.original_name
+                FROM course_works cw
+                LEFT JOIN course_work_files f
+                    ON f.student_id = cw.student_id AND f.discipline = cw.discipline AND f.semester = cw.semester
+                WHERE cw.discipline_key=?
+            ''', (discipline_key(discipline),))
+            rows = cursor.fetchall()
+        files = []
+        seen_paths = set()
+        used_names = set()
+        for file_path, original_name in rows:
+            if not file_path or file_path in seen_paths or not os.path.isfile(file_path):
+                continue
+            seen_paths.add(file_path)
+            arcname = original_name or os.path.basename(file_path)
+            base, ext = os.path.splitext(arcname)
+            counter = 2
+            while arcname in used_names:
+                arcname = f"{base} ({counter}){ext}"
+                counter += 1
+            used_names.add(arcname)
+            files.append((file_path, arcname))
+        return files
 
     def _create_archive_part(self, files, part_num, base_path, total_parts):
         """Создает часть архива"""
         archive_path = f"{base_path}.part{part_num+1}of{total_parts}.zip"
         with zipfile.ZipFile(archive_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-            for file_path in files:
-                arcname = os.path.basename(file_path)
+            for file_path, arcname in files:
                 zipf.write(file_path, arcname)
         return archive_path
 
     def _estimate_total_size(self, files):
         """Оценивает общий размер файлов"""
-        return sum(os.path.getsize(f) for f in files)
+        return sum(os.path.getsize(file_path) for file_path, _ in files)
 
     def _split_files_into_parts(self, files):
         """Разделяет файлы на части, чтобы каждая часть не превышала максимальный размер"""
@@ -62,7 +84,8 @@ class CourseWorkArchiveManager:
         current_part = []
         current_size = 0
 
-        for file_path in files:
+        for file_entry in files:
+            file_path = file_entry[0]
             file_size = os.path.getsize(file_path)
             if file_size > self.MAX_ARCHIVE_SIZE:
                 logger.warning(f"Файл {file_path} превышает максимально допустимый размер и будет пропущен")
@@ -71,10 +94,10 @@ class CourseWorkArchiveManager:
             if current_size + file_size > self.MAX_ARCHIVE_SIZE:
                 if current_part:
                     parts.append(current_part)
-                current_part = [file_path]
+                current_part = [file_entry]
                 current_size = file_size
             else:
-                current_part.append(file_path)
+                current_part.append(file_entry)
                 current_size += file_size
 
         if current_part:
@@ -111,8 +134,8 @@ class CourseWorkArchiveManager:
                 cursor.execute('''
                     SELECT MAX(parsing_time) 
                     FROM course_works 
-                    WHERE TRIM(LOWER(discipline))=TRIM(LOWER(?))
-                ''', (discipline,))
+                    WHERE discipline_key=?
+                ''', (discipline_key(discipline),))
                 latest_work_time = cursor.fetchone()[0]
                 
                 if latest_work_time:
@@ -189,8 +212,7 @@ class CourseWorkArchiveManager:
             logger.info(f"Создание единого архива для '{discipline}': {single_archive_path}")
             try:
                 with zipfile.ZipFile(single_archive_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-                    for file_path in current_files:
-                        arcname = os.path.basename(file_path)
+                    for file_path, arcname in current_files:
                         zipf.write(file_path, arcname)
                         logger.debug(f"Добавлен файл в архив: {arcname}")
 
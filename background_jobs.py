@@ -0,0 +1,76 @@
+import asyncio
+from utils import logger, config, safe_send_message, safe_edit_message
+
+# Настройки фоновых задач регистрации (переопределяются секцией "registration" в config.json)
+REGISTRATION_SETTINGS = {
+    'max_concurrent_jobs': 3,   # Сколько регистраций выполняется одновременно
+    'max_pending_jobs': 20,     # Сколько регистраций может ждать в очереди, остальным отказываем
+    **config.get('registration', {})
+}
+
+class BackgroundJobRunner:
+    """
+    Выполняет долгие операции (загрузка с VUZ2, сохранение в базу) в фоне,
+    чтобы обработчик Telegram сразу освобождал event loop.
+    Пользователь сразу получает сообщение о ходе работы, которое редактируется
+    результатом задачи после ее завершения.
+    """
+
+    def __init__(self, max_concurrent_jobs, max_pending_jobs):
+        self.max_pending_jobs = max_pending_jobs
+        self._semaphore = asyncio.Semaphore(max(1, max_concurrent_jobs))
+        self._tasks = set()
+
+    @property
+    def pending_count(self):
+        return len(self._tasks)
+
+    async def submit(self, message, job, progress_text, description="задача"):
+        """
+        Запускает job() в фоне.
+        message - сообщение пользователя, на которое отправляется сообщение о ходе работы.
+        job - корутинная функция без аргументов, возвращающая (text, reply_markup);
+              reply_markup должен быть inline-клавиатурой или None (ограничение edit_text).
+        Returns: True, если задача поставлена, False, если очередь переполнена.
+        """
+        if len(self._tasks) >= self.max_pending_jobs:
+            logger.warning(f"Очередь фоновых задач заполнена ({len(self._tasks)}), отклонена: {description}")
+            await safe_send_message(
+                message,
+                "Сейчас выполняется слишком много регистраций. Пожалуйста, попробуйте через минуту."
+            )
+            return False
+
+        if self._semaphore.locked():
+            progress_text = f"{progress_text}\n\nЗапрос поставлен в очередь."
+        # Сообщение без клавиатуры: к нему потом можно добавить inline-клавиатуру при редактировании
+        progress_message = await safe_send_message(message, progress_text)
+        task = asyncio.create_task(self._run(progress_message, message, job, description))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return True
+
+    async def _run(self, progress_message, message, job, description):
+        async with self._semaphore:
+            try:
+                text, reply_markup = await job()
+            except Exception as e:
+                logger.error(f"Ошибка фоновой задачи ({description}): {type(e).__name__} - {e}")
+                text, reply_markup = "Произошла ошибка при выполнении действия.\n\nВы можете вернуться в главное меню командой /cancel.", None
+        if progress_message is not None and await safe_edit_message(progress_message, text, reply_markup=reply_markup):
+            return
+        # Если отредактировать не удалось, отправляем результат новым сообщением
+        await safe_send_message(message, text, reply_markup=reply_markup)
+
+    async def stop(self):
+        """Отменяет незавершенные задачи (при остановке бота)"""
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+# Общий исполнитель для регистраций и добавления студентов
+registration_jobs = BackgroundJobRunner(
+    max_concurrent_jobs=REGISTRATION_SETTINGS['max_concurrent_jobs'],
+    max_pending_jobs=REGISTRATION_SETTINGS['max_pending_jobs']
+)
@@ -0,0 +1,225 @@
+import os
+import time
+import sqlite3
+import asyncio
+import datetime
+from utils import logger, config, get_db_connection, run_blocking, DB_SETTINGS
+
+# Настройки резервного копирования базы (переопределяются секцией "backup" в config.json)
+BACKUP_SETTINGS = {
+    'directory': 'backups',         # Каталог копий
+    'interval_hours': 24,           # Как часто делать копию
+    'startup_delay_minutes': 5,     # Первая копия после запуска бота, если плановая уже пропущена
+    'keep': 7,                      # Сколько последних копий хранить
+    'pages_per_step': 256,          # Страниц базы за один шаг копирования
+    'step_pause_seconds': 0.01,     # Пауза между шагами, чтобы запись бота и обработчиков не ждала копию
+    'max_restarts': 3,              # Перезапусков копирования (база менялась во время копии), после которых
+                                    # копия снимается одним шагом
+    **config.get('backup', {})
+}
+
+# Копия снимается через SQLite backup API (sqlite3.Connection.backup), а не копированием
+# файла: копия всегда согласована, даже если бот или scrape_worker.py в это время пишут.
+# Копирование идет по pages_per_step страниц с паузой между шагами в потоке BLOCKING_EXECUTOR.
+# Если база изменилась другим соединением, SQLite начинает копирование заново; после
+# max_restarts перезапусков копия снимается одним шагом (в режиме WAL это одна читающая
+# транзакция, пишущие ее не ждут). Готовая копия проверяется PRAGMA integrity_check и только
+# затем получает свое имя; результаты запусков пишутся в таблицу backups.
+
+class _TooManyRestarts(Exception):
+    pass
+
+def _backup_name(now):
+    stem = os.path.splitext(os.path.basename(DB_SETTINGS['path']))[0]
+    return f"{stem}_{now.strftime('%Y%m%d_%H%M%S')}.db"
+
+def _copy(target_path, pages, settings, stats):
+    """Копирует базу в target_path шагами по pages страниц (pages=-1 - одним шагом)"""
+    source = sqlite3.connect(DB_SETTINGS['path'], timeout=DB_SETTINGS['busy_timeout_ms'] / 1000)
+    target = sqlite3.connect(target_path)
+    remaining_before = None
+
+    def progress(status, remaining, total):
+        nonlocal remaining_before
+        stats['steps'] += 1
+        stats['pages'] = total
+        # После перезапуска (или ожидания блокировки) оставшихся страниц не меньше, чем до шага
+        if remaining_before is not None and remaining and remaining >= remaining_before:
+            stats['restarts'] += 1
+            if pages > 0 and stats['restarts'] >= settings['max_restarts']:
+                raise _TooManyRestarts()
+        remaining_before = remaining
+        if remaining:
+            time.sleep(settings['step_pause_seconds'])
+
+    try:
+        source.execute(f"PRAGMA busy_timeout={int(DB_SETTINGS['busy_timeout_ms'])}")
+        source.backup(target, pages=pages, progress=progress)
+        # Копия - один самодостаточный файл, без -wal рядом
+        target.execute('PRAGMA journal_mode=DELETE')
+    finally:
+        target.close()
+        source.close()
+
+def _verify(path):
+    """Returns: результат PRAGMA integrity_check копии ('ok', если копия цела)"""
+    conn = sqlite3.connect(path)
+    try:
+        return '; '.join(row[0] for row in conn.execute('PRAGMA integrity_check').fetchall())
+    finally:
+        conn.close()
+
+def _remove(path):
+    for suffix in ('', '-journal', '-wal', '-shm'):
+        try:
+            os.remove(path + suffix)
+        except FileNotFoundError:
+            pass
+
+def _record(result):
+    with get_db_connection() as conn:
+        if not conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='backups'").fetchone():
+            return  # Копия перед миграцией базы, в которой еще нет журнала (migrate.py)
+        conn.execute('''
+            INSERT INTO backups (file, started_at, finished_at, duration, size, pages, steps, restarts, integrity, error)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (
+            result['file'], result['started_at'], result['finished_at'], result['duration'], result['size'],
+            result['pages'], result['steps'], result['restarts'], result['integrity'], result['error']
+        ))
+        conn.commit()
+
+def create_backup(settings=None):
+    """
+    Снимает и проверяет копию базы в каталоге settings['directory'].
+    Returns: {'file', 'started_at', 'finished_at', 'duration', 'size', 'pages', 'steps', 'restarts',
+    'integrity', 'error'}; при ошибке file - None, error - текст ошибки
+    """
+    settings = settings or BACKUP_SETTINGS
+    os.makedirs(settings['directory'], exist_ok=True)
+    now = datetime.datetime.now()
+    path = os.path.join(settings['directory'], _backup_name(now))
+    partial_path = path + '.part'
+    stats = {'steps': 0, 'pages': 0, 'restarts': 0}
+    result = {
+        'file': None, 'started_at': now.isoformat(), 'size': None, 'integrity': None, 'error': None
+    }
+    started = time.perf_counter()
+    try:
+        _remove(partial_path)
+        try:
+            _copy(partial_path, settings['pages_per_step'], settings, stats)
+        except _TooManyRestarts:
+            logger.info(f"База менялась во время копирования ({stats['restarts']} перезапусков), копия одним шагом")
+            _remove(partial_path)
+            _copy(partial_path, -1, settings, stats)
+        result['integrity'] = _verify(partial_path)
+        if result['integrity'] != 'ok':
+            raise RuntimeError(f"проверка копии не пройдена: {result['integrity'][:200]}")
+        os.replace(partial_path, path)
+        result['file'] = path
+        result['size'] = os.path.getsize(path)
+    except Exception as e:
+        _remove(partial_path)
+        result['error'] = f"{type(e).__name__}: {e}"
+    result.update(stats)
+    result['duration'] = time.perf_counter() - started
+    result['finished_at'] = datetime.datetime.now().isoformat()
+    try:
+        _record(result)
+    except Exception as e:
+        logger.error(f"Не удалось записать результат резервного копирования: {e}")
+    if result['error']:
+        logger.error(f"Ошибка резервного копирования базы: {result['error']}")
+    else:
+        logger.info(
+            f"Резервная копия базы {path}: {result['size'] / 1024 / 1024:.1f} МБ за {result['duration']:.1f} с, "
+            f"шагов {result['steps']}, перезапусков {result['restarts']}"
+        )
+    return result
+
+def _backup_files(settings):
+    """Returns: пути копий в каталоге, от новых к старым"""
+    directory = settings['directory']
+    if not os.path.isdir(directory):
+        return []
+    stem = os.path.splitext(os.path.basename(DB_SETTINGS['path']))[0]
+    names = [
+        name for name in os.listdir(directory)
+        if name.startswith(stem + '_') and name.endswith('.db')
+    ]
+    return [os.path.join(directory, name) for name in sorted(names, reverse=True)]
+
+def prune_backups(settings=None):
+    """Удаляет копии сверх settings['keep'] последних. Returns: число удаленных"""
+    settings = settings or BACKUP_SETTINGS
+    removed = 0
+    for path in _backup_files(settings)[max(1, settings['keep']):]:
+        try:
+            _remove(path)
+            removed += 1
+        except OSError as e:
+            logger.warning(f"Не удалось удалить старую резервную копию {path}: {e}")
+    return removed
+
+def backup_report(settings=None):
+    """
+    Returns: {'last': последний запуск, 'last_success': последняя удачная копия (словари как у
+    create_backup или None), 'files': число хранимых копий, 'total_size': их общий размер}
+    """
+    settings = settings or BACKUP_SETTINGS
+    columns = ('file', 'started_at', 'finished_at', 'duration', 'size', 'pages', 'steps', 'restarts', 'integrity', 'error')
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f'SELECT {", ".join(columns)} FROM backups ORDER BY id DESC LIMIT 1')
+        last = cursor.fetchone()
+        cursor.execute(f'SELECT {", ".join(columns)} FROM backups WHERE error IS NULL ORDER BY id DESC LIMIT 1')
+        last_success = cursor.fetchone()
+    files = _backup_files(settings)
+    return {
+        'last': dict(zip(columns, last)) if last else None,
+        'last_success': dict(zip(columns, last_success)) if last_success else None,
+        'files': len(files),
+        'total_size': sum(os.path.getsize(path) for path in files if os.path.exists(path))
+    }
+
+class BackupService:
+    """Резервные копии базы по расписанию (в процессе бота)"""
+
+    def __init__(self, settings=None):
+        self.settings = settings or BACKUP_SETTINGS
+
+    def _next_backup_at(self):
+        """Время следующей копии: interval_hours после последней удачной, но не раньше startup_delay_minutes"""
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT MAX(started_at) FROM backups WHERE error IS NULL')
+            last = cursor.fetchone()[0]
+        earliest = datetime.datetime.now() + datetime.timedelta(minutes=self.settings['startup_delay_minutes'])
+        if not last:
+            return earliest
+        return max(earliest, datetime.datetime.fromisoformat(last) + datetime.timedelta(hours=self.settings['interval_hours']))
+
+    async def run(self, is_running):
+        """Цикл резервного копирования; is_running - функция, возвращающая False для остановки"""
+        next_backup_at = await run_blocking(self._next_backup_at)
+        while is_running():
+            try:
+                now = datetime.datetime.now()
+                if now < next_backup_at:
+                    await asyncio.sleep(min(60, (next_backup_at - now).total_seconds()))
+                    continue
+                result = await run_blocking(create_backup, self.settings)
+                removed = await run_blocking(prune_backups, self.settings)
+                if removed:
+                    logger.info(f"Удалено старых резервных копий: {removed}")
+                # После ошибки повторяем через час, а не через interval_hours
+                hours = self.settings['interval_hours']
+                if result['error']:
+                    hours = min(1, hours)
+                next_backup_at = datetime.datetime.now() + datetime.timedelta(hours=hours)
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"Ошибка в цикле резервного копирования: {e}")
+                await asyncio.sleep(60)
@@ -0,0 +1,225 @@
+"""
+Задержка обработчиков кнопок во время парсинга: соединения из пула с WAL и
+настройками DB_SETTINGS против прежних (новое соединение на каждый вызов,
+журнал отката, настройки SQLite по умолчанию).
+
+Для каждого режима на временной базе заводит --students студентов, ставит всех
+в очередь оценок и разбирает ее обработчиками StudentParserScheduler против
+заглушки VUZ2 (--change-rate 1: каждая проверка пишет оценки). Пока идет парсинг,
+--rate раз в секунду «нажимается кнопка» «Мой рейтинг» случайного студента
+(check_registration и render_student_rating, как в обработчике) и замеряется
+время ответа. --worker-processes N дополнительно запускает N процессов
+scrape_worker.py, которые пишут в ту же базу.
+
+    python benchmarks/bench_db_latency.py --students 500 --workers 8
+    python benchmarks/bench_db_latency.py --worker-processes 2 --rate 100
+
+Каждый режим выполняется в отдельном процессе и рабочем каталоге
+(config.json, students.db) во временной папке; --keep оставляет их для просмотра.
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import asyncio
+import logging
+import argparse
+import tempfile
+import datetime
+import subprocess
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+
+from vuz2_stub import add_stub_arguments, stub_from_args  # noqa: E402
+
+FIRST_STUDENT_ID = 10000000
+FIRST_TELEGRAM_ID = 500000
+
+# Настройки database для режимов: 'legacy' повторяет прежний sqlite3.connect('students.db')
+MODES = {
+    'legacy': {
+        'journal_mode': 'DELETE',
+        'synchronous': 'FULL',
+        'busy_timeout_ms': 5000,
+        'mmap_size': 0,
+        'cache_size_kb': 2000,
+        'temp_store': 'DEFAULT',
+        'pool_size': 0
+    },
+    'pooled': {}
+}
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def prepare_workdir(workdir, args, mode, base_url):
+    bench_config = {
+        'vuz2': {
+            'base_url': base_url,
+            'requests_per_second': 0,
+            'max_in_flight': max(8, args.workers * 2),
+            'max_connections': max(8, args.workers * 2)
+        },
+        'scheduler': {'parser_workers': args.workers, 'portfolio_workers': 0},
+        'job_queue': {'poll_seconds': 0.1},
+        'database': MODES[mode]
+    }
+    with open(os.path.join(workdir, 'config.json'), 'w') as f:
+        json.dump(bench_config, f)
+    os.chdir(workdir)
+
+
+def seed_students(get_db_connection, count):
+    with get_db_connection() as conn:
+        conn.executemany(
+            'INSERT OR IGNORE INTO students (student_id, name, telegram_id, student_group) VALUES (?, ?, ?, ?)',
+            [
+                (str(FIRST_STUDENT_ID + i), f'Студент {i}', str(FIRST_TELEGRAM_ID + i), f'ПИ-{i % 20}')
+                for i in range(count)
+            ]
+        )
+        conn.commit()
+
+
+def make_all_due(get_db_connection):
+    now = datetime.datetime.now()
+    with get_db_connection() as conn:
+        conn.execute('UPDATE scrape_state SET next_parse_at=?', (now.isoformat(),))
+        conn.execute('UPDATE scrape_state SET portfolio_next_at=?', ((now + datetime.timedelta(days=1)).isoformat(),))
+        conn.commit()
+
+
+async def press_rating_button(student_index):
+    """То же, что обработчик кнопки «Мой рейтинг»: проверка регистрации и таблица оценок"""
+    from utils import check_registration, run_blocking
+    from refresh_requests import render_student_rating
+
+    is_registered, student = await check_registration(str(FIRST_TELEGRAM_ID + student_index))
+    if not is_registered:
+        raise RuntimeError('студент не найден')
+    return await run_blocking(render_student_rating, student[0])
+
+
+async def run_mode(args, mode):
+    # Модули бота читают config.json из текущего каталога при импорте
+    from utils import get_db_connection, logger
+    from schema import init_db
+    import scheduler as scheduler_module
+    from scraper import vuz2_client
+    from job_queue import scrape_jobs, GRADES_JOB
+
+    if not args.verbose:
+        logger.setLevel(logging.CRITICAL)
+    init_db()
+    seed_students(get_db_connection, args.students)
+    parser = scheduler_module.StudentParserScheduler(application=None)
+    parser._seed_scrape_state()
+    make_all_due(get_db_connection)
+
+    processes = [
+        subprocess.Popen(
+            [sys.executable, os.path.join(REPO_DIR, 'scrape_worker.py'),
+             '--workers', str(args.workers), '--portfolio-workers', '0'],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        for _ in range(args.worker_processes)
+    ]
+    latencies, errors = [], []
+    rng = random.Random(args.seed)
+
+    async def press():
+        started = time.perf_counter()
+        try:
+            await press_rating_button(rng.randrange(args.students))
+            latencies.append(time.perf_counter() - started)
+        except Exception as e:
+            errors.append(str(e))
+
+    parser.is_running = True
+    parser.result_writer.start()
+    workers = [asyncio.create_task(parser._parser_worker(n, GRADES_JOB)) for n in range(args.workers)]
+    presses = []
+    started = time.perf_counter()
+    try:
+        parser._enqueue_due_students(args.students, GRADES_JOB)
+        while True:
+            counts = scrape_jobs.counts()
+            if not counts.get('pending') and not counts.get('running'):
+                break
+            presses.append(asyncio.create_task(press()))
+            await asyncio.sleep(1 / args.rate)
+        elapsed = time.perf_counter() - started
+        await asyncio.gather(*presses)
+    finally:
+        parser.is_running = False
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        await parser.result_writer.stop()
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
+        await vuz2_client.close()
+
+    print(
+        f'{mode:<7} парсинг {args.students / elapsed:6.1f} студ/с за {elapsed:5.1f} с | '
+        f'кнопка: {len(latencies)} нажатий, p50 {percentile(latencies, 0.5) * 1000:6.1f} мс, '
+        f'p95 {percentile(latencies, 0.95) * 1000:6.1f} мс, p99 {percentile(latencies, 0.99) * 1000:6.1f} мс, '
+        f'max {max(latencies, default=0) * 1000:6.1f} мс | ошибок {len(errors)}'
+        + (f' ({errors[0]})' if errors else '')
+    )
+
+
+def run_in_workdir(args, mode):
+    stub = stub_from_args(args).start()
+    workdir = tempfile.mkdtemp(prefix=f'brumarks-bench-{mode}-')
+    cwd = os.getcwd()
+    try:
+        prepare_workdir(workdir, args, mode, stub.base_url)
+        asyncio.run(run_mode(args, mode))
+    finally:
+        stub.stop()
+        os.chdir(cwd)
+        if args.keep:
+            print(f'  рабочий каталог: {workdir}')
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Задержка обработчиков во время парсинга: пул соединений и WAL')
+    parser.add_argument('--students', type=int, default=500, help='число студентов')
+    parser.add_argument('--workers', type=int, default=8, help='обработчиков оценок (в боте и в каждом процессе)')
+    parser.add_argument('--worker-processes', type=int, default=0, help='дополнительных процессов scrape_worker.py')
+    parser.add_argument('--rate', type=float, default=50, help='нажатий кнопки в секунду')
+    parser.add_argument('--modes', default='legacy,pooled', help='режимы через запятую: ' + ', '.join(MODES))
+    parser.add_argument('--mode', help=argparse.SUPPRESS)
+    parser.add_argument('--keep', action='store_true', help='не удалять рабочие каталоги')
+    parser.add_argument('--verbose', action='store_true', help='выводить лог бота')
+    add_stub_arguments(parser)
+    parser.set_defaults(change_rate=1.0)
+    args = parser.parse_args()
+    if args.corpus:
+        args.corpus = os.path.abspath(args.corpus)
+
+    if args.mode:
+        run_in_workdir(args, args.mode)
+        return
+    # Модули бота читают настройки при импорте, поэтому каждый режим - в своем процессе
+    for mode in args.modes.split(','):
+        subprocess.run([sys.executable, os.path.abspath(__file__), *sys.argv[1:], '--mode', mode], check=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,187 @@
+"""
+Сравнение и замер скорости разбора страниц VUZ2 (extractor.py).
+
+Проверяет на корпусе страниц, что быстрый и полный разбор дают одинаковый
+результат (name, grades, subjects, course_works), и печатает страниц в секунду
+для каждого пути.
+
+    python benchmarks/bench_extractor.py                  # синтетический корпус
+    python benchmarks/bench_extractor.py --corpus DIR     # сохраненные страницы
+
+В DIR ожидаются пары файлов <id>.rate.html и <id>.portfolio.html (портфолио
+может отсутствовать). Код возврата 1, если хотя бы одна страница разошлась.
+"""
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from extractor import (  # noqa: E402
+    FastPathError, extract_rating_fast, extract_rating_full,
+    extract_portfolio_fast, extract_portfolio_full
+)
+
+SUBJECTS = ['Математика', 'Физика', 'Химия', 'Программирование', 'Философия',
+            'Экономика', 'Базы данных', 'Английский язык', 'Сети &amp; системы']
+NAMES = ['Иванов Иван Иванович', 'Петрова Анна Сергеевна', 'Сидоров-Ким Павел']
+
+PAGE_HEAD = '''<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>Рейтинг</title>
+<script>var menu = "<div class='box'>";</script>
+<link rel="stylesheet" href="/css/main.css"></head>
+<body><div id="header"><ul class="menu">{menu}</ul></div>
+'''
+PAGE_TAIL = '<div id="footer"><p>БРУ</p>{footer}</div></body></html>'
+
+
+def _filler(rng, count):
+    return ''.join(f'<li><a href="/page/{rng.randint(1, 999)}/">Пункт {i}</a></li>' for i in range(count))
+
+
+def make_rating_page(rng, variant):
+    """Синтетическая страница рейтинга; variant задает особый случай разметки"""
+    menu = _filler(rng, 30)
+    footer = ''.join(f'<p>Строка подвала {i}</p>' for i in range(40))
+    if variant == 'not_found':
+        return (PAGE_HEAD.format(menu=menu) + '<div class="box data"><h2>Студент не найден</h2></div>'
+                + PAGE_TAIL.format(footer=footer)).encode('utf-8')
+
+    subjects = rng.sample(SUBJECTS, rng.randint(3, len(SUBJECTS)))
+    header = '<tr><th>Модуль</th>' + ''.join(f'<th>{s}</th>' for s in subjects) + '<th>Итог</th></tr>'
+    rows = ''
+    for label in ('1-ый модуль', '2-ой модуль'):
+        if variant == 'one_module' and label == '2-ой модуль':
+            continue
+        cells = ''.join(f'<td>{rng.choice([str(rng.randint(0, 10)), "-", "н/а", ""])}</td>' for _ in subjects)
+        rows += f'<tr><td> {label} </td>{cells}<td>{rng.randint(0, 10)}</td></tr>\n'
+    rows += '<tr><td>Пропуски</td>' + '<td>0</td>' * (len(subjects) + 1) + '</tr>'
+    table = f'<table id="user" class="rate">\n{header}\n{rows}</table>'
+    if variant == 'nested_table':
+        table = table.replace('<td>Пропуски</td>', '<td><table><tr><td>x</td></tr></table></td>')
+    if variant == 'no_table':
+        table = '<p>Нет данных</p>'
+
+    name = rng.choice(NAMES)
+    if variant == 'name_markup':
+        name = f'<span>{name}</span> &laquo;гр.&raquo;'
+    box = f'<div class="box data">\n<h1>{name}</h1>\n<div class="info">Группа ПИ-231</div>\n{table}\n</div>'
+    if variant == 'h1_outside':
+        box = f'<div class="box data"><p>пусто</p></div><h1>{name}</h1>{table}'
+    return (PAGE_HEAD.format(menu=menu) + box + PAGE_TAIL.format(footer=footer)).encode('utf-8')
+
+
+def make_portfolio_page(rng, variant):
+    """Синтетическая страница портфолио"""
+    menu = _filler(rng, 30)
+    footer = ''.join(f'<p>Строка подвала {i}</p>' for i in range(40))
+    items = ''
+    for _ in range(rng.randint(0, 6)):
+        semester = rng.randint(1, 8)
+        discipline = rng.choice(SUBJECTS)
+        link = f'<a href="/files/{rng.randint(1000, 9999)}.docx">курсовая.docx</a>'
+        if rng.random() < 0.1:
+            link = ''
+        items += f'<li>Семестр: {semester}<br>Дисциплина: {discipline}<br>{link}</li>\n'
+    if variant == 'junk_item':
+        items += '<li>Прочее: <b>Грамота</b></li>'
+    ul = f'<ul class="works">\n{items}</ul>'
+    if variant == 'nested_list':
+        ul = ul.replace('</ul>', '<li><ul><li>вложенный</li></ul></li></ul>')
+    if variant == 'empty_portfolio':
+        ul = ''
+    return (PAGE_HEAD.format(menu=menu) + f'<div class="box data"><h1>Портфолио</h1>{ul}</div>'
+            + PAGE_TAIL.format(footer=footer)).encode('utf-8')
+
+
+RATING_VARIANTS = ['normal'] * 6 + ['not_found', 'one_module', 'nested_table', 'no_table', 'name_markup', 'h1_outside']
+PORTFOLIO_VARIANTS = ['normal'] * 6 + ['junk_item', 'nested_list', 'empty_portfolio', 'missing']
+
+
+def synthetic_corpus(size, seed):
+    rng = random.Random(seed)
+    corpus = []
+    for i in range(size):
+        rating = make_rating_page(rng, RATING_VARIANTS[i % len(RATING_VARIANTS)])
+        portfolio_variant = PORTFOLIO_VARIANTS[i % len(PORTFOLIO_VARIANTS)]
+        portfolio = None if portfolio_variant == 'missing' else make_portfolio_page(rng, portfolio_variant)
+        corpus.append((f'synthetic-{i}', rating, portfolio))
+    return corpus
+
+
+def load_corpus(directory):
+    corpus = []
+    for filename in sorted(os.listdir(directory)):
+        if not filename.endswith('.rate.html'):
+            continue
+        page_id = filename[:-len('.rate.html')]
+        with open(os.path.join(directory, filename), 'rb') as f:
+            rating = f.read()
+        portfolio_path = os.path.join(directory, f'{page_id}.portfolio.html')
+        portfolio = None
+        if os.path.exists(portfolio_path):
+            with open(portfolio_path, 'rb') as f:
+                portfolio = f.read()
+        corpus.append((page_id, rating, portfolio))
+    return corpus
+
+
+def fast_or_full(fast, full, content):
+    """То же, что делает scraper: быстрый путь с откатом на полный"""
+    try:
+        return fast(content), False
+    except FastPathError:
+        return full(content), True
+
+
+def run_differential(corpus):
+    mismatches = 0
+    fallbacks = 0
+    for page_id, rating, portfolio in corpus:
+        rating_result, rating_fallback = fast_or_full(extract_rating_fast, extract_rating_full, rating)
+        portfolio_result, portfolio_fallback = fast_or_full(extract_portfolio_fast, extract_portfolio_full, portfolio)
+        fallbacks += rating_fallback + portfolio_fallback
+        if rating_result != extract_rating_full(rating):
+            mismatches += 1
+            print(f'РАСХОЖДЕНИЕ рейтинга: {page_id}')
+        if portfolio_result != extract_portfolio_full(portfolio):
+            mismatches += 1
+            print(f'РАСХОЖДЕНИЕ портфолио: {page_id}')
+    print(f'Страниц: {len(corpus)}, расхождений: {mismatches}, откатов на полный разбор: {fallbacks}')
+    return mismatches
+
+
+def measure(label, func, pages, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for content in pages:
+            func(content)
+    elapsed = time.perf_counter() - started
+    count = len(pages) * repeat
+    print(f'{label:<28} {count / elapsed:10.1f} стр/с  ({elapsed:.2f} с на {count} стр.)')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Сравнение быстрого и полного разбора страниц VUZ2')
+    parser.add_argument('--corpus', help='каталог с сохраненными страницами')
+    parser.add_argument('--size', type=int, default=200, help='размер синтетического корпуса')
+    parser.add_argument('--repeat', type=int, default=3, help='число проходов при замере')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus) if args.corpus else synthetic_corpus(args.size, args.seed)
+    mismatches = run_differential(corpus)
+
+    ratings = [rating for _, rating, _ in corpus]
+    portfolios = [portfolio for _, _, portfolio in corpus if portfolio is not None]
+    measure('рейтинг, полный разбор', extract_rating_full, ratings, args.repeat)
+    measure('рейтинг, быстрый путь', lambda c: fast_or_full(extract_rating_fast, extract_rating_full, c), ratings, args.repeat)
+    measure('портфолио, полный разбор', extract_portfolio_full, portfolios, args.repeat)
+    measure('портфолио, быстрый путь', lambda c: fast_or_full(extract_portfolio_fast, extract_portfolio_full, c), portfolios, args.repeat)
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == '__main__':
+    main()
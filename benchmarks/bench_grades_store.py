@@ -0,0 +1,290 @@
+"""
+Хранение оценок: старая широкая таблица students (по колонке "<дисциплина> (модуль N)"
+на каждую дисциплину) против справочника subjects и таблицы grades на временной базе.
+
+Заводит --students студентов в группах по --group-size, всего --subjects дисциплин,
+каждая группа изучает --subjects-per-group из них. Для старой схемы замеряет запись
+оценок студента (как прежний save_to_db), чтение оценок студента (SELECT * и разбор
+колонок, как прежний format_ratings_table) и чтение дисциплины группы (как прежний
+обработчик discipline_); затем перенос оценок (grade_store.migrate_legacy_batch,
+drop_legacy_grade_columns) и те же операции на новой схеме (save_to_db,
+load_student_grades, load_discipline_grades).
+
+    python benchmarks/bench_grades_store.py
+    python benchmarks/bench_grades_store.py --students 2000 --subjects 100 --ops 200
+
+Рабочий каталог (config.json, students.db) создается во временной папке;
+--keep оставляет его для просмотра.
+"""
+import os
+import re
+import sys
+import json
+import time
+import random
+import shutil
+import logging
+import argparse
+import tempfile
+import datetime
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+
+FIRST_STUDENT_ID = 10000000
+
+# Таблица students до перехода на grades (колонки оценок добавлялись ALTER TABLE)
+LEGACY_STUDENTS_DDL = '''
+    CREATE TABLE students (
+        student_id TEXT PRIMARY KEY,
+        name TEXT,
+        update_date TEXT,
+        telegram_id TEXT,
+        student_group TEXT,
+        is_admin INTEGER DEFAULT 0,
+        backup_telegram_ids TEXT DEFAULT '[]',
+        last_parsed_time TEXT,
+        is_superadmin INTEGER DEFAULT 0,
+        notifications INTEGER DEFAULT 1,
+        subgroup INTEGER DEFAULT 1
+    )
+'''
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def quote(name):
+    return '"{}"'.format(name.replace('"', '""'))
+
+
+class Dataset:
+    """Студенты, группы и оценки; дисциплины групп выбираются случайно из общего списка"""
+
+    def __init__(self, args):
+        rng = random.Random(args.seed)
+        self.rng = rng
+        self.subjects = [f'Дисциплина {n:03d}' for n in range(args.subjects)]
+        self.students = []
+        self.group_subjects = {}
+        for n in range(args.students):
+            group = f'ГР-{n // args.group_size + 100}'
+            if group not in self.group_subjects:
+                self.group_subjects[group] = sorted(rng.sample(self.subjects, min(args.subjects_per_group, args.subjects)))
+            self.students.append((str(FIRST_STUDENT_ID + n), f'Студент {n}', group))
+
+    def grades(self, group):
+        """Returns: {(дисциплина, модуль): оценка} со случайными пропусками, как на странице рейтинга"""
+        return {
+            (subject, module): (self.rng.randint(2, 10) if self.rng.random() < 0.7 else None)
+            for subject in self.group_subjects[group] for module in (1, 2)
+        }
+
+
+# --- Старая схема (код до перехода, для сравнения) ---
+
+def legacy_create(get_db_connection, dataset):
+    """Широкая таблица со всеми дисциплинами и оценками всех студентов"""
+    with get_db_connection() as conn:
+        conn.execute(LEGACY_STUDENTS_DDL)
+        for subject in dataset.subjects:
+            for module in (1, 2):
+                conn.execute(f'ALTER TABLE students ADD COLUMN {quote(f"{subject} (модуль {module})")} TEXT DEFAULT "не изучает"')
+        for student_id, name, group in dataset.students:
+            grades = dataset.grades(group)
+            columns = ['student_id', 'name', 'student_group'] + [f'{s} (модуль {m})' for s, m in grades]
+            conn.execute(
+                f'INSERT INTO students ({",".join(quote(c) for c in columns)}) VALUES ({",".join("?" * len(columns))})',
+                [student_id, name, group, *grades.values()]
+            )
+        conn.commit()
+
+
+def legacy_save(get_db_connection, student_id, name, grades, subjects, student_group):
+    """Запись оценок как в прежнем save_to_db: PRAGMA table_info и upsert всех колонок"""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        now = datetime.datetime.now()
+        data = {
+            'student_id': student_id,
+            'name': name,
+            'update_date': now.strftime('%Y-%m-%d %H:%M:%S'),
+            'last_parsed_time': now.isoformat(),
+            'notifications': 1,
+            'student_group': student_group
+        }
+        # get_all_subjects_from_db + update_db_structure
+        cursor.execute('PRAGMA table_info(students)')
+        known = {col[1].split(' (модуль')[0] for col in cursor.fetchall()}
+        for subject in subjects:
+            if subject not in known:
+                for module in (1, 2):
+                    cursor.execute(f'ALTER TABLE students ADD COLUMN {quote(f"{subject} (модуль {module})")} TEXT DEFAULT "не изучает"')
+        cursor.execute('PRAGMA table_info(students)')
+        for col in cursor.fetchall():
+            col_name = col[1]
+            if col_name in data or '(модуль' not in col_name:
+                continue
+            subject, module = col_name.split(' (модуль ')
+            data[col_name] = grades.get((subject, int(module[:-1]))) if subject in subjects else 'не изучает'
+        columns = [quote(k) for k in data]
+        cursor.execute(f'''
+            INSERT INTO students ({",".join(columns)}) VALUES ({",".join("?" * len(data))})
+            ON CONFLICT(student_id) DO UPDATE SET {",".join(f"{c}=?" for c in columns)}
+        ''', list(data.values()) * 2)
+        conn.commit()
+
+
+def legacy_student_grades(get_db_connection, student_id):
+    """Чтение как в прежних my_rating/format_ratings_table: SELECT * и разбор имен колонок"""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT * FROM students WHERE student_id=?', (student_id,))
+        row = cursor.fetchone()
+        columns = [desc[0] for desc in cursor.description]
+    result = {}
+    for key, value in zip(columns, row):
+        if '(модуль' in key and value not in ('не изучает', None, 'None'):
+            subject, module = key.split(' (модуль ')
+            result.setdefault(subject, {})[module.replace(')', '')] = value
+    return result
+
+
+def legacy_discipline_grades(get_db_connection, student_group, subject):
+    """Чтение как в прежнем обработчике discipline_: поиск колонок по PRAGMA и выборка группы"""
+    def normalize(s):
+        return re.sub(r'\s+', ' ', s.strip().lower())
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('PRAGMA table_info(students)')
+        names = [col[1] for col in cursor.fetchall()]
+        real = [next(c for c in names if normalize(c) == normalize(f'{subject} (модуль {m})')) for m in (1, 2)]
+        cursor.execute(
+            f'SELECT student_id, name, {quote(real[0])}, {quote(real[1])} FROM students WHERE student_group=? ORDER BY name',
+            (student_group,)
+        )
+        return cursor.fetchall()
+
+
+# --- Замеры ---
+
+def timed(func, *args):
+    started = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - started
+
+
+def report_ops(label, durations):
+    total = sum(durations)
+    print(
+        f'  {label:<28} {len(durations) / total if total else 0:9.0f} оп/с'
+        f'  p50 {percentile(durations, 0.5) * 1000:7.2f} мс  p95 {percentile(durations, 0.95) * 1000:7.2f} мс'
+    )
+
+
+def db_size_mb(get_db_connection):
+    with get_db_connection() as conn:
+        page_size = conn.execute('PRAGMA page_size').fetchone()[0]
+        used = conn.execute('PRAGMA page_count').fetchone()[0] - conn.execute('PRAGMA freelist_count').fetchone()[0]
+    return used * page_size / 1024 / 1024
+
+
+def measure(args, dataset, save, student_grades, discipline_grades):
+    rng = random.Random(args.seed + 1)
+    sample = [rng.choice(dataset.students) for _ in range(args.ops)]
+    report_ops('запись оценок студента', [
+        timed(save, student_id, name, dataset.grades(group), dataset.group_subjects[group], group)
+        for student_id, name, group in sample
+    ])
+    report_ops('оценки студента', [timed(student_grades, student_id) for student_id, _, _ in sample])
+    report_ops('дисциплина группы', [
+        timed(discipline_grades, group, rng.choice(dataset.group_subjects[group]))
+        for _, _, group in sample
+    ])
+
+
+def run(args):
+    # Модули бота читают config.json из текущего каталога при импорте
+    from utils import get_db_connection, logger, save_to_db
+    from schema import init_db
+    import grade_store
+
+    if not args.verbose:
+        logger.setLevel(logging.CRITICAL)
+    dataset = Dataset(args)
+
+    started = time.perf_counter()
+    legacy_create(get_db_connection, dataset)
+    print(f'Старая схема: {len(dataset.students)} студентов, {len(dataset.subjects) * 2} колонок оценок, '
+          f'создана за {time.perf_counter() - started:.1f} с, {db_size_mb(get_db_connection):.1f} МБ')
+    measure(
+        args, dataset,
+        lambda *a: legacy_save(get_db_connection, *a),
+        lambda student_id: legacy_student_grades(get_db_connection, student_id),
+        lambda group, subject: legacy_discipline_grades(get_db_connection, group, subject)
+    )
+
+    init_db()
+    batches = []
+    while True:
+        started = time.perf_counter()
+        count = grade_store.migrate_legacy_batch()
+        if not count:
+            break
+        batches.append(time.perf_counter() - started)
+    drop_seconds = timed(grade_store.drop_legacy_grade_columns)
+    print(
+        f'Перенос: {len(batches)} транзакций за {sum(batches):.1f} с '
+        f'(транзакция p50 {percentile(batches, 0.5) * 1000:.0f} мс, max {max(batches, default=0) * 1000:.0f} мс), '
+        f'удаление старых колонок {drop_seconds:.1f} с'
+    )
+
+    with get_db_connection() as conn:
+        conn.execute('VACUUM')
+    with get_db_connection() as conn:
+        grade_rows = conn.execute('SELECT COUNT(*) FROM grades').fetchone()[0]
+    print(f'Новая схема: {grade_rows} строк grades, {db_size_mb(get_db_connection):.1f} МБ')
+    measure(
+        args, dataset,
+        lambda student_id, name, grades, subjects, group: save_to_db(
+            student_id, name, grades, subjects, student_group=group
+        ),
+        grade_store.load_student_grades,
+        grade_store.load_discipline_grades
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Старая широкая таблица оценок против subjects/grades')
+    parser.add_argument('--students', type=int, default=10000, help='число студентов')
+    parser.add_argument('--subjects', type=int, default=500, help='всего дисциплин')
+    parser.add_argument('--subjects-per-group', type=int, default=40, help='дисциплин у одной группы')
+    parser.add_argument('--group-size', type=int, default=25, help='студентов в группе')
+    parser.add_argument('--ops', type=int, default=300, help='операций каждого вида в замере')
+    parser.add_argument('--batch-size', type=int, default=1000, help='migrations.batch_size (строк оценок за транзакцию переноса)')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--keep', action='store_true', help='не удалять рабочий каталог')
+    parser.add_argument('--verbose', action='store_true', help='выводить лог бота')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='brumarks-bench-')
+    cwd = os.getcwd()
+    try:
+        with open(os.path.join(workdir, 'config.json'), 'w') as f:
+            json.dump({'migrations': {'batch_size': args.batch_size}}, f)
+        os.chdir(workdir)
+        print(f'Рабочий каталог: {workdir}')
+        run(args)
+    finally:
+        os.chdir(cwd)
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,239 @@
+"""
+Задержка event loop во время парсинга: запросы частых обработчиков кнопок через
+repository (DB_EXECUTOR) против прежних запросов прямо в event loop.
+
+Для каждого режима на временной базе заводит --students студентов с расписанием
+групп, ставит всех в очередь оценок и разбирает ее обработчиками
+StudentParserScheduler против заглушки VUZ2 (--change-rate 1: каждая проверка пишет
+оценки). Пока идет парсинг, --rate раз в секунду «нажимается кнопка» случайного
+студента: профиль (как в начале handle_inline_buttons), затем «Мой рейтинг»,
+«Группа», «Дисциплины» с выбором дисциплины или расписание на сегодня/неделю.
+utils.LoopLagMonitor замеряет, насколько позже заданного просыпается event loop;
+для кнопок замеряется время ответа. --worker-processes N дополнительно запускает N
+процессов scrape_worker.py, которые пишут в ту же базу.
+
+    python benchmarks/bench_loop_lag.py --students 500 --workers 8
+    python benchmarks/bench_loop_lag.py --worker-processes 2 --rate 200
+
+Режим inline подменяет run_db в utils и repository вызовом функции прямо в event loop
+(так обработчики работали с базой раньше). Каждый режим выполняется в отдельном
+процессе и рабочем каталоге (config.json, students.db) во временной папке; --keep
+оставляет их для просмотра.
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import asyncio
+import logging
+import argparse
+import tempfile
+import datetime
+import subprocess
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+
+from vuz2_stub import add_stub_arguments, stub_from_args  # noqa: E402
+from bench_db_latency import FIRST_TELEGRAM_ID, percentile, seed_students, make_all_due  # noqa: E402
+
+MODES = ('inline', 'executor')
+GROUPS = 20
+BUTTONS = ('my_rating', 'group', 'disciplines', 'schedule_today', 'schedule_week')
+
+
+def prepare_workdir(workdir, args, base_url):
+    bench_config = {
+        'vuz2': {
+            'base_url': base_url,
+            'requests_per_second': 0,
+            'max_in_flight': max(8, args.workers * 2),
+            'max_connections': max(8, args.workers * 2)
+        },
+        'scheduler': {'parser_workers': args.bot_workers, 'portfolio_workers': 0},
+        'job_queue': {'poll_seconds': 0.1},
+        'database': {'executor_workers': args.db_workers}
+    }
+    with open(os.path.join(workdir, 'config.json'), 'w') as f:
+        json.dump(bench_config, f)
+    os.chdir(workdir)
+
+
+def seed_schedule(get_db_connection):
+    """Таблица raspisanie с парами на каждый день для всех групп бенчмарка"""
+    lesson = json.dumps({'discipline': 'Физика', 'auditory': '101', 'lector_name': 'Иванов И. И.'})
+    columns = [f'{day}_{n}' for day in ('monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday') for n in range(1, 6)]
+    with get_db_connection() as conn:
+        conn.executemany(
+            f'INSERT OR REPLACE INTO raspisanie (group_full_name, {", ".join(columns)}) '
+            f'VALUES (?, {", ".join("?" * len(columns))})',
+            [
+                (f'ПИ-{g}_sub1_{week_type}', *([lesson] * len(columns)))
+                for g in range(GROUPS) for week_type in ('UP', 'DOWN')
+            ]
+        )
+        conn.commit()
+
+
+async def _inline(func, *args, **kwargs):
+    return func(*args, **kwargs)
+
+
+async def press_button(button, student_index, rng):
+    """Запросы и форматирование обработчика кнопки, без отправки сообщений в Telegram"""
+    import repository
+    from utils import format_ratings_table
+
+    telegram_id = str(FIRST_TELEGRAM_ID + student_index)
+    profile = await repository.get_profile(telegram_id, touch_activity=True)
+    if not profile:
+        raise RuntimeError('студент не найден')
+    student_id, student_group, _, _ = profile
+    if button == 'my_rating':
+        await repository.get_student_rating(student_id)
+    elif button == 'group':
+        await repository.get_group_students(student_group)
+    elif button == 'disciplines':
+        disciplines = await repository.get_student_subjects(student_id)
+        if disciplines:
+            discipline = rng.choice(disciplines)
+            group_data, _ = await repository.get_discipline_view(student_group, discipline)
+            format_ratings_table(discipline, group_data, is_group=True)
+    elif button == 'schedule_today':
+        await repository.get_schedule(telegram_id, datetime.datetime.now().strftime('%A').lower())
+    else:
+        await repository.get_schedule(telegram_id)
+
+
+async def run_mode(args, mode):
+    # Модули бота читают config.json из текущего каталога при импорте
+    import utils
+    import repository
+    from utils import get_db_connection, logger, LoopLagMonitor
+    from schema import init_db
+    import scheduler as scheduler_module
+    from scraper import vuz2_client
+    from job_queue import scrape_jobs, GRADES_JOB
+
+    if not args.verbose:
+        logger.setLevel(logging.CRITICAL)
+    if mode == 'inline':
+        utils.run_db = repository.run_db = _inline
+    init_db()
+    seed_students(get_db_connection, args.students)
+    seed_schedule(get_db_connection)
+    parser = scheduler_module.StudentParserScheduler(application=None)
+    parser._seed_scrape_state()
+    make_all_due(get_db_connection)
+
+    processes = [
+        subprocess.Popen(
+            [sys.executable, os.path.join(REPO_DIR, 'scrape_worker.py'),
+             '--workers', str(args.workers), '--portfolio-workers', '0'],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        for _ in range(args.worker_processes)
+    ]
+    latencies, errors = [], []
+    rng = random.Random(args.seed)
+
+    async def press():
+        button = rng.choice(BUTTONS)
+        started = time.perf_counter()
+        try:
+            await press_button(button, rng.randrange(args.students), rng)
+            latencies.append(time.perf_counter() - started)
+        except Exception as e:
+            errors.append(f'{button}: {e}')
+
+    parser.is_running = True
+    parser.result_writer.start()
+    monitor = LoopLagMonitor(args.lag_interval)
+    monitor_task = asyncio.create_task(monitor.run(lambda: parser.is_running))
+    workers = [asyncio.create_task(parser._parser_worker(n, GRADES_JOB)) for n in range(args.bot_workers)]
+    presses = []
+    started = time.perf_counter()
+    try:
+        parser._enqueue_due_students(args.students, GRADES_JOB)
+        while True:
+            counts = scrape_jobs.counts()
+            if not counts.get('pending') and not counts.get('running'):
+                break
+            presses.append(asyncio.create_task(press()))
+            await asyncio.sleep(1 / args.rate)
+        elapsed = time.perf_counter() - started
+        await asyncio.gather(*presses)
+    finally:
+        parser.is_running = False
+        for task in workers + [monitor_task]:
+            task.cancel()
+        await asyncio.gather(*workers, monitor_task, return_exceptions=True)
+        await parser.result_writer.stop()
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
+        await vuz2_client.close()
+
+    lag = monitor.take()
+    print(
+        f'{mode:<8} парсинг {args.students / elapsed:6.1f} студ/с за {elapsed:5.1f} с | '
+        f'задержка loop: p50 {lag["p50"] * 1000:5.1f} мс, p99 {lag["p99"] * 1000:6.1f} мс, '
+        f'max {lag["max"] * 1000:6.1f} мс | кнопки: {len(latencies)}, '
+        f'p50 {percentile(latencies, 0.5) * 1000:6.1f} мс, p95 {percentile(latencies, 0.95) * 1000:6.1f} мс, '
+        f'p99 {percentile(latencies, 0.99) * 1000:6.1f} мс | ошибок {len(errors)}'
+        + (f' ({errors[0]})' if errors else '')
+    )
+
+
+def run_in_workdir(args, mode):
+    stub = stub_from_args(args).start()
+    workdir = tempfile.mkdtemp(prefix=f'brumarks-bench-{mode}-')
+    cwd = os.getcwd()
+    try:
+        prepare_workdir(workdir, args, stub.base_url)
+        asyncio.run(run_mode(args, mode))
+    finally:
+        stub.stop()
+        os.chdir(cwd)
+        if args.keep:
+            print(f'  рабочий каталог: {workdir}')
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Задержка event loop: запросы обработчиков в DB_EXECUTOR и в самом loop')
+    parser.add_argument('--students', type=int, default=500, help='число студентов')
+    parser.add_argument('--workers', type=int, default=8, help='обработчиков оценок в каждом процессе scrape_worker.py')
+    parser.add_argument('--bot-workers', type=int, help='обработчиков оценок в процессе бота (по умолчанию --workers)')
+    parser.add_argument('--worker-processes', type=int, default=0, help='дополнительных процессов scrape_worker.py')
+    parser.add_argument('--rate', type=float, default=100, help='нажатий кнопок в секунду')
+    parser.add_argument('--db-workers', type=int, default=4, help='database.executor_workers')
+    parser.add_argument('--lag-interval', type=float, default=0.01, help='период замера задержки loop, с')
+    parser.add_argument('--modes', default=','.join(MODES), help='режимы через запятую: ' + ', '.join(MODES))
+    parser.add_argument('--mode', help=argparse.SUPPRESS)
+    parser.add_argument('--keep', action='store_true', help='не удалять рабочие каталоги')
+    parser.add_argument('--verbose', action='store_true', help='выводить лог бота')
+    add_stub_arguments(parser)
+    parser.set_defaults(change_rate=1.0)
+    args = parser.parse_args()
+    if args.bot_workers is None:
+        args.bot_workers = args.workers
+    if args.corpus:
+        args.corpus = os.path.abspath(args.corpus)
+
+    if args.mode:
+        run_in_workdir(args, args.mode)
+        return
+    # Модули бота читают настройки при импорте, поэтому каждый режим - в своем процессе
+    for mode in args.modes.split(','):
+        subprocess.run([sys.executable, os.path.abspath(__file__), *sys.argv[1:], '--mode', mode], check=True)
+
+
+if __name__ == '__main__':
+    main()
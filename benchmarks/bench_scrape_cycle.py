@@ -0,0 +1,250 @@
+"""
+Полный цикл парсинга StudentParserScheduler против локальной заглушки VUZ2
+(vuz2_stub.py) на временной базе.
+
+Заводит --students студентов, делает --cycles проходов по всем (первый - с
+разбором и скачиванием курсовых работ, следующие - в основном пропуск по
+неизменному хешу страниц) и для каждого прохода печатает студентов в секунду,
+p50/p95 времени обработки одного студента, запись в базу (ResultWriter: время,
+транзакций и строк в секунду) и число запросов к VUZ2. Оценки проверяются в каждом проходе, портфолио - в каждом
+--portfolio-every проходе (как при разных интервалах проверки оценок и портфолио).
+
+    python benchmarks/bench_scrape_cycle.py --students 300 --workers 4 --latency 0.05
+    python benchmarks/bench_scrape_cycle.py --error-rate 0.1 --not-found-rate 0.05 --change-rate 0.2
+    python benchmarks/bench_scrape_cycle.py --cycles 4 --portfolio-every 4
+    python benchmarks/bench_scrape_cycle.py --batch-size 1   # по транзакции на студента, как до ResultWriter
+
+Рабочий каталог (config.json, students.db, course_works/) создается во временной
+папке; --keep оставляет его для просмотра.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import asyncio
+import logging
+import argparse
+import tempfile
+import datetime
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+
+from vuz2_stub import add_stub_arguments, stub_from_args  # noqa: E402
+
+FIRST_STUDENT_ID = 10000000
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def prepare_workdir(workdir, args, base_url):
+    """config.json для модулей бота: VUZ2 - заглушка, обработчики и лимиты - из аргументов"""
+    bench_config = {
+        'vuz2': {
+            'base_url': base_url,
+            'requests_per_second': args.rps,
+            'burst': max(1, args.workers),
+            'max_in_flight': args.max_in_flight,
+            'max_connections': max(args.max_in_flight, 1),
+            'breaker_open_seconds': args.breaker_open_seconds
+        },
+        'scheduler': {'parser_workers': args.workers, 'portfolio_workers': args.portfolio_workers},
+        # Короткие паузы, чтобы повторные попытки успели пройти в рамках прохода
+        'job_queue': {
+            'retry_base_seconds': 0.5,
+            'retry_max_seconds': 2,
+            'poll_seconds': 0.2,
+            'defer_jitter_seconds': 1
+        },
+        'result_writer': {'batch_size': args.batch_size, 'flush_interval_seconds': args.flush_interval}
+    }
+    with open(os.path.join(workdir, 'config.json'), 'w') as f:
+        json.dump(bench_config, f)
+    os.chdir(workdir)
+
+
+class CycleProbe:
+    """
+    Замеры времени обработки студентов внутри StudentParserScheduler.
+    _schedule_next_parse (_schedule_next_portfolio) вызывается один раз на задачу оценок
+    (портфолио), когда ResultWriter записал ее окончательный результат.
+    Запись в базу замеряет сам ResultWriter (take_stats).
+    """
+
+    def __init__(self, scheduler_module, parser):
+        self.parser = parser
+        self.started = {}
+        self.latencies = []
+        self.processed = 0
+
+        def timed_fetch(kind, original_fetch):
+            async def fetch(student_id):
+                # Время задачи считается от первой попытки до записи окончательного результата
+                self.started.setdefault((kind, student_id), time.perf_counter())
+                return await original_fetch(student_id)
+            return fetch
+
+        scheduler_module.fetch_rating_page = timed_fetch('grades', scheduler_module.fetch_rating_page)
+        scheduler_module.fetch_portfolio_page = timed_fetch('portfolio', scheduler_module.fetch_portfolio_page)
+
+        def timed_finish(kind, schedule_next):
+            def finish(student_id, *a, **kw):
+                result = schedule_next(student_id, *a, **kw)
+                started = self.started.pop((kind, student_id), None)
+                if started is not None:
+                    self.latencies.append(time.perf_counter() - started)
+                self.processed += 1
+                return result
+            return finish
+
+        parser._schedule_next_parse = timed_finish('grades', parser._schedule_next_parse)
+        parser._schedule_next_portfolio = timed_finish('portfolio', parser._schedule_next_portfolio)
+
+    def reset(self):
+        self.started.clear()
+        self.latencies = []
+        self.processed = 0
+        self.parser.result_writer.take_stats()
+
+
+def seed_students(get_db_connection, count):
+    with get_db_connection() as conn:
+        conn.executemany(
+            'INSERT OR IGNORE INTO students (student_id, telegram_id, student_group) VALUES (?, ?, ?)',
+            [(str(FIRST_STUDENT_ID + i), 'added by admin', f'ПИ-{i % 10}') for i in range(count)]
+        )
+        conn.commit()
+
+
+def make_all_due(get_db_connection, with_portfolio):
+    now = datetime.datetime.now().isoformat()
+    with get_db_connection() as conn:
+        conn.execute('UPDATE scrape_state SET next_parse_at=?', (now,))
+        # Портфолио вне очереди прохода откладываем, чтобы его задачи не попали в замер
+        portfolio_next_at = now if with_portfolio else (datetime.datetime.now() + datetime.timedelta(days=1)).isoformat()
+        conn.execute('UPDATE scrape_state SET portfolio_next_at=?', (portfolio_next_at,))
+        conn.commit()
+
+
+async def run_cycle(parser, probe, get_db_connection, student_count, worker_counts, with_portfolio):
+    """
+    Один проход: все студенты становятся «к проверке» оценок (и портфолио, если with_portfolio),
+    ставятся в очередь задач, и обработчики разбирают ее до окончательного результата по каждой задаче.
+    """
+    from job_queue import GRADES_JOB, PORTFOLIO_JOB
+
+    make_all_due(get_db_connection, with_portfolio)
+    probe.reset()
+    parser.cycle_stats = parser._new_cycle_stats()
+    parser.is_running = True
+    kinds = [GRADES_JOB, PORTFOLIO_JOB] if with_portfolio else [GRADES_JOB]
+    workers = [
+        asyncio.create_task(parser._parser_worker(n, kind))
+        for kind in kinds for n in range(worker_counts[kind])
+    ]
+    started = time.perf_counter()
+    try:
+        for kind in kinds:
+            parser._enqueue_due_students(student_count, kind)
+        while probe.processed < student_count * len(kinds):
+            await asyncio.sleep(0.01)
+        elapsed = time.perf_counter() - started
+        writes = parser.result_writer.take_stats()
+    finally:
+        parser.is_running = False
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+    return elapsed, writes
+
+
+def report(cycle, elapsed, probe, writes, stats, student_count, requests):
+    latencies = probe.latencies
+    print(
+        f'Проход {cycle}: {student_count / elapsed:8.1f} студ/с за {elapsed:.2f} с | '
+        f'p50 {percentile(latencies, 0.5) * 1000:.0f} мс, p95 {percentile(latencies, 0.95) * 1000:.0f} мс | '
+        f'запись в базу {writes["write_seconds"]:.2f} с: {writes["commits"]} транзакций, '
+        f'{writes["commits"] / elapsed:.1f} commit/с, {writes["rows"] / elapsed:.0f} строк/с | '
+        f'полных {stats["full"]}, без изменений {stats["skipped"]}, ошибок {stats["failed"]}, отложено {stats["deferred"]} | '
+        f'портфолио: обновлено {stats["portfolio_full"]}, без изменений {stats["portfolio_skipped"]} | '
+        f'запросов к VUZ2: рейтинг {requests["rating"]}, портфолио {requests["portfolio"]}, файлы {requests["file"]}'
+    )
+
+
+async def run(args, student_count, stub):
+    # Модули бота читают config.json из текущего каталога при импорте
+    from utils import get_db_connection, logger
+    from schema import init_db
+    import scheduler as scheduler_module
+    from scraper import vuz2_client
+
+    if not args.verbose:
+        logger.setLevel(logging.CRITICAL)
+    init_db()
+    seed_students(get_db_connection, student_count)
+    parser = scheduler_module.StudentParserScheduler(application=None)
+    parser._seed_scrape_state()
+    probe = CycleProbe(scheduler_module, parser)
+    worker_counts = {
+        'grades': scheduler_module.SCHEDULER_SETTINGS['parser_workers'],
+        'portfolio': scheduler_module.SCHEDULER_SETTINGS['portfolio_workers']
+    }
+    parser.result_writer.start()
+    try:
+        for cycle in range(1, args.cycles + 1):
+            requests_before = dict(stub.stats)
+            with_portfolio = (cycle - 1) % max(1, args.portfolio_every) == 0
+            elapsed, writes = await run_cycle(
+                parser, probe, get_db_connection, student_count, worker_counts, with_portfolio
+            )
+            requests = {key: stub.stats[key] - requests_before[key] for key in requests_before}
+            report(cycle, elapsed, probe, writes, parser.cycle_stats, student_count, requests)
+    finally:
+        await parser.result_writer.stop()
+        await vuz2_client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Цикл парсинга против локальной заглушки VUZ2')
+    parser.add_argument('--students', type=int, default=200, help='число студентов')
+    parser.add_argument('--cycles', type=int, default=2, help='число проходов по всем студентам')
+    parser.add_argument('--workers', type=int, default=4, help='обработчиков оценок (scheduler.parser_workers)')
+    parser.add_argument('--portfolio-workers', type=int, default=2, help='обработчиков портфолио (scheduler.portfolio_workers)')
+    parser.add_argument('--portfolio-every', type=int, default=1, help='портфолио проверяется в каждом N-м проходе')
+    parser.add_argument('--rps', type=float, default=0, help='vuz2.requests_per_second (0 - без ограничения)')
+    parser.add_argument('--max-in-flight', type=int, default=8, help='vuz2.max_in_flight')
+    parser.add_argument('--breaker-open-seconds', type=float, default=5.0, help='vuz2.breaker_open_seconds')
+    parser.add_argument('--batch-size', type=int, default=100, help='result_writer.batch_size (1 - транзакция на студента)')
+    parser.add_argument('--flush-interval', type=float, default=0.5, help='result_writer.flush_interval_seconds')
+    parser.add_argument('--keep', action='store_true', help='не удалять рабочий каталог')
+    parser.add_argument('--verbose', action='store_true', help='выводить лог бота (по умолчанию скрыт, ошибки видны в итогах прохода)')
+    add_stub_arguments(parser)
+    args = parser.parse_args()
+    if args.corpus:
+        args.corpus = os.path.abspath(args.corpus)
+
+    stub = stub_from_args(args).start()
+    workdir = tempfile.mkdtemp(prefix='brumarks-bench-')
+    cwd = os.getcwd()
+    try:
+        prepare_workdir(workdir, args, stub.base_url)
+        print(f'Заглушка VUZ2: {stub.base_url}, рабочий каталог: {workdir}')
+        asyncio.run(run(args, args.students, stub))
+        print(f'Запросов к заглушке: {stub.stats}')
+    finally:
+        stub.stop()
+        os.chdir(cwd)
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
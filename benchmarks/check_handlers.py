@@ -0,0 +1,131 @@
+"""
+Проверка inline-кнопок: handle_inline_buttons вызывается на временной базе, созданной
+schema.init_db, с тестовым студентом, его оценками и курсовой работой. Каждая кнопка
+должна ответить ожидаемым сообщением, а не сообщением об ошибке (обработчики ловят
+исключения, пишут их в лог и отвечают «Произошла ошибка...»).
+
+    python benchmarks/check_handlers.py
+
+Код возврата 1, если хотя бы одна кнопка ответила не так. Telegram не нужен: update,
+callback_query и message заменены простыми объектами, которые запоминают ответы.
+"""
+import os
+import sys
+import json
+import shutil
+import asyncio
+import tempfile
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+
+TELEGRAM_ID = 501
+STUDENT_ID = '10000001'
+GROUP = 'ПИ-231'
+
+# (callback_data, текст, который должен быть в ответе). Кнопки нажимаются по порядку с общим
+# context.user_data: disciplines заполняет discipline_map, по которому работают следующие.
+CHECKS = (
+    ('my_rating', 'Матан'),
+    ('disciplines', 'Ваши дисциплины'),
+    ('discipline_d0', 'Матан'),
+    ('courseworks_d0', 'Курсовые работы по дисциплине Матан'),
+    ('group', 'Студенты вашей группы'),
+    ('student_' + STUDENT_ID, 'Матан'),
+)
+
+ERROR_MARKERS = ('ошибка', 'не найден', 'не зарегистрированы')
+
+
+class Message:
+    chat_id = TELEGRAM_ID
+    message_id = 1
+
+    def __init__(self, replies):
+        self.replies = replies
+
+    async def reply_text(self, text, **kwargs):
+        self.replies.append(text)
+        return self
+
+    async def edit_text(self, text, **kwargs):
+        self.replies.append(text)
+        return self
+
+    async def edit_reply_markup(self, **kwargs):
+        pass
+
+
+class CallbackQuery:
+    def __init__(self, data, replies):
+        self.data = data
+        self.message = Message(replies)
+
+    async def answer(self):
+        pass
+
+
+class User:
+    id = TELEGRAM_ID
+
+
+class Update:
+    effective_user = User()
+
+    def __init__(self, data, replies):
+        self.callback_query = CallbackQuery(data, replies)
+
+
+class Context:
+    def __init__(self):
+        self.user_data = {}
+
+
+def seed():
+    from utils import save_to_db, save_course_work_to_db
+    save_to_db(
+        STUDENT_ID, 'Иванов', {('Матан', 1): 5, ('Физика', 2): 4}, ['Матан', 'Физика'],
+        telegram_id=str(TELEGRAM_ID), student_group=GROUP
+    )
+    save_course_work_to_db(STUDENT_ID, 'Иванов', str(TELEGRAM_ID), GROUP, 'Матан', 'course_works/x.pdf', 1)
+
+
+async def check():
+    from handlers import handle_inline_buttons
+    context = Context()
+    failed = 0
+    for data, expected in CHECKS:
+        replies = []
+        await handle_inline_buttons(Update(data, replies), context)
+        text = ' | '.join(replies)
+        ok = any(expected in reply for reply in replies) and not any(
+            marker in reply.lower() for reply in replies for marker in ERROR_MARKERS
+        )
+        if not ok:
+            failed += 1
+        print(f"{'ok  ' if ok else 'FAIL'} {data}: {text[:200]!r}")
+    return failed
+
+
+def main():
+    workdir = tempfile.mkdtemp(prefix='brumarks-handlers-')
+    cwd = os.getcwd()
+    try:
+        with open(os.path.join(workdir, 'config.json'), 'w') as f:
+            json.dump({'telegram_token': '0:check'}, f)
+        os.chdir(workdir)
+        # Модули бота читают config.json из текущего каталога при импорте
+        from schema import init_db
+        init_db()
+        seed()
+        failed = asyncio.run(check())
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+    print(f'Кнопок с ошибкой: {failed}' if failed else 'Все кнопки отвечают')
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+"""
+Проверка планов частых запросов: EXPLAIN QUERY PLAN на базе, созданной schema.init_db,
+должен искать по индексу (SEARCH ... USING INDEX / PRIMARY KEY), а не просматривать
+таблицу целиком (SCAN) и не сортировать результат во временном B-дереве.
+
+    python benchmarks/check_query_plans.py
+
+Код возврата 1, если хотя бы один запрос выполняется без индекса. Запросы повторяют
+запросы обработчиков и планировщика; при изменении запросов или индексов (schema.INDEXES)
+обновите список HOT_QUERIES.
+"""
+import os
+import sys
+import json
+import shutil
+import tempfile
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+
+# (описание, запрос, параметры)
+HOT_QUERIES = (
+    (
+        'регистрация по telegram_id (check_registration, каждое нажатие кнопки)',
+        'SELECT student_id, student_group, is_admin FROM students WHERE telegram_id=?',
+        ('1',)
+    ),
+    (
+        'группа по telegram_id (handle_inline_buttons)',
+        'SELECT student_group FROM students WHERE telegram_id=?',
+        ('1',)
+    ),
+    (
+        'список студентов группы',
+        'SELECT student_id, name FROM students WHERE student_group=? ORDER BY name',
+        ('ПИ-231',)
+    ),
+    (
+        'оценки студента (grade_store.load_student_grades)',
+        '''SELECT s.name, g.module, g.value
+           FROM grades g JOIN subjects s ON s.id = g.subject_id
+           WHERE g.student_id = ?''',
+        ('10000000',)
+    ),
+    (
+        'оценки группы по дисциплине (grade_store.load_discipline_grades)',
+        '''SELECT g.student_id, g.module, g.value
+           FROM grades g JOIN students st ON st.student_id = g.student_id
+           WHERE st.student_group = ? AND g.subject_id = (SELECT id FROM subjects WHERE name = ?)''',
+        ('ПИ-231', 'Физика')
+    ),
+    (
+        'курсовая работа студента (save_course_work_to_db)',
+        'SELECT 1 FROM course_works WHERE student_id = ? AND discipline = ? AND semester = ?',
+        ('10000000', 'Физика', 1)
+    ),
+    (
+        'курсовые работы студента (scraper.load_course_works)',
+        'SELECT discipline, semester, file_path FROM course_works WHERE student_id = ?',
+        ('10000000',)
+    ),
+    (
+        'есть ли курсовые по дисциплине (repository.get_discipline_view)',
+        'SELECT 1 FROM course_works WHERE discipline_key=? LIMIT 1',
+        ('физика',)
+    ),
+    (
+        'курсовые работы по дисциплине (repository.get_discipline_course_works, архив)',
+        '''SELECT cw.name, cw.discipline, cw.file_path, cw.semester, cw.student_group, f.original_name
+           FROM course_works cw
+           LEFT JOIN course_work_files f
+               ON f.student_id = cw.student_id AND f.discipline = cw.discipline AND f.semester = cw.semester
+           WHERE cw.discipline_key=?''',
+        ('физика',)
+    ),
+    (
+        'последнее изменение курсовых по дисциплине (архив)',
+        'SELECT MAX(parsing_time) FROM course_works WHERE discipline_key=?',
+        ('физика',)
+    ),
+    (
+        'неотправленные изменения оценок (grade_events.queue_event_notifications, каждая пачка записи)',
+        '''SELECT e.id, e.student_id, e.kind, sub.name, e.module, e.old_value, e.new_value, st.name, st.telegram_id
+           FROM grade_events e
+           LEFT JOIN subjects sub ON sub.id = e.subject_id
+           LEFT JOIN students st ON st.student_id = e.student_id
+           WHERE e.notified_at IS NULL
+           ORDER BY e.id''',
+        ()
+    ),
+)
+
+
+def plan_problems(conn, sql, params):
+    """Returns: (строки плана, строки без индекса)"""
+    plan = [row[3] for row in conn.execute(f'EXPLAIN QUERY PLAN {sql}', params)]
+    problems = [line for line in plan if line.startswith('SCAN ') or 'TEMP B-TREE' in line]
+    return plan, problems
+
+
+def check(get_db_connection):
+    failed = 0
+    with get_db_connection() as conn:
+        for description, sql, params in HOT_QUERIES:
+            plan, problems = plan_problems(conn, sql, params)
+            if problems:
+                failed += 1
+                print(f'FAIL {description}')
+            else:
+                print(f'ok   {description}')
+            for line in plan:
+                print(f'       {line}')
+    return failed
+
+
+def main():
+    workdir = tempfile.mkdtemp(prefix='brumarks-plans-')
+    cwd = os.getcwd()
+    try:
+        with open(os.path.join(workdir, 'config.json'), 'w') as f:
+            json.dump({}, f)
+        os.chdir(workdir)
+        # Модули бота читают config.json из текущего каталога при импорте
+        from utils import get_db_connection
+        from schema import init_db
+        init_db()
+        failed = check(get_db_connection)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+    print(f'Запросов без индекса: {failed}' if failed else 'Все запросы используют индексы')
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
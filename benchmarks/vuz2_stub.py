@@ -0,0 +1,205 @@
+"""
+Локальная замена VUZ2 для бенчмарков и ручной проверки парсинга без обращения
+к vuz2.bru.by.
+
+Отдает страницы /rate/<id>/ и /rate/<id>/portfolio/1/ и файлы курсовых работ
+/files/<имя>. Страницы берутся из каталога с сохраненными страницами (формат
+тот же, что у bench_extractor.py: <id>.rate.html и <id>.portfolio.html), для
+остальных номеров генерируются синтетические страницы, одинаковые при
+повторных запросах.
+
+    python benchmarks/vuz2_stub.py --port 8765 --latency 0.2 --error-rate 0.05
+
+и base_url "http://127.0.0.1:8765" в секции "vuz2" config.json.
+"""
+import os
+import sys
+import time
+import random
+import hashlib
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_extractor import make_rating_page, make_portfolio_page  # noqa: E402
+
+
+class Vuz2Stub:
+    """
+    HTTP-сервер, изображающий VUZ2.
+    latency, latency_jitter - задержка ответа в секундах (равномерно в latency ± latency_jitter);
+    error_rate - доля запросов, на которые отвечается 503;
+    not_found_rate - доля номеров, для которых отдается страница «Студент не найден»;
+    change_rate - вероятность, что при очередном запросе рейтинга оценки студента изменятся;
+    file_size - размер синтетических файлов курсовых работ в байтах.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, corpus=None, latency=0.0, latency_jitter=0.0,
+                 error_rate=0.0, not_found_rate=0.0, change_rate=0.0, file_size=32 * 1024, seed=1):
+        self.corpus = corpus
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.error_rate = error_rate
+        self.not_found_rate = not_found_rate
+        self.change_rate = change_rate
+        self.file_size = file_size
+        self.seed = seed
+        self.stats = {'rating': 0, 'portfolio': 0, 'file': 0, 'errors': 0, 'not_found': 0}
+        self._versions = {}
+        self._lock = threading.Lock()
+        self._rng = random.Random(seed)
+        self._server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        """Запускает сервер в фоновом потоке"""
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    # --- страницы ---
+
+    def _random(self):
+        with self._lock:
+            return self._rng.random()
+
+    def _count(self, key):
+        with self._lock:
+            self.stats[key] += 1
+
+    def _student_rng(self, student_id, salt):
+        digest = hashlib.sha256(f'{self.seed}:{salt}:{student_id}'.encode()).digest()
+        return random.Random(int.from_bytes(digest[:8], 'big'))
+
+    def _is_not_found(self, student_id):
+        return self._student_rng(student_id, 'not_found').random() < self.not_found_rate
+
+    def _read_corpus(self, student_id, kind):
+        if not self.corpus:
+            return None
+        path = os.path.join(self.corpus, f'{student_id}.{kind}.html')
+        if not os.path.exists(path):
+            return None
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def rating_page(self, student_id):
+        recorded = self._read_corpus(student_id, 'rate')
+        if recorded is not None:
+            return recorded
+        if self._is_not_found(student_id):
+            self._count('not_found')
+            return make_rating_page(self._student_rng(student_id, 'rate'), 'not_found')
+        with self._lock:
+            version = self._versions.get(student_id, 0)
+            if self.change_rate and self._rng.random() < self.change_rate:
+                version += 1
+                self._versions[student_id] = version
+        return make_rating_page(self._student_rng(student_id, f'rate:{version}'), 'normal')
+
+    def portfolio_page(self, student_id):
+        recorded = self._read_corpus(student_id, 'portfolio')
+        if recorded is not None:
+            return recorded
+        return make_portfolio_page(self._student_rng(student_id, 'portfolio'), 'normal')
+
+    def file_content(self, name):
+        block = hashlib.sha256(name.encode()).digest()
+        return (block * (self.file_size // len(block) + 1))[:self.file_size]
+
+    def _make_handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send(self, status, body, content_type='text/html; charset=utf-8'):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                delay = stub.latency + random.uniform(-stub.latency_jitter, stub.latency_jitter)
+                if delay > 0:
+                    time.sleep(delay)
+                if stub.error_rate and stub._random() < stub.error_rate:
+                    stub._count('errors')
+                    self._send(503, b'Service Unavailable', 'text/plain')
+                    return
+
+                parts = [part for part in self.path.split('?', 1)[0].split('/') if part]
+                if len(parts) == 2 and parts[0] == 'rate':
+                    stub._count('rating')
+                    self._send(200, stub.rating_page(parts[1]))
+                elif len(parts) == 4 and parts[0] == 'rate' and parts[2] == 'portfolio':
+                    stub._count('portfolio')
+                    self._send(200, stub.portfolio_page(parts[1]))
+                elif len(parts) == 2 and parts[0] == 'files':
+                    stub._count('file')
+                    self._send(200, stub.file_content(parts[1]), 'application/octet-stream')
+                else:
+                    self._send(404, b'Not Found', 'text/plain')
+
+        return Handler
+
+
+def add_stub_arguments(parser):
+    """Параметры заглушки, общие для этого скрипта и bench_scrape_cycle.py"""
+    parser.add_argument('--corpus', help='каталог с сохраненными страницами (<id>.rate.html, <id>.portfolio.html)')
+    parser.add_argument('--latency', type=float, default=0.0, help='задержка ответа, с')
+    parser.add_argument('--latency-jitter', type=float, default=0.0, help='разброс задержки, с')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='доля ответов 503')
+    parser.add_argument('--not-found-rate', type=float, default=0.0, help='доля несуществующих студентов')
+    parser.add_argument('--change-rate', type=float, default=0.0, help='вероятность изменения оценок при запросе')
+    parser.add_argument('--file-size', type=int, default=32 * 1024, help='размер файлов курсовых работ, байт')
+    parser.add_argument('--seed', type=int, default=1)
+
+
+def stub_from_args(args, host='127.0.0.1', port=0):
+    return Vuz2Stub(
+        host=host, port=port, corpus=args.corpus, latency=args.latency,
+        latency_jitter=args.latency_jitter, error_rate=args.error_rate,
+        not_found_rate=args.not_found_rate, change_rate=args.change_rate,
+        file_size=args.file_size, seed=args.seed
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Локальная замена VUZ2')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    add_stub_arguments(parser)
+    args = parser.parse_args()
+
+    stub = stub_from_args(args, host=args.host, port=args.port)
+    print(f'Заглушка VUZ2: {stub.base_url}')
+    try:
+        stub.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(f'Запросов: {stub.stats}')
+
+
+if __name__ == '__main__':
+    main()
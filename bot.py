@@ -2,7 +2,7 @@ from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQu
 from telegram import Update
 from telegram.error import NetworkError, TimedOut
 from utils import (
-    logger, config, get_db_connection, require_registration, REPLY_KEYBOARD_MARKUP,
+    logger, config, require_registration, REPLY_KEYBOARD_MARKUP,
     INLINE_KEYBOARD_MARKUP, format_ratings_table, show_student_rating, handle_telegram_timeout,
     send_notification_to_users
 )
@@ -11,6 +11,10 @@ from handlers import (
     settings_menu, handle_settings_callback
 )
 from scheduler import StudentParserScheduler
+from background_jobs import registration_jobs
+from scraper import vuz2_client, cleanup_partial_downloads
+from course_work_store import migrate_legacy_files
+from schema import init_db
 import asyncio
 import signal
 import traceback
@@ -78,86 +82,10 @@ async def menu_command(update, context):
 async def handle_start_button(update, context):
     await start_command(update, context)  # Повторно используем логику /start
 
-def init_db():
-    with get_db_connection() as conn:
-        cursor = conn.cursor()
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS students (
-                student_id TEXT PRIMARY KEY,
-                name TEXT,
-                update_date TEXT,
-                telegram_id TEXT,
-                student_group TEXT,
-                is_admin INTEGER DEFAULT 0,
-                backup_telegram_ids TEXT DEFAULT '[]',
-                last_parsed_time TEXT,
-                is_superadmin INTEGER DEFAULT 0,
-                notifications INTEGER DEFAULT 1,
-                subgroup INTEGER DEFAULT 1
-            )
-        ''')
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS course_works (
-                discipline TEXT,
-                student_id TEXT,
-                telegram_id TEXT,
-                name TEXT,
-                student_group TEXT,
-                semester INTEGER,
-                file_path TEXT,
-                parsing_time TEXT
-            )
-        ''')
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS course_work_archives (
-                discipline TEXT PRIMARY KEY,
-                archive_parts TEXT DEFAULT '[]',
-                last_updated TEXT NOT NULL,
-                file_count INTEGER DEFAULT 0,
-                total_size INTEGER DEFAULT 0
-            )
-        ''')
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS disciplines (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                group_name TEXT NOT NULL,
-                disc_1 TEXT,
-                disc_2 TEXT,
-                disc_3 TEXT,
-                disc_4 TEXT,
-                disc_5 TEXT,
-                disc_6 TEXT,
-                disc_7 TEXT,
-                disc_8 TEXT,
-                disc_9 TEXT,
-                disc_10 TEXT,
-                disc_11 TEXT,
-                disc_12 TEXT,
-                disc_13 TEXT,
-                disc_14 TEXT,
-                disc_15 TEXT,
-                disc_16 TEXT,
-                disc_17 TEXT,
-                disc_18 TEXT,
-                disc_19 TEXT,
-                disc_20 TEXT,
-                disc_21 TEXT,
-                disc_22 TEXT,
-                disc_23 TEXT,
-                disc_24 TEXT,
-                disc_25 TEXT,
-                disc_26 TEXT,
-                disc_27 TEXT,
-                disc_28 TEXT,
-                disc_29 TEXT,
-                disc_30 TEXT,
-                UNIQUE(group_name)
-            )
-        ''')
-        conn.commit()
-
 # Initialize database
 init_db()
+cleanup_partial_downloads()
+migrate_legacy_files()
 
 # Bot setup with timeouts
 application = create_application()
@@ -354,6 +282,10 @@ async def main():
                 logger.info("Остановка планировщика...")
                 await scheduler.stop()
                 logger.info("Планировщик успешно остановлен")
+
+            # Отменяем незавершенные регистрации и закрываем пул соединений к VUZ2
+            await registration_jobs.stop()
+            await vuz2_client.close()
             
             logger.info("Остановка приложения бота...")
             await application.stop()
@@ -0,0 +1,120 @@
+import os
+import shutil
+import hashlib
+import datetime
+from urllib.parse import unquote
+from utils import logger, get_db_connection, COURSE_WORKS_DIR
+
+# Хранилище курсовых работ по содержимому: course_works/blobs/ab/cd/<sha256>.
+# Одинаковые файлы хранятся один раз, а файлы разных студентов с одинаковым
+# именем больше не перезаписывают друг друга. course_works.file_path указывает на blob,
+# исходное имя файла и ссылка VUZ2 хранятся в course_work_files.
+BLOBS_DIR = os.path.join(COURSE_WORKS_DIR, 'blobs')
+
+def blob_path(sha256):
+    """Путь к blob в хранилище: два уровня подкаталогов по первым символам хеша"""
+    return os.path.normpath(os.path.join(BLOBS_DIR, sha256[:2], sha256[2:4], sha256))
+
+def is_blob_path(file_path):
+    return os.path.normpath(file_path).startswith(os.path.normpath(BLOBS_DIR) + os.sep)
+
+def original_name_from_url(url):
+    """Имя файла из ссылки VUZ2"""
+    return unquote(os.path.basename(url.split('?', 1)[0])) or 'course_work'
+
+def hash_file(file_path, chunk_size=64 * 1024):
+    """Returns: (sha256, size) файла"""
+    digest = hashlib.sha256()
+    size = 0
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+            size += len(chunk)
+    return digest.hexdigest(), size
+
+def find_blob_by_url(source_url):
+    """Returns: путь к blob, уже скачанному по этой ссылке, или None"""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT sha256 FROM course_work_files WHERE source_url=? LIMIT 1', (source_url,))
+        row = cursor.fetchone()
+    if not row:
+        return None
+    path = blob_path(row[0])
+    return path if os.path.isfile(path) else None
+
+def store_blob(tmp_path, sha256, size):
+    """
+    Перемещает файл (уже сохраненный на диск) в хранилище.
+    Если blob с таким содержимым уже есть, файл удаляется.
+    Returns: (blob_path, deduplicated)
+    """
+    path = blob_path(sha256)
+    deduplicated = os.path.isfile(path)
+    if deduplicated:
+        os.remove(tmp_path)
+    else:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(tmp_path, path)
+    with get_db_connection() as conn:
+        conn.execute(
+            'INSERT OR IGNORE INTO course_work_blobs (sha256, size, created_at) VALUES (?, ?, ?)',
+            (sha256, size, datetime.datetime.now().isoformat())
+        )
+        conn.commit()
+    return path, deduplicated
+
+def link_course_work(student_id, discipline, semester, file_path, original_name, source_url=None):
+    """Связывает курсовую работу студента с blob и сохраняет исходное имя файла"""
+    with get_db_connection() as conn:
+        conn.execute('''
+            INSERT OR REPLACE INTO course_work_files
+            (student_id, discipline, semester, sha256, original_name, source_url, linked_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (student_id, discipline, semester, os.path.basename(file_path), original_name,
+              source_url, datetime.datetime.now().isoformat()))
+        conn.commit()
+
+def migrate_legacy_files():
+    """
+    Переносит в хранилище файлы, сохраненные до его появления под своим именем
+    в course_works/, и обновляет ссылки на них в course_works.
+    """
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT DISTINCT file_path FROM course_works WHERE file_path IS NOT NULL')
+        legacy_paths = [row[0] for row in cursor.fetchall() if not is_blob_path(row[0])]
+    moved = 0
+    for legacy_path in legacy_paths:
+        if not os.path.isfile(legacy_path):
+            continue
+        try:
+            sha256, size = hash_file(legacy_path)
+            new_path = blob_path(sha256)
+            if not os.path.isfile(new_path):
+                # Копируем через временный файл; старый файл удаляется только после обновления базы
+                os.makedirs(os.path.dirname(new_path), exist_ok=True)
+                tmp_path = f"{new_path}.tmp"
+                shutil.copy2(legacy_path, tmp_path)
+                os.replace(tmp_path, new_path)
+            now = datetime.datetime.now().isoformat()
+            with get_db_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(
+                    'INSERT OR IGNORE INTO course_work_blobs (sha256, size, created_at) VALUES (?, ?, ?)',
+                    (sha256, size, now)
+                )
+                cursor.execute('UPDATE course_works SET file_path=? WHERE file_path=?', (new_path, legacy_path))
+                cursor.execute('''
+                    INSERT OR IGNORE INTO course_work_files
+                    (student_id, discipline, semester, sha256, original_name, source_url, linked_at)
+                    SELECT student_id, discipline, semester, ?, ?, NULL, ?
+                    FROM course_works WHERE file_path=?
+                ''', (sha256, os.path.basename(legacy_path), now, new_path))
+                conn.commit()
+            os.remove(legacy_path)
+            moved += 1
+        except Exception as e:
+            logger.error(f"Ошибка при переносе курсовой работы {legacy_path} в хранилище: {e}")
+    if moved:
+        logger.info(f"Перенесено в хранилище курсовых работ: {moved} файлов")
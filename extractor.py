@@ -0,0 +1,214 @@
+import re
+import html
+from bs4 import BeautifulSoup
+
+# Разбор страниц VUZ2. Для каждой страницы есть два пути:
+#  - быстрый: регулярными выражениями вырезаются только нужные фрагменты
+#    (table#user, заголовок h1, список курсовых работ), и BeautifulSoup разбирает
+#    лишь их, а не всю страницу;
+#  - полный: исходная логика на дереве всей страницы.
+# Быстрый путь бросает FastPathError, если разметка выглядит непривычно,
+# тогда вызывающий код переходит на полный путь (см. scraper.extract_rating и
+# extract_portfolio, через которые разбирают страницы scraper.parse_rating и parse_student_data).
+
+USER_TABLE_RE = re.compile(r'<table\b[^>]*\sid=["\']?user["\'\s>][^>]*>?.*?</table\s*>', re.S | re.I)
+DATA_BOX_RE = re.compile(r'<div\b[^>]*\sclass=["\']box data["\'][^>]*>', re.I)
+LIST_RE = re.compile(r'<ul\b[^>]*>.*?</ul\s*>', re.S | re.I)
+_H1_RE = re.compile(r'<h1\b[^>]*>(.*?)</h1\s*>', re.S | re.I)
+_H2_RE = re.compile(r'<h2\b[^>]*>(.*?)</h2\s*>', re.S | re.I)
+_TAG_RE = re.compile(r'<[^>]+>')
+_DIV_CLOSE_RE = re.compile(r'</div\s*>', re.I)
+_NESTED_RE = {
+    'table': re.compile(r'<table\b', re.I),
+    'ul': re.compile(r'<ul\b', re.I),
+}
+
+MODULE_MAP = {'1-ый модуль': 1, '2-ой модуль': 2}
+
+class FastPathError(Exception):
+    """Быстрый разбор не справился со страницей, нужен полный разбор"""
+
+def _decode(content):
+    return content.decode('utf-8', errors='replace') if isinstance(content, bytes) else content
+
+def _tag_text(fragment):
+    """Текст HTML-фрагмента без тегов, как у BeautifulSoup .text"""
+    if '<!' in fragment:
+        # Комментарии и CDATA BeautifulSoup обрабатывает иначе, чем простое удаление тегов
+        raise FastPathError("комментарий или CDATA в заголовке")
+    return html.unescape(_TAG_RE.sub('', fragment))
+
+def _slice_single(regex, nested_name, text, pos=0):
+    """Вырезает фрагмент по regex; вложенные одноименные теги быстрый путь не поддерживает"""
+    match = regex.search(text, pos)
+    if not match:
+        return None
+    fragment = match.group(0)
+    if len(_NESTED_RE[nested_name].findall(fragment)) > 1:
+        raise FastPathError(f"вложенный <{nested_name}> во фрагменте")
+    return fragment
+
+# --- Страница рейтинга ---
+
+def _read_grades(table, subjects):
+    rows = table.find_all('tr')
+    grades = {}
+    for module_label, module_num in MODULE_MAP.items():
+        module_row = next((row for row in rows if row.find('td') and row.find('td').text.strip() == module_label), None)
+        if module_row:
+            module_cells = module_row.find_all('td')
+            if len(module_cells) > 1:
+                for i, subject in enumerate(subjects):
+                    grade = module_cells[i + 1].text.strip() if i + 1 < len(module_cells) else '-'
+                    grades[(subject, module_num)] = int(grade) if grade.isdigit() else None
+    return grades
+
+def _read_subjects(table):
+    rows = table.find_all('tr')
+    if not rows:
+        return []
+    headers = [header.text.strip() for header in rows[0].find_all('th')]
+    return headers[1:-1] if len(headers) > 2 else []
+
+def extract_rating_full(content):
+    """
+    Полный разбор страницы рейтинга.
+    Returns: (not_found, full_name, subjects, grades), grades - {(дисциплина, модуль): оценка}
+    """
+    soup = BeautifulSoup(content, 'html.parser', from_encoding='utf-8')
+
+    # Проверяем наличие сообщения об ошибке
+    error_message = soup.find('h2')
+    if error_message and "не найден" in error_message.text:
+        return True, "Unknown", [], {}
+
+    data_box = soup.find('div', class_='box data')
+    if data_box:
+        name_tag = data_box.find('h1')
+        full_name = name_tag.text.strip() if name_tag else "Unknown"
+    else:
+        full_name = "Unknown"
+
+    table = soup.find('table', id='user')
+    subjects = _read_subjects(table) if table else []
+    grades = _read_grades(table, subjects) if subjects else {}
+    return False, full_name, subjects, grades
+
+def extract_rating_fast(content):
+    """
+    Быстрый разбор страницы рейтинга: BeautifulSoup получает только таблицу table#user.
+    Returns: (not_found, full_name, subjects, grades)
+    Raises: FastPathError, если разметка не подходит для быстрого пути
+    """
+    text = _decode(content)
+
+    h2_match = _H2_RE.search(text)
+    if h2_match and "не найден" in _tag_text(h2_match.group(1)):
+        return True, "Unknown", [], {}
+
+    full_name = "Unknown"
+    box_match = DATA_BOX_RE.search(text)
+    if box_match:
+        h1_match = _H1_RE.search(text, box_match.end())
+        if h1_match:
+            # h1 должен лежать внутри блока, а не после его закрытия
+            if _DIV_CLOSE_RE.search(text, box_match.end(), h1_match.start()):
+                raise FastPathError("h1 вне блока box data")
+            full_name = _tag_text(h1_match.group(1)).strip()
+
+    table_html = _slice_single(USER_TABLE_RE, 'table', text)
+    if not table_html:
+        return False, full_name, [], {}
+    table = BeautifulSoup(table_html, 'html.parser').find('table')
+    if table is None:
+        raise FastPathError("не удалось разобрать table#user")
+    subjects = _read_subjects(table)
+    grades = _read_grades(table, subjects) if subjects else {}
+    return False, full_name, subjects, grades
+
+# --- Страница портфолио ---
+
+def _read_portfolio_list(ul):
+    entries = []
+    for li in ul.find_all('li'):
+        # Получаем текст до первого <a> (только описание, без имени файла)
+        li_text = ''
+        for content in li.contents:
+            if getattr(content, 'name', None) == 'a':
+                break
+            if isinstance(content, str):
+                li_text += content
+        semester_match = re.search(r'Семестр: (\d+)', li_text)
+        discipline_match = re.search(r'Дисциплина: (.*)', li_text)
+        if semester_match and discipline_match:
+            file_link = li.find('a')
+            entries.append({
+                'semester': semester_match.group(1),
+                'discipline': discipline_match.group(1).strip(),
+                'href': file_link['href'] if file_link and 'href' in file_link.attrs else None
+            })
+    return entries
+
+def extract_portfolio_full(content):
+    """
+    Полный разбор страницы портфолио.
+    Returns: список {'semester', 'discipline', 'href'}
+    """
+    if not content:
+        return []
+    soup = BeautifulSoup(content, 'html.parser', from_encoding='utf-8')
+    portfolio_section = soup.find('div', class_='box data')
+    if not portfolio_section:
+        return []
+    ul = portfolio_section.find('ul')
+    return _read_portfolio_list(ul) if ul else []
+
+def extract_portfolio_fast(content):
+    """
+    Быстрый разбор страницы портфолио: BeautifulSoup получает только список курсовых работ.
+    Returns: список {'semester', 'discipline', 'href'}
+    Raises: FastPathError, если разметка не подходит для быстрого пути
+    """
+    if not content:
+        return []
+    text = _decode(content)
+    box_match = DATA_BOX_RE.search(text)
+    if not box_match:
+        return []
+    list_html = _slice_single(LIST_RE, 'ul', text, box_match.end())
+    if not list_html:
+        return []
+    if _DIV_CLOSE_RE.search(text, box_match.end(), text.find(list_html, box_match.end())):
+        raise FastPathError("список вне блока box data")
+    ul = BeautifulSoup(list_html, 'html.parser').find('ul')
+    if ul is None:
+        raise FastPathError("не удалось разобрать список курсовых работ")
+    return _read_portfolio_list(ul)
+
+# --- Фрагменты для хеша страниц ---
+
+def rating_fragments(rating_content):
+    """
+    Вырезает значимые фрагменты страницы рейтинга без разбора HTML:
+    заголовок h1 и таблицу table#user.
+    Returns: (h1, table) или None, если таблица не найдена
+    """
+    rating_html = _decode(rating_content)
+    table_match = USER_TABLE_RE.search(rating_html)
+    if not table_match:
+        return None
+    name_match = _H1_RE.search(rating_html)
+    return (name_match.group(0) if name_match else '', table_match.group(0))
+
+def portfolio_fragment(portfolio_content):
+    """
+    Вырезает список курсовых работ со страницы портфолио без разбора HTML.
+    Returns: html списка или '', если списка на странице нет
+    """
+    portfolio_html = _decode(portfolio_content)
+    box_match = DATA_BOX_RE.search(portfolio_html)
+    if box_match:
+        list_match = LIST_RE.search(portfolio_html, box_match.end())
+        if list_match:
+            return list_match.group(0)
+    return ''
@@ -0,0 +1,242 @@
+import asyncio
+import datetime
+from utils import logger, config, get_db_connection, run_blocking
+from grade_store import MODULES, subject_ids
+from notification_outbox import queue_notification
+
+# Настройки истории изменений оценок (переопределяются секцией "grade_events" в config.json)
+GRADE_EVENT_SETTINGS = {
+    'compact_after_days': 30,           # События старше схлопываются до одного на (студент, дисциплина, модуль)
+    'retention_days': 365,              # События старше удаляются
+    'maintenance_interval_hours': 24,   # Как часто выполнять схлопывание и удаление
+    'maintenance_batch': 500,           # Ключей (студент, дисциплина, модуль) или событий за одну транзакцию
+    'maintenance_pause_seconds': 0.05,  # Пауза между транзакциями обслуживания
+    **config.get('grade_events', {})
+}
+
+# История оценок - журнал grade_events, в который только добавляются строки: одна строка на
+# одно действительное изменение оценки (kind='grade') или группы (kind='group') студента.
+# Изменения считаются в памяти при записи результатов парсинга: разобранные оценки
+# сравниваются с оценками из базы, прочитанными одним запросом перед записью, и событие
+# пишется в той же транзакции, что и оценки. Уведомления строятся по еще не отправленным
+# событиям (notified_at IS NULL) в той же транзакции, поэтому каждое изменение дает ровно
+# одно уведомление; статистика изменений тоже читается из журнала. Старые события
+# схлопываются (остается одно событие «было - стало» на дисциплину и модуль) и удаляются
+# по истечении retention_days.
+
+SYSTEM_TELEGRAM_IDS = ('added by admin', 'added_by_superadmin')
+
+def stored_value(value):
+    """Оценка в виде, в котором она хранится в grades.value (TEXT)"""
+    return None if value is None else str(value)
+
+def grade_changes(old_grades, subjects, grades):
+    """
+    Изменения оценок студента без обращения к базе.
+    old_grades - {(дисциплина, модуль): значение из grades}, subjects и grades - разобранная страница.
+    Returns: [(дисциплина, модуль, было, стало)] по дисциплинам и модулям
+    """
+    changes = []
+    for subject in sorted(dict.fromkeys(subjects)):
+        for module in MODULES:
+            old_value = old_grades.get((subject, module))
+            new_value = stored_value(grades.get((subject, module)))
+            if old_value != new_value:
+                changes.append((subject, module, old_value, new_value))
+    return changes
+
+def record_events(cursor, student_id, group_change, changes, now):
+    """
+    Добавляет события студента в открытой транзакции (commit делает вызывающий).
+    group_change - (было, стало) или None, changes - результат grade_changes.
+    Returns: число событий
+    """
+    params = []
+    if group_change:
+        params.append((student_id, 'group', None, None, group_change[0], group_change[1], now))
+    if changes:
+        ids = subject_ids(cursor, [subject for subject, _, _, _ in changes])
+        params.extend(
+            (student_id, 'grade', ids[subject], module, old_value, new_value, now)
+            for subject, module, old_value, new_value in changes
+        )
+    cursor.executemany('''
+        INSERT INTO grade_events (student_id, kind, subject_id, module, old_value, new_value, changed_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', params)
+    return len(params)
+
+def format_changes_message(name, changes):
+    """Форматирует сообщение об изменениях в успеваемости"""
+    if not changes:
+        return None
+
+    message = f"📊 Изменения в данных {name}:\n\n"
+
+    # Сначала выводим изменение группы, если оно есть
+    group_changes = [c for c in changes if c['type'] == 'group']
+    if group_changes:
+        change = group_changes[0]
+        message += "👥 Изменение группы:\n"
+        message += f"   Было: {change['old_value'] if change['old_value'] else '-'}\n"
+        message += f"   Стало: {change['new_value']}\n\n"
+
+    # Затем выводим изменения в оценках
+    grade_changes = [c for c in changes if c['type'] == 'grade']
+    if grade_changes:
+        message += "📚 Изменения в успеваемости:\n\n"
+        for change in grade_changes:
+            message += f"📚 {change['subject']} (модуль {change['module']}):\n"
+            message += f"   Было: {change['old_value'] if change['old_value'] not in [None, 'None'] else '-'}\n"
+            message += f"   Стало: {change['new_value']}\n\n"
+
+    return message
+
+def queue_event_notifications(conn):
+    """
+    Ставит в очередь уведомления по неотправленным событиям и отмечает события
+    (в открытой транзакции conn, commit делает вызывающий).
+    О снятой оценке (стало NULL) не уведомляем; события студентов без Telegram тоже отмечаются.
+    Returns: число поставленных уведомлений
+    """
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT e.id, e.student_id, e.kind, sub.name, e.module, e.old_value, e.new_value,
+               st.name, st.telegram_id
+        FROM grade_events e
+        LEFT JOIN subjects sub ON sub.id = e.subject_id
+        LEFT JOIN students st ON st.student_id = e.student_id
+        WHERE e.notified_at IS NULL
+        ORDER BY e.id
+    ''')
+    rows = cursor.fetchall()
+    if not rows:
+        return 0
+    students = {}
+    for _, student_id, kind, subject, module, old_value, new_value, name, telegram_id in rows:
+        student = students.setdefault(student_id, {'name': name, 'telegram_id': telegram_id, 'changes': {}})
+        # Несколько изменений одной оценки (студент дважды в пачке) - одно «было - стало»
+        change = student['changes'].setdefault((kind, subject or '', module or 0), {
+            'type': kind, 'subject': subject, 'module': module, 'old_value': old_value
+        })
+        change['new_value'] = new_value
+    queued = 0
+    for student_id, student in students.items():
+        telegram_id = student['telegram_id']
+        if not telegram_id or telegram_id in SYSTEM_TELEGRAM_IDS:
+            continue
+        changes = [
+            change for _, change in sorted(student['changes'].items())
+            if change['new_value'] not in (None, 'None') and change['new_value'] != change['old_value']
+        ]
+        message = format_changes_message(student['name'], changes)
+        if message:
+            # Отправит бот (обработчик может работать в отдельном процессе)
+            queue_notification(telegram_id, message, conn=conn)
+            queued += 1
+            logger.info(f"Уведомление об изменениях поставлено в очередь для студента {student['name']} (ID: {student_id})")
+    now = datetime.datetime.now().isoformat()
+    cursor.executemany('UPDATE grade_events SET notified_at=? WHERE id=?', [(now, row[0]) for row in rows])
+    return queued
+
+def grade_change_summary(hours=24):
+    """Returns: {'events': изменений оценок, 'students': студентов с изменениями} за последние hours часов"""
+    since = (datetime.datetime.now() - datetime.timedelta(hours=hours)).isoformat()
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT COUNT(*), COUNT(DISTINCT student_id) FROM grade_events
+            WHERE changed_at >= ? AND kind = 'grade'
+        ''', (since,))
+        events, students = cursor.fetchone()
+        return {'events': events, 'students': students}
+
+def compact_events_batch(settings=None):
+    """
+    Схлопывает отправленные события старше compact_after_days: для каждого
+    (студент, вид, дисциплина, модуль) остается одно событие от первого «было»
+    к последнему «стало» (или ни одного, если значение вернулось к исходному).
+    Обрабатывает не больше maintenance_batch ключей в одной транзакции.
+    Returns: число удаленных событий
+    """
+    settings = settings or GRADE_EVENT_SETTINGS
+    cutoff = (datetime.datetime.now() - datetime.timedelta(days=settings['compact_after_days'])).isoformat()
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        conn.execute('BEGIN IMMEDIATE')
+        cursor.execute('''
+            SELECT student_id, kind, subject_id, module FROM grade_events
+            WHERE changed_at < ? AND notified_at IS NOT NULL
+            GROUP BY student_id, kind, subject_id, module
+            HAVING COUNT(*) > 1
+            LIMIT ?
+        ''', (cutoff, settings['maintenance_batch']))
+        keys = cursor.fetchall()
+        removed, updated = [], []
+        for student_id, kind, subject_id, module in keys:
+            cursor.execute('''
+                SELECT id, old_value, new_value FROM grade_events
+                WHERE student_id = ? AND kind = ? AND subject_id IS ? AND module IS ?
+                  AND changed_at < ? AND notified_at IS NOT NULL
+                ORDER BY id
+            ''', (student_id, kind, subject_id, module, cutoff))
+            events = cursor.fetchall()
+            first_old, (last_id, _, last_new) = events[0][1], events[-1]
+            removed.extend((event_id,) for event_id, _, _ in events[:-1])
+            if first_old == last_new:
+                removed.append((last_id,))
+            else:
+                updated.append((first_old, last_id))
+        cursor.executemany('UPDATE grade_events SET old_value=? WHERE id=?', updated)
+        cursor.executemany('DELETE FROM grade_events WHERE id=?', removed)
+        conn.commit()
+        return len(removed)
+
+def purge_events_batch(settings=None):
+    """
+    Удаляет отправленные события старше retention_days, не больше maintenance_batch за транзакцию.
+    Returns: число удаленных событий
+    """
+    settings = settings or GRADE_EVENT_SETTINGS
+    cutoff = (datetime.datetime.now() - datetime.timedelta(days=settings['retention_days'])).isoformat()
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            DELETE FROM grade_events WHERE id IN (
+                SELECT id FROM grade_events
+                WHERE changed_at < ? AND notified_at IS NOT NULL
+                ORDER BY id
+                LIMIT ?
+            )
+        ''', (cutoff, settings['maintenance_batch']))
+        conn.commit()
+        return cursor.rowcount
+
+async def maintain_grade_events(is_running, settings=None):
+    """
+    Фоновое схлопывание и удаление старых событий небольшими транзакциями раз в
+    maintenance_interval_hours. is_running - функция, возвращающая False для остановки.
+    """
+    settings = settings or GRADE_EVENT_SETTINGS
+    while is_running():
+        try:
+            totals = []
+            for step in (compact_events_batch, purge_events_batch):
+                total = 0
+                while is_running():
+                    count = await run_blocking(step, settings)
+                    if not count:
+                        break
+                    total += count
+                    await asyncio.sleep(settings['maintenance_pause_seconds'])
+                totals.append(total)
+            if any(totals):
+                logger.info(
+                    f"Обслуживание истории оценок: схлопнуто событий {totals[0]}, удалено старых {totals[1]}"
+                )
+            await asyncio.sleep(settings['maintenance_interval_hours'] * 3600)
+        except asyncio.CancelledError:
+            break
+        except Exception as e:
+            logger.error(f"Ошибка при обслуживании истории оценок: {e}")
+            await asyncio.sleep(60)
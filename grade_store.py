@@ -0,0 +1,278 @@
+import asyncio
+import datetime
+from utils import logger, get_db_connection, run_blocking, get_table_columns, invalidate_table_columns
+from schema import MIGRATION_SETTINGS
+
+# Оценки хранятся в таблице grades (student_id, subject_id, module, value) со справочником
+# дисциплин subjects. Строка есть, только если студент изучает дисциплину; value NULL - оценки
+# еще нет. Раньше оценки лежали в колонках students "<дисциплина> (модуль N)", которые
+# добавлялись ALTER TABLE для каждой новой дисциплины; они переносятся в grades в фоне
+# (студенты из legacy_grades_pending), а после переноса удаляются из students.
+# Перенос - не нумерованная миграция schema.MIGRATIONS: init_db выполняется до запуска бота,
+# а перенос большой базы идет, пока бот работает. Размер транзакции и пауза между ними
+# берутся из тех же настроек "migrations", что и у миграций по частям.
+
+MODULES = (1, 2)
+# Значение старых колонок для дисциплины, которую студент не изучает
+NOT_STUDIED = "не изучает"
+LEGACY_COLUMN_MARK = ' (модуль '
+
+# Перенос завершен в этом процессе: читателям больше не нужно проверять legacy_grades_pending
+_legacy_migrated = False
+# (колонки students из кэша схемы, разобранные из них старые колонки оценок)
+_legacy_columns = (None, [])
+
+def _placeholders(values):
+    return ','.join('?' * len(values))
+
+def subject_ids(cursor, names):
+    """Returns: {название дисциплины: id}, новые дисциплины добавляются в справочник"""
+    names = list(dict.fromkeys(names))
+    if not names:
+        return {}
+    cursor.executemany('INSERT OR IGNORE INTO subjects (name) VALUES (?)', [(name,) for name in names])
+    ids = {}
+    for start in range(0, len(names), 500):
+        chunk = names[start:start + 500]
+        cursor.execute(f'SELECT name, id FROM subjects WHERE name IN ({_placeholders(chunk)})', chunk)
+        ids.update(cursor.fetchall())
+    return ids
+
+def _chunks(values, size=500):
+    values = list(values)
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+def save_grades(cursor, student_id, subjects, grades, now=None):
+    """
+    Записывает оценки студента в открытой транзакции (commit делает вызывающий).
+    subjects - дисциплины, которые изучает студент, grades - {(дисциплина, модуль): оценка}.
+    Строки дисциплин, которых больше нет в subjects, удаляются.
+    """
+    save_grades_batch(cursor, [(student_id, subjects, grades)], now)
+
+def save_grades_batch(cursor, students, now=None):
+    """
+    save_grades для пачки студентов [(student_id, subjects, grades)]: каждая команда
+    выполняется одним executemany на всю пачку (студент встречается в пачке один раз)
+    """
+    now = (now or datetime.datetime.now()).isoformat()
+    ids = subject_ids(cursor, [subject for _, subjects, _ in students for subject in subjects])
+    cursor.executemany('''
+        INSERT INTO grades (student_id, subject_id, module, value, updated_at) VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(student_id, subject_id, module) DO UPDATE SET value=excluded.value, updated_at=excluded.updated_at
+        WHERE grades.value IS NOT excluded.value
+    ''', [
+        (student_id, ids[subject], module, grades.get((subject, module)), now)
+        for student_id, subjects, grades in students
+        for subject in dict.fromkeys(subjects) for module in MODULES
+    ])
+    kept = {student_id: {ids[subject] for subject in subjects} for student_id, subjects, _ in students}
+    stale = []
+    for chunk in _chunks(kept):
+        cursor.execute(f'SELECT student_id, subject_id FROM grades WHERE student_id IN ({_placeholders(chunk)})', chunk)
+        stale.extend(row for row in cursor.fetchall() if row[1] not in kept[row[0]])
+    cursor.executemany('DELETE FROM grades WHERE student_id=? AND subject_id=?', stale)
+    # Оценки студентов уже в новом формате - старые колонки переносить не нужно
+    cursor.executemany('DELETE FROM legacy_grades_pending WHERE student_id=?', [(student_id,) for student_id in kept])
+
+def _ensure_migrated(cursor, student_ids):
+    """
+    Переносит из старых колонок оценки студентов, до которых еще не дошел фоновый перенос
+    (в открытой транзакции, commit делает вызывающий)
+    """
+    if _legacy_migrated or not student_ids or not legacy_grade_columns(cursor):
+        return
+    pending = []
+    for chunk in _chunks(student_ids):
+        cursor.execute(f'SELECT student_id FROM legacy_grades_pending WHERE student_id IN ({_placeholders(chunk)})', chunk)
+        pending.extend(row[0] for row in cursor.fetchall())
+    if pending:
+        _migrate_students(cursor, pending)
+
+def load_student_grades(student_id):
+    """Returns: {дисциплина: {модуль: оценка}} дисциплин, которые изучает студент, по алфавиту"""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        _ensure_migrated(cursor, [student_id])
+        cursor.execute('''
+            SELECT s.name, g.module, g.value
+            FROM grades g
+            JOIN subjects s ON s.id = g.subject_id
+            WHERE g.student_id = ?
+            ORDER BY s.name, g.module
+        ''', (student_id,))
+        result = {}
+        for subject, module, value in cursor.fetchall():
+            result.setdefault(subject, {})[module] = value
+        return result
+
+def load_grades_batch(cursor, student_ids):
+    """
+    Оценки студентов в открытой транзакции (оценки из старых колонок переносятся без commit).
+    Returns: {student_id: {(дисциплина, модуль): оценка}}
+    """
+    _ensure_migrated(cursor, student_ids)
+    result = {student_id: {} for student_id in student_ids}
+    for chunk in _chunks(result):
+        cursor.execute(f'''
+            SELECT g.student_id, s.name, g.module, g.value
+            FROM grades g
+            JOIN subjects s ON s.id = g.subject_id
+            WHERE g.student_id IN ({_placeholders(chunk)})
+        ''', chunk)
+        for student_id, subject, module, value in cursor.fetchall():
+            result[student_id][(subject, module)] = value
+    return result
+
+def load_discipline_grades(student_group, subject):
+    """Returns: [(имя студента, {модуль: оценка})] всех студентов группы по алфавиту"""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT student_id, name FROM students WHERE student_group=? ORDER BY name', (student_group,))
+        students = cursor.fetchall()
+        _ensure_migrated(cursor, [student_id for student_id, _ in students])
+        cursor.execute('''
+            SELECT g.student_id, g.module, g.value
+            FROM grades g
+            JOIN students st ON st.student_id = g.student_id
+            WHERE st.student_group = ? AND g.subject_id = (SELECT id FROM subjects WHERE name = ?)
+        ''', (student_group, subject))
+        values = {}
+        for student_id, module, value in cursor.fetchall():
+            values.setdefault(student_id, {})[module] = value
+    return [(name, values.get(student_id, {})) for student_id, name in students]
+
+def load_student_subjects(student_id):
+    """Returns: список дисциплин, которые изучает студент, по алфавиту"""
+    return list(load_student_grades(student_id))
+
+def all_subjects():
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT name FROM subjects ORDER BY name')
+        return [row[0] for row in cursor.fetchall()]
+
+# --- Перенос из старых колонок students ---
+
+def legacy_grade_columns(cursor):
+    """
+    Returns: [(колонка, дисциплина, модуль)] старых колонок оценок в students.
+    Разбирается заново, только когда сброшен кэш колонок students (utils.get_table_columns)
+    """
+    global _legacy_columns
+    students_columns = get_table_columns('students', cursor)
+    if _legacy_columns[0] is not students_columns:
+        columns = []
+        for name in students_columns:
+            if LEGACY_COLUMN_MARK in name and name.endswith(')'):
+                subject, module = name.rsplit(LEGACY_COLUMN_MARK, 1)
+                if module[:-1].isdigit():
+                    columns.append((name, subject, int(module[:-1])))
+        _legacy_columns = (students_columns, columns)
+    return _legacy_columns[1]
+
+def _migrate_students(cursor, student_ids):
+    """Копирует оценки студентов из старых колонок в grades (новые записи не перезаписываются)"""
+    columns = legacy_grade_columns(cursor)
+    if columns:
+        ids = subject_ids(cursor, [subject for _, subject, _ in columns])
+        select = ', '.join('"{}"'.format(name.replace('"', '""')) for name, _, _ in columns)
+        now = datetime.datetime.now().isoformat()
+        cursor.execute(
+            f'SELECT student_id, {select} FROM students WHERE student_id IN ({_placeholders(student_ids)})',
+            student_ids
+        )
+        rows = []
+        for student_id, *values in cursor.fetchall():
+            for (_, subject, module), value in zip(columns, values):
+                if value != NOT_STUDIED:
+                    rows.append((student_id, ids[subject], module, value, now))
+        cursor.executemany('''
+            INSERT OR IGNORE INTO grades (student_id, subject_id, module, value, updated_at) VALUES (?, ?, ?, ?, ?)
+        ''', rows)
+    cursor.execute(f'DELETE FROM legacy_grades_pending WHERE student_id IN ({_placeholders(student_ids)})', student_ids)
+
+def migrate_legacy_batch(batch_size=None):
+    """
+    Переносит оценки очередной пачки студентов одной транзакцией: не больше batch_size
+    (migrations.batch_size) строк, то есть batch_size / число старых колонок студентов.
+    Returns: число студентов
+    """
+    batch_size = batch_size or MIGRATION_SETTINGS['batch_size']
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('BEGIN IMMEDIATE')
+        students = max(1, batch_size // max(1, len(legacy_grade_columns(cursor))))
+        cursor.execute('SELECT student_id FROM legacy_grades_pending LIMIT ?', (students,))
+        student_ids = [row[0] for row in cursor.fetchall()]
+        if student_ids:
+            _migrate_students(cursor, student_ids)
+        conn.commit()
+        return len(student_ids)
+
+def drop_legacy_grade_columns():
+    """
+    Удаляет старые колонки оценок из students (пересоздает таблицу без них), когда перенос
+    завершен. Returns: число удаленных колонок
+    """
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('BEGIN IMMEDIATE')
+        # Колонки могли удалить в другом процессе - читаем схему заново
+        invalidate_table_columns('students')
+        legacy = {name for name, _, _ in legacy_grade_columns(cursor)}
+        if cursor.execute('SELECT COUNT(*) FROM legacy_grades_pending').fetchone()[0] or not legacy:
+            conn.rollback()
+            return 0
+        cursor.execute('PRAGMA table_info(students)')
+        keep = [col for col in cursor.fetchall() if col[1] not in legacy]
+        cursor.execute("SELECT sql FROM sqlite_master WHERE type='index' AND tbl_name='students' AND sql IS NOT NULL")
+        index_sql = [row[0] for row in cursor.fetchall()]
+        definitions, names = [], []
+        for _, name, col_type, notnull, default, pk in keep:
+            quoted = '"{}"'.format(name.replace('"', '""'))
+            definition = f'{quoted} {col_type}'.strip()
+            if pk:
+                definition += ' PRIMARY KEY'
+            if notnull:
+                definition += ' NOT NULL'
+            if default is not None:
+                definition += f' DEFAULT {default}'
+            definitions.append(definition)
+            names.append(quoted)
+        cursor.execute(f'CREATE TABLE students_compact ({", ".join(definitions)})')
+        cursor.execute(f'INSERT INTO students_compact ({", ".join(names)}) SELECT {", ".join(names)} FROM students')
+        cursor.execute('DROP TABLE students')
+        cursor.execute('ALTER TABLE students_compact RENAME TO students')
+        for sql in index_sql:
+            cursor.execute(sql)
+        conn.commit()
+    invalidate_table_columns('students')
+    logger.info(f"Из таблицы students удалены старые колонки оценок: {len(legacy)}")
+    return len(legacy)
+
+async def migrate_legacy_grades(is_running):
+    """
+    Фоновый перенос оценок из старых колонок небольшими транзакциями, затем удаление колонок.
+    is_running - функция, возвращающая False для остановки.
+    """
+    global _legacy_migrated
+    migrated = 0
+    while is_running():
+        try:
+            count = await run_blocking(migrate_legacy_batch)
+            if count:
+                migrated += count
+                await asyncio.sleep(MIGRATION_SETTINGS['pause_seconds'])
+                continue
+            _legacy_migrated = True
+            if migrated:
+                logger.info(f"Оценки перенесены в таблицу grades: {migrated} студентов")
+            await run_blocking(drop_legacy_grade_columns)
+            return
+        except asyncio.CancelledError:
+            break
+        except Exception as e:
+            logger.error(f"Ошибка при переносе оценок из старых колонок: {e}")
+            await asyncio.sleep(60)
@@ -1,5 +1,5 @@
-import re
 import os
+import html
 import json
 import base64
 import zipfile
@@ -7,11 +7,24 @@ import tempfile
 import asyncio
 import traceback
 from utils import (
-    logger, get_db_connection, check_registration, parse_student_data, save_to_db,
+    logger, get_db_connection, check_registration, save_to_db,
     show_student_rating, format_ratings_table, REPLY_KEYBOARD_MARKUP,
-    CANCEL_KEYBOARD_MARKUP, INLINE_KEYBOARD_MARKUP, validate_student_id, validate_group_format, validate_student_group, handle_telegram_timeout,
-    send_notification_to_users, get_week_type, set_week_type_settings, notify_superadmins
+    CANCEL_KEYBOARD_MARKUP, INLINE_KEYBOARD_MARKUP, validate_student_id, validate_group_format, handle_telegram_timeout,
+    send_notification_to_users, notify_superadmins,
+    save_course_work_to_db, run_blocking, run_db, rating_refresh_markup, group_students_markup
 )
+from scraper import parse_student_data, validate_student_group, vuz2_client
+from refresh_requests import request_refresh, request_group_refresh, render_student_rating, REFRESH_FRESH
+from background_jobs import registration_jobs
+from repository import (
+    get_profile, touch, get_student_rating, get_group_students, get_student_group,
+    get_student_subjects, get_discipline_view, get_discipline_course_works, get_schedule,
+    get_student_rating_view, get_archive_parts, set_notifications, get_student_groups,
+    get_week_settings, set_week_type, toggle_week_type, toggle_auto_switch
+)
+from scheduler import scrape_load_report
+from backup_service import backup_report, BACKUP_SETTINGS
+from grade_events import grade_change_summary
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup
 from archive_manager import CourseWorkArchiveManager
 from datetime import datetime, timedelta
@@ -60,11 +73,154 @@ def build_schedule_keyboard(schedule, group, subgroup, week_type, day_type, date
         lesson_buttons.append([InlineKeyboardButton("« Назад", callback_data='schedule')])
     return message, lesson_buttons, lessons_data
 
+# --- ФОНОВАЯ РЕГИСТРАЦИЯ СТУДЕНТОВ ---
+VUZ2_UNAVAILABLE_TEXT = "Не удалось получить данные по номеру студенческого билета. Проверьте правильность номера или сервер VUZ2 не отвечает. Попробуйте позже."
+
+def _vuz2_down_text():
+    """Текст для пользователя, если VUZ2 сейчас недоступен (цепь разомкнута), иначе None"""
+    if not vuz2_client.breaker.is_open:
+        return None
+    retry_minutes = max(1, round(vuz2_client.breaker.status()['retry_after'] / 60))
+    return f"Сайт VUZ2 сейчас недоступен. Попробуйте через {retry_minutes} мин.\n\nВы можете отменить действие командой /cancel."
+
+async def _reply_if_vuz2_down(message):
+    """Сразу отвечает пользователю, если VUZ2 недоступен. Returns: True, если ответ отправлен"""
+    down_text = _vuz2_down_text()
+    if down_text:
+        await message.reply_text(down_text, reply_markup=CANCEL_KEYBOARD_MARKUP)
+        return True
+    return False
+
+async def _send_rating_with_refresh(message, student_id):
+    """
+    Отправляет сохраненные оценки студента и ставит их обновление с высоким приоритетом
+    (вместо повторного парсинга в обработчике): таблицу в сообщении обновит бот.
+    """
+    text = await get_student_rating(student_id)
+    if _vuz2_down_text():
+        await message.reply_text(text, parse_mode='HTML', reply_markup=rating_refresh_markup(student_id))
+        return
+    sent = await message.reply_text(text, parse_mode='HTML', reply_markup=rating_refresh_markup(student_id, in_progress=True))
+    status = await run_db(request_refresh, student_id, sent.chat_id, sent.message_id)
+    if status == REFRESH_FRESH:
+        await sent.edit_reply_markup(reply_markup=rating_refresh_markup(student_id))
+
+def _link_existing_student(student_id, telegram_id):
+    """
+    Привязывает telegram_id к уже зарегистрированному студенту.
+    Returns: имя студента или None, если студента нет в базе
+    """
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute('SELECT name FROM students WHERE student_id=?', (student_id,))
+        existing_student = cursor.fetchone()
+        if not existing_student:
+            return None
+        cursor.execute('UPDATE students SET telegram_id=? WHERE student_id=?', (telegram_id, student_id))
+        cursor.execute('UPDATE course_works SET telegram_id=? WHERE student_id=?', (telegram_id, student_id))
+        conn.commit()
+        return existing_student[0]
+    finally:
+        conn.close()
+
+def _save_new_student(student_id, name, grades, subjects, course_works, telegram_id, student_group, is_admin=None):
+    """
+    Сохраняет нового студента и его курсовые работы (выполняется в run_blocking).
+    is_admin=None - администратором становится первый студент группы.
+    Returns: is_admin
+    """
+    if is_admin is None:
+        conn = get_db_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute('SELECT COUNT(*) FROM students WHERE student_group=?', (student_group,))
+            is_admin = cursor.fetchone()[0] == 0
+        finally:
+            conn.close()
+    save_to_db(
+        student_id=student_id,
+        name=name,
+        grades=grades,
+        subjects=subjects,
+        telegram_id=telegram_id,
+        student_group=student_group,
+        is_admin=is_admin
+    )
+    for cw in course_works:
+        save_course_work_to_db(
+            student_id=student_id,
+            name=name,
+            telegram_id=telegram_id,
+            student_group=student_group,
+            discipline=cw.get('discipline'),
+            file_path=cw.get('file_path'),
+            semester=cw.get('semester')
+        )
+    return is_admin
+
+async def _registration_job(context, student_id, student_group, telegram_id):
+    """
+    Фоновая самостоятельная регистрация студента.
+    Returns: (text, reply_markup) для сообщения о ходе регистрации
+    """
+    try:
+        # Проверяем существование студента и его группу (страницы VUZ2 загружаются один раз)
+        name, grades, subjects, course_works = await parse_student_data(student_id, use_cache=True)
+        if name == "Unknown":
+            down_text = _vuz2_down_text()
+            if down_text:
+                # VUZ2 недоступен: номер и группа верные, регистрацию можно повторить позже
+                context.user_data.pop('registration_in_progress', None)
+                return down_text, CANCEL_KEYBOARD_MARKUP
+            context.user_data.clear()  # Сбрасываем состояние
+            context.user_data['awaiting_student_id'] = True  # Возвращаем к вводу student_id
+            return (
+                f"{VUZ2_UNAVAILABLE_TEXT}\n\nПожалуйста, введите номер студенческого билета или отмените действие командой /cancel.",
+                CANCEL_KEYBOARD_MARKUP
+            )
+
+        is_valid_group, group_error = await validate_student_group(student_id, student_group, use_cache=True)
+        if not is_valid_group:
+            context.user_data.clear()
+            context.user_data['awaiting_student_id'] = True
+            return (
+                f"Ошибка: {group_error}\n\nПожалуйста, введите номер студенческого билета или отмените действие командой /cancel.",
+                CANCEL_KEYBOARD_MARKUP
+            )
+
+        # Студента могли зарегистрировать, пока шла загрузка - просто привязываем telegram_id
+        existing_name = await run_blocking(_link_existing_student, student_id, telegram_id)
+        if existing_name:
+            context.user_data.clear()
+            return f"Ваш Telegram ID был успешно привязан к существующему студенту {existing_name}.", None
+
+        is_admin = await run_blocking(
+            _save_new_student, student_id, name, grades, subjects, course_works, telegram_id, student_group
+        )
+        context.user_data.clear()
+
+        # Уведомляем суперадминов о новом пользователе
+        notification_text = (
+            "🆕 <b>Новый пользователь в боте!</b>\n\n"
+            f"• Имя: {name}\n"
+            f"• Группа: {student_group}\n"
+            f"• Student ID: {student_id}\n"
+            f"• Telegram ID: {telegram_id}"
+        )
+        await notify_superadmins(context.application, notification_text)
+        return f"Регистрация завершена! Вы {'стали администратором' if is_admin else 'добавлены в'} группу {student_group}.", None
+    except Exception as e:
+        context.user_data.pop('registration_in_progress', None)
+        logger.error(f"Error saving group: {e}")
+        return "Произошла ошибка при регистрации.\n\nВы можете вернуться в главное меню командой /cancel.", None
+
 @handle_telegram_timeout()
 async def handle_message(update, context):
     text = update.message.text.strip()
     user_id = update.effective_user.id
     logger.info(f"Получено сообщение от пользователя {user_id}: {text}")
+    await touch(user_id)
 
     if context.user_data.get('awaiting_admin_comment'):
         comment = text.strip()
@@ -198,6 +354,12 @@ async def handle_message(update, context):
         return
 
     if context.user_data.get('awaiting_group'):
+        if context.user_data.get('registration_in_progress'):
+            await update.message.reply_text(
+                "Регистрация уже выполняется, пожалуйста, подождите...",
+                reply_markup=REPLY_KEYBOARD_MARKUP
+            )
+            return
         student_group = text.upper()
         student_id = context.user_data.get('temp_student_id')
         telegram_id = str(update.effective_user.id)
@@ -213,124 +375,20 @@ async def handle_message(update, context):
             )
             return
 
-        # Проверяем существование студента и его группу
-        name, grades, subjects, course_works = parse_student_data(student_id)
-        if name == "Unknown":
-            context.user_data.clear()  # Сбрасываем состояние
-            context.user_data['awaiting_student_id'] = True  # Возвращаем к вводу student_id
-            await update.message.reply_text(
-                "Не удалось получить данные по номеру студенческого билета. Проверьте правильность номера или сервер VUZ2 не отвечает. Попробуйте позже.\n\nПожалуйста, введите номер студенческого билета или отмените действие командой /cancel.",
-                reply_markup=CANCEL_KEYBOARD_MARKUP
-            )
-            return
-            
-        # Проверяем соответствие студента группе
-        is_valid_group, group_error = validate_student_group(student_id, student_group)
-        if not is_valid_group:
-            context.user_data.clear()  # Сбрасываем состояние
-            context.user_data['awaiting_student_id'] = True  # Возвращаем к вводу student_id
-            await update.message.reply_text(
-                f"Ошибка: {group_error}\n\nПожалуйста, введите номер студенческого билета или отмените действие командой /cancel.",
-                reply_markup=CANCEL_KEYBOARD_MARKUP
-            )
+        if await _reply_if_vuz2_down(update.message):
             return
 
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        # Проверяем, есть ли студент с таким student_id
-        cursor.execute('SELECT name FROM students WHERE student_id=?', (student_id,))
-        existing_student = cursor.fetchone()
-        if existing_student:
-            # Просто обновляем telegram_id в students и course_works
-            cursor.execute('UPDATE students SET telegram_id=? WHERE student_id=?', (telegram_id, student_id))
-            cursor.execute('UPDATE course_works SET telegram_id=? WHERE student_id=?', (telegram_id, student_id))
-            conn.commit()
-            conn.close()
-            context.user_data.clear()
-            await update.message.reply_text(
-                f"Ваш Telegram ID был успешно привязан к существующему студенту {existing_student[0]}.",
-                reply_markup=REPLY_KEYBOARD_MARKUP
-            )
-            return
-        # Сообщаем пользователю о начале процесса
-        if not context.user_data.get('registration_in_progress'):
-            context.user_data['registration_in_progress'] = True
-            await update.message.reply_text(
-                "Идет регистрация, пожалуйста, подождите... Это может занять до минуты.",
-                reply_markup=REPLY_KEYBOARD_MARKUP
-            )
-        # Парсим только если еще не парсили для этого студента в этой сессии
-        if 'temp_parsed_student_id' in context.user_data and context.user_data['temp_parsed_student_id'] == student_id:
-            name = context.user_data['temp_name']
-            grades = context.user_data['temp_grades']
-            subjects = context.user_data['temp_subjects']
-            course_works = context.user_data['temp_course_works']
-        else:
-            name, grades, subjects, course_works = parse_student_data(student_id)
-            context.user_data['temp_name'] = name
-            context.user_data['temp_grades'] = grades
-            context.user_data['temp_subjects'] = subjects
-            context.user_data['temp_course_works'] = course_works
-            context.user_data['temp_parsed_student_id'] = student_id
-        if name == "Unknown":
-            context.user_data.pop('registration_in_progress', None)
-            await update.message.reply_text(
-                "Не удалось получить данные по номеру студенческого билета. Проверьте правильность номера или сервер VUZ2 не отвечает. Попробуйте позже.\n\nВы можете отменить действие командой /cancel.",
-                reply_markup=CANCEL_KEYBOARD_MARKUP
-            )
-            context.user_data.clear()
-            return
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        try:
-            cursor.execute('SELECT COUNT(*) FROM students WHERE student_group=?', (student_group,))
-            group_exists = cursor.fetchone()[0] > 0
-            is_admin = not group_exists
-
-            save_to_db(
-                student_id=student_id,
-                name=name,
-                grades=grades,
-                subjects=subjects,
-                telegram_id=telegram_id,
-                student_group=student_group,
-                is_admin=is_admin
-            )
-            # Сохраняем курсовые работы
-            for cw in course_works:
-                from utils import save_course_work_to_db
-                save_course_work_to_db(
-                    student_id=student_id,
-                    name=name,
-                    telegram_id=telegram_id,
-                    student_group=student_group,
-                    discipline=cw.get('discipline'),
-                    file_path=cw.get('file_path'),
-                    semester=cw.get('semester')
-                )
-            context.user_data.pop('registration_in_progress', None)
-            context.user_data.clear()
-            
-            # Уведомляем суперадминов о новом пользователе
-            notification_text = (
-                "🆕 <b>Новый пользователь в боте!</b>\n\n"
-                f"• Имя: {name}\n"
-                f"• Группа: {student_group}\n"
-                f"• Student ID: {student_id}\n"
-                f"• Telegram ID: {telegram_id}"
-            )
-            await notify_superadmins(context.application, notification_text)
-            
-            await update.message.reply_text(
-                f"Регистрация завершена! Вы {'стали администратором' if is_admin else 'добавлены в'} группу {student_group}.",
-                reply_markup=REPLY_KEYBOARD_MARKUP
-            )
-        except Exception as e:
+        # Загрузка с VUZ2 и сохранение выполняются в фоне, сообщение о ходе регистрации
+        # будет отредактировано результатом
+        context.user_data['registration_in_progress'] = True
+        submitted = await registration_jobs.submit(
+            update.message,
+            lambda: _registration_job(context, student_id, student_group, telegram_id),
+            "Идет регистрация, пожалуйста, подождите... Это может занять до минуты.",
+            description=f"регистрация {student_id}"
+        )
+        if not submitted:
             context.user_data.pop('registration_in_progress', None)
-            logger.error(f"Error saving group: {e}")
-            await update.message.reply_text("Произошла ошибка при регистрации.\n\nВы можете вернуться в главное меню командой /cancel.")
-        finally:
-            conn.close()
         return
 
     if context.user_data.get('awaiting_admin_student_id'):
@@ -355,17 +413,23 @@ async def handle_message(update, context):
             student_data = cursor.fetchone()
             
             if not student_data:
-                name, grades, subjects, course_works = parse_student_data(student_id, telegram_id="added by admin", student_group=admin_group)
-                if name == "Unknown":
-                    await update.message.reply_text(
-                        "Не удалось получить данные по номеру студенческого билета. Проверьте правильность введенного номера. Возможно сервер VUZ2 не отвечает. Попробуйте позже.\n\nВы можете отменить действие командой /cancel.",
-                        reply_markup=CANCEL_KEYBOARD_MARKUP
-                    )
+                if await _reply_if_vuz2_down(update.message):
                     return
-                save_to_db(student_id, name, grades, subjects, telegram_id="added by admin", student_group=admin_group)
-                await update.message.reply_text(
-                    f"Студент {name} добавлен в группу {admin_group}!",
-                    reply_markup=REPLY_KEYBOARD_MARKUP
+
+                async def add_student_job():
+                    name, grades, subjects, course_works = await parse_student_data(student_id, telegram_id="added by admin", student_group=admin_group, use_cache=True)
+                    if name == "Unknown":
+                        return (
+                            _vuz2_down_text() or "Не удалось получить данные по номеру студенческого билета. Проверьте правильность введенного номера. Возможно сервер VUZ2 не отвечает. Попробуйте позже.\n\nВы можете отменить действие командой /cancel.",
+                            CANCEL_KEYBOARD_MARKUP
+                        )
+                    await run_blocking(save_to_db, student_id, name, grades, subjects, telegram_id="added by admin", student_group=admin_group)
+                    return f"Студент {name} добавлен в группу {admin_group}!", None
+
+                await registration_jobs.submit(
+                    update.message, add_student_job,
+                    "Добавляю студента, пожалуйста, подождите...",
+                    description=f"добавление студента {student_id}"
                 )
             else:
                 name, student_group = student_data
@@ -376,9 +440,10 @@ async def handle_message(update, context):
                     )
                 else:
                     await update.message.reply_text(
-                        f"Студент {name} уже является членом группы {admin_group}.",
+                        f"Студент {name} уже является членом группы {admin_group}. Обновляю его оценки.",
                         reply_markup=REPLY_KEYBOARD_MARKUP
                     )
+                    await _send_rating_with_refresh(update.message, student_id)
         except Exception as e:
             logger.error(f"Error processing admin action: {e}")
             await update.message.reply_text("Произошла ошибка при выполнении действия.\n\nВы можете вернуться в главное меню командой /cancel.")
@@ -405,29 +470,33 @@ async def handle_message(update, context):
             cursor.execute('SELECT name, student_group, is_admin FROM students WHERE student_id=?', (student_id,))
             student_data = cursor.fetchone()
             if not student_data:
-                name, grades, subjects, course_works = parse_student_data(student_id, telegram_id="added by admin", student_group=admin_group)
-                if name == "Unknown":
-                    await update.message.reply_text(
-                        "Не удалось получить данные по номеру студенческого билета. Проверьте правильность введенного номера. Возможно сервер VUZ2 не отвечает. Попробуйте позже.\n\nВы можете отменить действие командой /cancel.",
-                        reply_markup=CANCEL_KEYBOARD_MARKUP
-                    )
-                    context.user_data.clear()
+                if await _reply_if_vuz2_down(update.message):
                     return
-                save_to_db(student_id, name, grades, subjects, telegram_id="added by admin", student_group=admin_group, is_admin=True)
-                
-                # Уведомляем суперадминов о новом администраторе
-                notification_text = (
-                    "🆕 <b>Новый администратор группы!</b>\n\n"
-                    f"• Имя: {name}\n"
-                    f"• Группа: {admin_group}\n"
-                    f"• Student ID: {student_id}\n"
-                    f"• Назначен администратором группы"
-                )
-                await notify_superadmins(context.application, notification_text)
-                
-                await update.message.reply_text(
-                    f"Пользователь {name} добавлен как администратор группы {admin_group}!",
-                    reply_markup=REPLY_KEYBOARD_MARKUP
+
+                async def add_admin_job():
+                    name, grades, subjects, course_works = await parse_student_data(student_id, telegram_id="added by admin", student_group=admin_group, use_cache=True)
+                    if name == "Unknown":
+                        return (
+                            _vuz2_down_text() or "Не удалось получить данные по номеру студенческого билета. Проверьте правильность введенного номера. Возможно сервер VUZ2 не отвечает. Попробуйте позже.\n\nВы можете отменить действие командой /cancel.",
+                            CANCEL_KEYBOARD_MARKUP
+                        )
+                    await run_blocking(save_to_db, student_id, name, grades, subjects, telegram_id="added by admin", student_group=admin_group, is_admin=True)
+
+                    # Уведомляем суперадминов о новом администраторе
+                    notification_text = (
+                        "🆕 <b>Новый администратор группы!</b>\n\n"
+                        f"• Имя: {name}\n"
+                        f"• Группа: {admin_group}\n"
+                        f"• Student ID: {student_id}\n"
+                        f"• Назначен администратором группы"
+                    )
+                    await notify_superadmins(context.application, notification_text)
+                    return f"Пользователь {name} добавлен как администратор группы {admin_group}!", None
+
+                await registration_jobs.submit(
+                    update.message, add_admin_job,
+                    "Добавляю администратора, пожалуйста, подождите...",
+                    description=f"добавление администратора {student_id}"
                 )
             else:
                 name, student_group, is_admin_flag = student_data
@@ -483,40 +552,40 @@ async def handle_message(update, context):
             cursor.execute('SELECT name, student_group FROM students WHERE student_id=?', (student_id,))
             student_data = cursor.fetchone()
             if not student_data:
-                name, grades, subjects, course_works = parse_student_data(student_id, telegram_id="added by admin", student_group=admin_group)
-                if name == "Unknown":
-                    await update.message.reply_text(
-                        "Не удалось получить данные по номеру студенческого билета. Проверьте правильность введенного номера. Возможно сервер VUZ2 не отвечает. Попробуйте позже.\n\nВы можете отменить действие командой /cancel.",
-                        reply_markup=CANCEL_KEYBOARD_MARKUP
-                    )
-                    context.user_data.clear()
+                if await _reply_if_vuz2_down(update.message):
                     return
-                save_to_db(student_id, name, grades, subjects, telegram_id="added by admin", student_group=admin_group)
-                from utils import save_course_work_to_db
-                for cw in course_works:
-                    save_course_work_to_db(
-                        student_id=student_id,
-                        name=name,
-                        telegram_id="added by admin",
-                        student_group=admin_group,
-                        discipline=cw.get('discipline'),
-                        file_path=cw.get('file_path'),
-                        semester=cw.get('semester')
+
+                async def add_student_job():
+                    name, grades, subjects, course_works = await parse_student_data(student_id, telegram_id="added by admin", student_group=admin_group, use_cache=True)
+                    if name == "Unknown":
+                        # Пока шла загрузка, администратор мог ввести следующий номер, поэтому цикл не прерываем
+                        return (
+                            _vuz2_down_text() or f"Не удалось получить данные по номеру студенческого билета {student_id}. Проверьте правильность введенного номера. Возможно сервер VUZ2 не отвечает. Попробуйте позже.\n\nВведите следующий номер студенческого билета или /cancel для выхода.",
+                            CANCEL_KEYBOARD_MARKUP
+                        )
+                    await run_blocking(
+                        _save_new_student, student_id, name, grades, subjects, course_works,
+                        "added by admin", admin_group, is_admin=False
                     )
-                
-                # Уведомляем суперадминов о новом пользователе, добавленном админом
-                notification_text = (
-                    "🆕 <b>Новый пользователь добавлен администратором!</b>\n\n"
-                    f"• Имя: {name}\n"
-                    f"• Группа: {admin_group}\n"
-                    f"• Student ID: {student_id}\n"
-                    f"• Добавлен администратором группы"
-                )
-                await notify_superadmins(context.application, notification_text)
-                
-                await update.message.reply_text(
-                    f"Студент {name} добавлен в группу {admin_group}!\n\nВведите следующий номер студенческого билета или /cancel для выхода.",
-                    reply_markup=CANCEL_KEYBOARD_MARKUP
+
+                    # Уведомляем суперадминов о новом пользователе, добавленном админом
+                    notification_text = (
+                        "🆕 <b>Новый пользователь добавлен администратором!</b>\n\n"
+                        f"• Имя: {name}\n"
+                        f"• Группа: {admin_group}\n"
+                        f"• Student ID: {student_id}\n"
+                        f"• Добавлен администратором группы"
+                    )
+                    await notify_superadmins(context.application, notification_text)
+                    return (
+                        f"Студент {name} добавлен в группу {admin_group}!\n\nВведите следующий номер студенческого билета или /cancel для выхода.",
+                        CANCEL_KEYBOARD_MARKUP
+                    )
+
+                await registration_jobs.submit(
+                    update.message, add_student_job,
+                    f"Добавляю студента {student_id}, пожалуйста, подождите...",
+                    description=f"добавление студента {student_id}"
                 )
                 # context.user_data['awaiting_add_student_id'] оставляем True для продолжения цикла
                 return
@@ -529,8 +598,9 @@ async def handle_message(update, context):
                     )
                     return
                 else:
+                    await _send_rating_with_refresh(update.message, student_id)
                     await update.message.reply_text(
-                        f"Студент {name} уже является членом группы {admin_group}.\n\nВведите следующий номер студенческого билета или /cancel для выхода.",
+                        f"Студент {name} уже является членом группы {admin_group}, его оценки обновляются.\n\nВведите следующий номер студенческого билета или /cancel для выхода.",
                         reply_markup=CANCEL_KEYBOARD_MARKUP
                     )
                     return
@@ -572,78 +642,42 @@ async def handle_message(update, context):
     if context.user_data.get('awaiting_superadmin_group'):
         student_group = update.message.text.strip().upper()
         student_id = context.user_data.get('temp_superadmin_student_id')
-        # Сообщаем пользователю о начале процесса
-        if not context.user_data.get('superadmin_registration_in_progress'):
-            context.user_data['superadmin_registration_in_progress'] = True
-            await update.message.reply_text(
-                "Идет регистрация пользователя, пожалуйста, подождите... Это может занять до минуты.",
-                reply_markup=REPLY_KEYBOARD_MARKUP
-            )
-        # Парсим только если еще не парсили для этого студента в этой сессии
-        if 'temp_superadmin_parsed_student_id' in context.user_data and context.user_data['temp_superadmin_parsed_student_id'] == student_id:
-            name = context.user_data['temp_superadmin_name']
-            grades = context.user_data['temp_superadmin_grades']
-            subjects = context.user_data['temp_superadmin_subjects']
-            course_works = context.user_data['temp_superadmin_course_works']
-        else:
-            name, grades, subjects, course_works = parse_student_data(student_id)
-            context.user_data['temp_superadmin_name'] = name
-            context.user_data['temp_superadmin_grades'] = grades
-            context.user_data['temp_superadmin_subjects'] = subjects
-            context.user_data['temp_superadmin_course_works'] = course_works
-            context.user_data['temp_superadmin_parsed_student_id'] = student_id
-        if name == "Unknown":
-            context.user_data.pop('superadmin_registration_in_progress', None)
-            await update.message.reply_text(
-                "Не удалось получить данные по номеру студенческого билета. Проверьте правильность номера или сервер VUZ2 не отвечает. Попробуйте позже.\n\nВы можете отменить действие командой /cancel.",
-                reply_markup=CANCEL_KEYBOARD_MARKUP
-            )
-            context.user_data.clear()
+        superadmin_id = update.effective_user.id
+        if await _reply_if_vuz2_down(update.message):
             return
-        try:
-            save_to_db(
-                student_id=student_id,
-                name=name,
-                grades=grades,
-                subjects=subjects,
-                telegram_id="added_by_superadmin",
-                student_group=student_group,
-                is_admin=False
-            )
-            for cw in course_works:
-                from utils import save_course_work_to_db
-                save_course_work_to_db(
-                    student_id=student_id,
-                    name=name,
-                    telegram_id="added_by_superadmin",
-                    student_group=student_group,
-                    discipline=cw.get('discipline'),
-                    file_path=cw.get('file_path'),
-                    semester=cw.get('semester')
-                )
-            
-            # Уведомляем других суперадминов о новом пользователе
-            notification_text = (
-                "🆕 <b>Новый пользователь добавлен суперадминистратором!</b>\n\n"
-                f"• Имя: {name}\n"
-                f"• Группа: {student_group}\n"
-                f"• Student ID: {student_id}"
-            )
-            await notify_superadmins(context.application, notification_text)
-            
-            context.user_data.pop('superadmin_registration_in_progress', None)
-            await update.message.reply_text(
-                f"Пользователь {name} успешно добавлен в группу {student_group}.",
-                reply_markup=REPLY_KEYBOARD_MARKUP
-            )
-        except Exception as e:
-            context.user_data.pop('superadmin_registration_in_progress', None)
-            logger.error(f"Ошибка при добавлении пользователя суперадмином (user_id: {update.effective_user.id}): {e}")
-            await update.message.reply_text(
-                "Произошла ошибка при добавлении пользователя.",
-                reply_markup=REPLY_KEYBOARD_MARKUP
-            )
         context.user_data.clear()
+
+        async def superadmin_add_job():
+            name, grades, subjects, course_works = await parse_student_data(student_id, use_cache=True)
+            if name == "Unknown":
+                return (
+                    _vuz2_down_text() or "Не удалось получить данные по номеру студенческого билета. Проверьте правильность номера или сервер VUZ2 не отвечает. Попробуйте позже.\n\nВы можете отменить действие командой /cancel.",
+                    CANCEL_KEYBOARD_MARKUP
+                )
+            try:
+                await run_blocking(
+                    _save_new_student, student_id, name, grades, subjects, course_works,
+                    "added_by_superadmin", student_group, is_admin=False
+                )
+
+                # Уведомляем других суперадминов о новом пользователе
+                notification_text = (
+                    "🆕 <b>Новый пользователь добавлен суперадминистратором!</b>\n\n"
+                    f"• Имя: {name}\n"
+                    f"• Группа: {student_group}\n"
+                    f"• Student ID: {student_id}"
+                )
+                await notify_superadmins(context.application, notification_text)
+                return f"Пользователь {name} успешно добавлен в группу {student_group}.", None
+            except Exception as e:
+                logger.error(f"Ошибка при добавлении пользователя суперадмином (user_id: {superadmin_id}): {e}")
+                return "Произошла ошибка при добавлении пользователя.", None
+
+        await registration_jobs.submit(
+            update.message, superadmin_add_job,
+            "Идет регистрация пользователя, пожалуйста, подождите... Это может занять до минуты.",
+            description=f"добавление пользователя {student_id} суперадминистратором"
+        )
         return
 
     if context.user_data.get('awaiting_title'):
@@ -853,8 +887,7 @@ async def handle_message(update, context):
                 keyboard = []
                 cursor.execute('SELECT * FROM disciplines WHERE group_name=?', (group,))
                 disciplines = cursor.fetchone()
-                cursor.execute('PRAGMA table_info(disciplines)')
-                columns = {row[1]: idx for idx, row in enumerate(cursor.fetchall())}
+                columns = {desc[0]: idx for idx, desc in enumerate(cursor.description)}
                 if disciplines:
                     for i in range(1, 31):
                         disc_field = f'disc_{i}'
@@ -1013,12 +1046,9 @@ async def handle_inline_buttons(update, context):
     logger.info(f"Нажата inline кнопка {callback_data} пользователем {user_id}")
     telegram_id = str(update.effective_user.id)
 
-    # --- Вытаскиваем is_superadmin ---
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    # --- Вытаскиваем is_superadmin (и отмечаем активность пользователя) ---
     try:
-        cursor.execute('SELECT student_id, student_group, is_admin, is_superadmin FROM students WHERE telegram_id=?', (telegram_id,))
-        student_row = cursor.fetchone()
+        student_row = await get_profile(telegram_id, touch_activity=True)
         if student_row:
             student_id, student_group, is_admin, is_superadmin = student_row
         else:
@@ -1026,8 +1056,6 @@ async def handle_inline_buttons(update, context):
     except Exception as e:
         logger.error(f"Ошибка при получении профиля: {e}")
         student_id, student_group, is_admin, is_superadmin = None, None, 0, 0
-    finally:
-        conn.close()
     is_registered = student_id is not None
 
     if not is_registered:
@@ -1046,21 +1074,12 @@ async def handle_inline_buttons(update, context):
                 reply_markup=REPLY_KEYBOARD_MARKUP
             )
             return
-        conn = get_db_connection()
-        cursor = conn.cursor()
         try:
-            cursor.execute("SELECT * FROM students WHERE student_id=?", (student_id,))
-            row = cursor.fetchone()
-            columns = [desc[0] for desc in cursor.description]
-            student_data = dict(zip(columns, row))
-            name = student_data.get('name', 'Неизвестно')
-            message = format_ratings_table(name, student_data)
-            await query.message.reply_text(message, parse_mode='HTML', reply_markup=REPLY_KEYBOARD_MARKUP)
+            message = await get_student_rating(student_id)
+            await query.message.reply_text(message, parse_mode='HTML', reply_markup=rating_refresh_markup(student_id))
         except Exception as e:
             logger.error(f"Database error: {e}")
             await query.message.reply_text("Произошла ошибка при получении данных.\n\nВы можете вернуться в главное меню командой /cancel.")
-        finally:
-            conn.close()
 
     elif callback_data == 'group':
         if not is_registered:
@@ -1069,23 +1088,15 @@ async def handle_inline_buttons(update, context):
                 reply_markup=REPLY_KEYBOARD_MARKUP
             )
             return
-        conn = get_db_connection()
-        cursor = conn.cursor()
         try:
-            cursor.execute('SELECT student_id, name FROM students WHERE student_group=? ORDER BY name', (student_group,))
-            students = cursor.fetchall()
-            keyboard = [[InlineKeyboardButton(name, callback_data=f"student_{student_id}")] for student_id, name in students]
-            if is_admin:
-                keyboard.append([InlineKeyboardButton("Добавить студента", callback_data='add_student')])
+            students = await get_group_students(student_group)
             await query.message.reply_text(
                 f"Студенты вашей группы ({student_group}):",
-                reply_markup=InlineKeyboardMarkup(keyboard)
+                reply_markup=group_students_markup(students, is_admin)
             )
         except Exception as e:
             logger.error(f"Database error in group handler (user_id: {update.effective_user.id}): {e}")
             await query.message.reply_text("Произошла ошибка при обработке запроса.\n\nВы можете вернуться в главное меню командой /cancel.")
-        finally:
-            conn.close()
 
     elif callback_data == 'disciplines':
         if not is_registered:
@@ -1094,25 +1105,14 @@ async def handle_inline_buttons(update, context):
                 reply_markup=REPLY_KEYBOARD_MARKUP
             )
             return
-        conn = get_db_connection()
-        cursor = conn.cursor()
         try:
-            cursor.execute("SELECT * FROM students WHERE student_id=?", (student_id,))
-            row = cursor.fetchone()
-            if not row:
+            disciplines = await get_student_subjects(student_id)
+            if disciplines is None:
                 await query.message.reply_text(
                     "Данные студента не найдены.",
                     reply_markup=REPLY_KEYBOARD_MARKUP
                 )
                 return
-            columns = [desc[0] for desc in cursor.description]
-            student_data = dict(zip(columns, row))
-            disciplines = []
-            for col in columns:
-                if "(модуль" in col and student_data[col] != "не изучает":
-                    disc_name = col.split(' (модуль')[0].strip()
-                    if disc_name and disc_name not in disciplines:
-                        disciplines.append(disc_name)
             if not disciplines:
                 await query.message.reply_text(
                     "Вы не изучаете ни одной дисциплины.",
@@ -1134,8 +1134,6 @@ async def handle_inline_buttons(update, context):
         except Exception as e:
             logger.error(f"Database error in disciplines handler (user_id: {update.effective_user.id}): {e}")
             await query.message.reply_text("Произошла ошибка при обработке запроса.\n\nВы можете вернуться в главное меню командой /cancel.")
-        finally:
-            conn.close()
 
     elif callback_data.startswith('discipline_'):
         if not is_registered:
@@ -1145,75 +1143,38 @@ async def handle_inline_buttons(update, context):
             )
             return
         try:
-            discipline_key = callback_data[len('discipline_'):]
-            logger.info(f"Получен callback: {discipline_key}")
+            map_key = callback_data[len('discipline_'):]
+            logger.info(f"Получен callback: {map_key}")
             logger.info(f"Текущий discipline_map: {context.user_data.get('discipline_map', {})}")
-            discipline_name = context.user_data.get('discipline_map', {}).get(discipline_key)
+            discipline_name = context.user_data.get('discipline_map', {}).get(map_key)
             if not discipline_name:
-                logger.error(f"Discipline not found in discipline_map for callback_data: {discipline_key}")
+                logger.error(f"Discipline not found in discipline_map for callback_data: {map_key}")
                 await query.message.reply_text(
                     "Ошибка: дисциплина не найдена. Попробуйте снова.",
                     reply_markup=REPLY_KEYBOARD_MARKUP
                 )
                 return
-            conn = None
             try:
-                conn = get_db_connection()
-                cursor = conn.cursor()
-                cursor.execute('SELECT student_group FROM students WHERE telegram_id=?', (telegram_id,))
-                result = cursor.fetchone()
-                if not result:
+                if not student_group:
                     await query.message.reply_text(
                         "Группа не найдена. Пожалуйста, зарегистрируйтесь заново.",
                         reply_markup=REPLY_KEYBOARD_MARKUP
                     )
                     return
-                student_group = result[0]
-                # Проверяем, что нужные столбцы существуют в таблице
-                module1_col = f'{discipline_name} (модуль 1)'
-                module2_col = f'{discipline_name} (модуль 2)'
-                cursor.execute('PRAGMA table_info(students)')
-                columns_info = [col[1] for col in cursor.fetchall()]
-                def normalize_colname(s):
-                    return re.sub(r'\s+', ' ', s.strip().lower())
-                norm_module1 = normalize_colname(module1_col)
-                norm_module2 = normalize_colname(module2_col)
-                module1_col_real = next((c for c in columns_info if normalize_colname(c) == norm_module1), None)
-                module2_col_real = next((c for c in columns_info if normalize_colname(c) == norm_module2), None)
-                if not module1_col_real or not module2_col_real:
-                    await query.message.reply_text(
-                        f"Ошибка: не найден столбец для дисциплины '{discipline_name}' в таблице студентов.\nПопробуйте вручную проверить названия столбцов в базе данных.",
-                        reply_markup=REPLY_KEYBOARD_MARKUP
-                    )
-                    return
-                module1_col_sql = f'"{module1_col_real}"'
-                module2_col_sql = f'"{module2_col_real}"'
-                sql_query = f'SELECT student_id, name, {module1_col_sql}, {module2_col_sql} FROM students WHERE student_group=? ORDER BY name'
-                cursor.execute(sql_query, (student_group,))
-                students = cursor.fetchall()
-                if not students:
+                group_data, has_course_works = await get_discipline_view(student_group, discipline_name)
+                if not group_data:
                     await query.message.reply_text(
                         "В вашей группе нет студентов, изучающих эту дисциплину.",
                         reply_markup=REPLY_KEYBOARD_MARKUP
                     )
                     return
-                group_data = []
-                for student in students:
-                    student_id, name, m1, m2 = student
-                    grades = {
-                        f"{discipline_name} (модуль 1)": m1 if m1 not in ["не изучает", None, "None"] else "-",
-                        f"{discipline_name} (модуль 2)": m2 if m2 not in ["не изучает", None, "None"] else "-"
-                    }
-                    group_data.append((name, grades))
                 message = format_ratings_table(discipline_name, group_data, is_group=True)
 
-                # Проверяем наличие курсовых работ по дисциплине (для всех групп)
-                cursor.execute('SELECT COUNT(*) FROM course_works WHERE TRIM(LOWER(discipline))=TRIM(LOWER(?))', (discipline_name,))
-                cw_count = cursor.fetchone()[0]
-                if cw_count > 0:
+                # Курсовые работы по дисциплине (для всех групп)
+                if has_course_works:
                     # Добавляем кнопку "Курсовые работы" с коротким ключом
                     keyboard = [
-                        [InlineKeyboardButton("Курсовые работы", callback_data=f"courseworks_{discipline_key}")]
+                        [InlineKeyboardButton("Курсовые работы", callback_data=f"courseworks_{map_key}")]
                     ]
                     await query.message.reply_text(
                         message,
@@ -1229,33 +1190,27 @@ async def handle_inline_buttons(update, context):
             except Exception as e:
                 logger.error(f"Error displaying discipline ratings (user_id: {update.effective_user.id}): {e}")
                 await query.message.reply_text("Произошла ошибка при получении данных.\n\nВы можете вернуться в главное меню командой /cancel.")
-            finally:
-                if conn:
-                    conn.close()
         except Exception as inner_error:
             logger.error(f"Unexpected error in discipline handler: {inner_error}")
 
     elif callback_data.startswith('courseworks_'):
         # --- Показываем список курсовых работ по дисциплине ---
-        discipline_key = callback_data[len('courseworks_'):]
+        map_key = callback_data[len('courseworks_'):]
         # Логируем ключ дисциплины
-        logger.info(f"courseworks_: discipline_key={discipline_key}")
+        logger.info(f"courseworks_: map_key={map_key}")
         # Получаем название дисциплины по ключу из user_data
-        discipline_name = context.user_data.get('discipline_map', {}).get(discipline_key)
+        discipline_name = context.user_data.get('discipline_map', {}).get(map_key)
         logger.info(f"courseworks_: discipline_name={discipline_name}")
         if not discipline_name:
-            logger.error(f"courseworks_: Не найдено название дисциплины по ключу {discipline_key}. discipline_map={context.user_data.get('discipline_map', {})}")
+            logger.error(f"courseworks_: Не найдено название дисциплины по ключу {map_key}. discipline_map={context.user_data.get('discipline_map', {})}")
             await query.message.reply_text(
                 "Ошибка: дисциплина не найдена. Попробуйте снова.",
                 reply_markup=REPLY_KEYBOARD_MARKUP
             )
             return
-        conn = get_db_connection()
-        cursor = conn.cursor()
         try:
             # Получаем все курсовые работы по дисциплине (без фильтра по группе)
-            cursor.execute('SELECT name, discipline, file_path, semester, student_group FROM course_works WHERE TRIM(LOWER(discipline))=TRIM(LOWER(?))', (discipline_name,))
-            course_works = cursor.fetchall()
+            course_works = await get_discipline_course_works(discipline_name)
             logger.info(f"courseworks_: найдено {len(course_works)} курсовых работ по дисциплине {discipline_name}")
             if not course_works:
                 await query.message.reply_text(
@@ -1265,17 +1220,17 @@ async def handle_inline_buttons(update, context):
                 return
             buttons = []
             coursework_map = {}
-            for idx, (name, discipline, file_path, semester, student_group) in enumerate(course_works, 1):
-                # Получаем только имя архива без папки
-                filename = os.path.basename(file_path)
+            for idx, (name, discipline, file_path, semester, student_group, original_name) in enumerate(course_works, 1):
+                # Файлы лежат в хранилище под хешем, пользователю показываем исходное имя
+                filename = original_name or os.path.basename(file_path)
                 btn_text = filename
                 cw_key = f"cw{idx}"
                 norm_file_path = os.path.normpath(file_path) if file_path else file_path
-                coursework_map[cw_key] = norm_file_path
+                coursework_map[cw_key] = (norm_file_path, filename)
                 logger.info(f"courseworks_: добавлен coursework_map[{cw_key}]={norm_file_path}")
                 buttons.append([InlineKeyboardButton(btn_text, callback_data=f"getcw_{cw_key}")])
             # Кнопка для скачивания всех работ архивом
-            buttons.append([InlineKeyboardButton("Скачать все архивом", callback_data=f"getcwzip_{discipline_key}")])
+            buttons.append([InlineKeyboardButton("Скачать все архивом", callback_data=f"getcwzip_{map_key}")])
             # Сохраняем map в user_data
             context.user_data['coursework_map'] = coursework_map
             logger.info(f"courseworks_: coursework_map={coursework_map}")
@@ -1290,13 +1245,11 @@ async def handle_inline_buttons(update, context):
                 "Произошла ошибка при получении курсовых работ.",
                 reply_markup=REPLY_KEYBOARD_MARKUP
             )
-        finally:
-            conn.close()
     elif callback_data.startswith('getcw_'):
         # --- Отправка отдельной курсовой работы ---
         cw_key = callback_data[len('getcw_'):]
         # Получаем путь к файлу из сохранённой map
-        file_path = context.user_data.get('coursework_map', {}).get(cw_key)
+        file_path, filename = context.user_data.get('coursework_map', {}).get(cw_key, (None, None))
         norm_file_path = os.path.normpath(file_path) if file_path else file_path
         logger.info(f"getcw_: cw_key={cw_key}, file_path={norm_file_path}")
         # Проверяем, существует ли файл физически
@@ -1312,7 +1265,7 @@ async def handle_inline_buttons(update, context):
         try:
             with open(norm_file_path, 'rb') as f:
                 logger.info(f"getcw_: отправка файла {norm_file_path}")
-                await query.message.reply_document(f, filename=os.path.basename(norm_file_path))
+                await query.message.reply_document(f, filename=filename or os.path.basename(norm_file_path))
         except Exception as e:
             logger.error(f"Ошибка при отправке файла {norm_file_path}: {e}")
             await query.message.reply_text(
@@ -1322,13 +1275,13 @@ async def handle_inline_buttons(update, context):
 
     elif callback_data.startswith('getcwzip_'):
         # --- Отправка архива всех курсовых работ по дисциплине ---
-        discipline_key = callback_data[len('getcwzip_'):]
-        logger.info(f"getcwzip_: discipline_key={discipline_key}")
-        discipline_name = context.user_data.get('discipline_map', {}).get(discipline_key)
+        map_key = callback_data[len('getcwzip_'):]
+        logger.info(f"getcwzip_: map_key={map_key}")
+        discipline_name = context.user_data.get('discipline_map', {}).get(map_key)
         logger.info(f"getcwzip_: discipline_name={discipline_name}")
         
         if not discipline_name:
-            logger.error(f"getcwzip_: Не найдено название дисциплины по ключу {discipline_key}. discipline_map={context.user_data.get('discipline_map', {})}")
+            logger.error(f"getcwzip_: Не найдено название дисциплины по ключу {map_key}. discipline_map={context.user_data.get('discipline_map', {})}")
             await query.message.reply_text(
                 "Ошибка: дисциплина не найдена. Попробуйте снова.",
                 reply_markup=REPLY_KEYBOARD_MARKUP
@@ -1353,16 +1306,9 @@ async def handle_inline_buttons(update, context):
                 return
 
             # Получаем все части архива из базы данных
-            with get_db_connection() as conn:
-                cursor = conn.cursor()
-                cursor.execute('SELECT archive_parts FROM course_work_archives WHERE discipline=?', (discipline_name,))
-                result = cursor.fetchone()
-                if result and result[0]:
-                    try:
-                        archive_paths = json.loads(result[0])
-                    except json.JSONDecodeError:
-                        logger.error(f"Ошибка при декодировании JSON для archive_parts: {result[0]}")
-                        archive_paths = []
+            stored_parts = await get_archive_parts(discipline_name)
+            if stored_parts is not None:
+                archive_paths = stored_parts
 
             # Обновляем статус
             total_parts = len(archive_paths)
@@ -1459,6 +1405,8 @@ async def handle_inline_buttons(update, context):
             keyboard.append([InlineKeyboardButton("➕ Добавить пользователя другой группы", callback_data='add_other_group_user')])
             keyboard.append([InlineKeyboardButton("📢 Отправить системное уведомление", callback_data='send_notification')])
             keyboard.append([InlineKeyboardButton("📋 Получить лог бота", callback_data='get_bot_log')])
+            keyboard.append([InlineKeyboardButton("🩺 Состояние VUZ2", callback_data='vuz2_status')])
+            keyboard.append([InlineKeyboardButton("💾 Резервные копии", callback_data='backup_status')])
         
         await query.message.reply_text(
             "⚙️ Настройки\n"
@@ -1547,8 +1495,7 @@ async def handle_inline_buttons(update, context):
             disciplines = cursor.fetchone()
             
             # Получаем имена колонок
-            cursor.execute('PRAGMA table_info(disciplines)')
-            columns = {row[1]: idx for idx, row in enumerate(cursor.fetchall())}
+            columns = {desc[0]: idx for idx, desc in enumerate(cursor.description)}
             
             keyboard = []
             if disciplines:
@@ -1682,37 +1629,19 @@ async def handle_inline_buttons(update, context):
 
     elif callback_data == 'schedule_today':
         # Получаем расписание на сегодня
-        conn = get_db_connection()
-        cursor = conn.cursor()
         try:
-            # Получаем группу пользователя
-            cursor.execute('SELECT student_group, subgroup FROM students WHERE telegram_id=?', (telegram_id,))
-            result = cursor.fetchone()
+            # Определяем текущий день недели
+            weekday = datetime.now().strftime('%A').lower()
+
+            # Группа пользователя, тип недели и расписание
+            result = await get_schedule(telegram_id, weekday)
             if not result:
                 await query.message.reply_text(
                     "Ошибка: группа не найдена.",
                     reply_markup=REPLY_KEYBOARD_MARKUP
                 )
                 return
-                
-            group, subgroup = result
-            if not subgroup:
-                subgroup = 1  # По умолчанию первая подгруппа
-                
-            # Определяем текущий день недели
-            weekday = datetime.now().strftime('%A').lower()
-            
-            # Получаем тип недели из глобальной переменной
-            week_type = get_week_type()
-            
-            # Получаем расписание
-            group_full_name = f"{group}_sub{subgroup}_{week_type}"
-            cursor.execute(f'''
-                SELECT {weekday}_1, {weekday}_2, {weekday}_3, {weekday}_4, {weekday}_5
-                FROM raspisanie 
-                WHERE group_full_name=?
-            ''', (group_full_name,))
-            schedule = cursor.fetchone()
+            group, subgroup, week_type, schedule = result
             
             if not schedule:
                 await query.message.reply_text(
@@ -1740,29 +1669,11 @@ async def handle_inline_buttons(update, context):
                 "Произошла ошибка при получении расписания.",
                 reply_markup=REPLY_KEYBOARD_MARKUP
             )
-        finally:
-            conn.close()
         return
 
     elif callback_data == 'schedule_tomorrow':
         # Получаем расписание на завтра
-        conn = get_db_connection()
-        cursor = conn.cursor()
         try:
-            # Получаем группу пользователя
-            cursor.execute('SELECT student_group, subgroup FROM students WHERE telegram_id=?', (telegram_id,))
-            result = cursor.fetchone()
-            if not result:
-                await query.message.reply_text(
-                    "Ошибка: группа не найдена.",
-                    reply_markup=REPLY_KEYBOARD_MARKUP
-                )
-                return
-
-            group, subgroup = result
-            if not subgroup:
-                subgroup = 1  # По умолчанию первая подгруппа
-
             now = datetime.now()
             today_weekday = now.strftime('%A').lower()
             tomorrow = now + timedelta(days=1)
@@ -1770,25 +1681,25 @@ async def handle_inline_buttons(update, context):
             # Если сегодня воскресенье, показать расписание на понедельник противоположной недели
             if today_weekday == 'sunday':
                 weekday = 'monday'
-                week_type = get_week_type()
-                # Переключаем на противоположный тип недели
-                week_type = "DOWN" if week_type == "UP" else "UP"
+                opposite_week = True
                 # Для корректного отображения даты передаем дату следующего понедельника
                 days_until_monday = (7 - now.weekday()) % 7 or 7
                 next_monday = now + timedelta(days=days_until_monday)
                 date_obj = next_monday
             else:
                 weekday = tomorrow.strftime('%A').lower()
-                week_type = get_week_type()
+                opposite_week = False
                 date_obj = tomorrow
 
-            group_full_name = f"{group}_sub{subgroup}_{week_type}"
-            cursor.execute(f'''
-                SELECT {weekday}_1, {weekday}_2, {weekday}_3, {weekday}_4, {weekday}_5
-                FROM raspisanie 
-                WHERE group_full_name=?
-            ''', (group_full_name,))
-            schedule = cursor.fetchone()
+            # Группа пользователя, тип недели и расписание
+            result = await get_schedule(telegram_id, weekday, opposite_week)
+            if not result:
+                await query.message.reply_text(
+                    "Ошибка: группа не найдена.",
+                    reply_markup=REPLY_KEYBOARD_MARKUP
+                )
+                return
+            group, subgroup, week_type, schedule = result
 
             if not schedule:
                 await query.message.reply_text(
@@ -1816,8 +1727,6 @@ async def handle_inline_buttons(update, context):
                 "Произошла ошибка при получении расписания.",
                 reply_markup=REPLY_KEYBOARD_MARKUP
             )
-        finally:
-            conn.close()
         return
 
     elif callback_data.startswith('lessoninfo_today_') or callback_data.startswith('lessoninfo_window_today_'):
@@ -1854,35 +1763,18 @@ async def handle_inline_buttons(update, context):
         return
     elif callback_data == 'schedule_week':
         # Получаем расписание на неделю
-        conn = get_db_connection()
-        cursor = conn.cursor()
         try:
-            # Получаем группу пользователя
-            cursor.execute('SELECT student_group, subgroup FROM students WHERE telegram_id=?', (telegram_id,))
-            result = cursor.fetchone()
+            # Группа пользователя, тип недели и расписание на всю неделю
+            result = await get_schedule(telegram_id)
             if not result:
                 await query.message.reply_text(
                     "Ошибка: группа не найдена.",
                     reply_markup=REPLY_KEYBOARD_MARKUP
                 )
                 return
-                
-            group, subgroup = result
-            if not subgroup:
-                subgroup = 1  # По умолчанию первая подгруппа
-                
-            # Получаем тип недели
-            week_type = get_week_type()
+            group, subgroup, week_type, schedule_dict = result
             
-            # Получаем расписание на всю неделю
-            group_full_name = f"{group}_sub{subgroup}_{week_type}"
-            cursor.execute('''
-                SELECT * FROM raspisanie 
-                WHERE group_full_name=?
-            ''', (group_full_name,))
-            schedule = cursor.fetchone()
-            
-            if not schedule:
+            if not schedule_dict:
                 await query.message.reply_text(
                     "Расписание на неделю не найдено.",
                     reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("« Назад", callback_data='schedule')]])
@@ -1897,9 +1789,6 @@ async def handle_inline_buttons(update, context):
             days = ['Понедельник', 'Вторник', 'Среда', 'Четверг', 'Пятница', 'Суббота', 'Воскресенье']
             day_columns = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
 
-            columns = [desc[0] for desc in cursor.description]
-            schedule_dict = dict(zip(columns, schedule))
-
             for day_name, day_col in zip(days, day_columns):
                 lessons = []
                 active_lessons = []
@@ -1946,8 +1835,6 @@ async def handle_inline_buttons(update, context):
                 "Произошла ошибка при получении расписания.",
                 reply_markup=REPLY_KEYBOARD_MARKUP
             )
-        finally:
-            conn.close()
         return
 
     elif callback_data == 'edit_schedule':
@@ -2013,8 +1900,7 @@ async def handle_inline_buttons(update, context):
             logger.info(f"Найдено расписание: {bool(schedule)}")
             
             # Получаем имена колонок
-            cursor.execute('PRAGMA table_info(raspisanie)')
-            columns = {row[1]: idx for idx, row in enumerate(cursor.fetchall())}
+            columns = {desc[0]: idx for idx, desc in enumerate(cursor.description)}
             logger.info(f"Получены колонки таблицы raspisanie: {list(columns.keys())}")
             
             # Создаем клавиатуру с кнопками для каждого дня и пары
@@ -2190,8 +2076,7 @@ async def handle_inline_buttons(update, context):
                 return
             
             # Получаем имена колонок
-            cursor.execute('PRAGMA table_info(disciplines)')
-            columns = {row[1]: idx for idx, row in enumerate(cursor.fetchall())}
+            columns = {desc[0]: idx for idx, desc in enumerate(cursor.description)}
             
             # Создаем клавиатуру с активными дисциплинами
             keyboard = []
@@ -2937,6 +2822,83 @@ async def handle_inline_buttons(update, context):
             )
         return
 
+    elif callback_data == 'vuz2_status':
+        if not is_superadmin:
+            await query.message.reply_text(
+                "У вас нет прав для выполнения этого действия.",
+                reply_markup=REPLY_KEYBOARD_MARKUP
+            )
+            return
+        status = vuz2_client.breaker.status()
+        state_names = {'closed': '🟢 доступен', 'open': '🔴 недоступен', 'half_open': '🟡 пробный запрос'}
+        avg_latency = f"{status['avg_latency']:.2f} с" if status['avg_latency'] is not None else '-'
+        message = (
+            "🩺 <b>Состояние VUZ2</b>\n\n"
+            f"• Статус: {state_names.get(status['state'], status['state'])}\n"
+            f"• Доля ошибок: {status['error_rate']:.0%} (последние {status['requests_in_window']} запросов)\n"
+            f"• Среднее время ответа: {avg_latency}\n"
+            f"• Отклонено запросов: {status['rejected']}\n"
+        )
+        if status['state'] == 'open':
+            message += f"• Пробный запрос через: {status['retry_after']:.0f} с\n"
+        if status['opened_at']:
+            message += f"• Недоступен с: {status['opened_at'].strftime('%d.%m.%Y %H:%M:%S')}\n"
+        if status['last_error']:
+            message += f"• Последняя ошибка: {html.escape(status['last_error'][:300])}\n"
+        load = await run_db(scrape_load_report, 60)
+        changes = await run_db(grade_change_summary, 24)
+        message += (
+            "\n<b>Парсинг</b>\n"
+            f"• Студентов в обычном режиме: {load['active']}, в медленном: {load['slow']}, выведено: {load['retired']}\n"
+            f"• Проверок оценок в час: ~{load['scrapes']:.0f} вместо ~{load['scrapes_without_lanes']:.0f} без учета активности\n"
+            f"• Проверок портфолио в час: ~{load['portfolio_scrapes']:.0f}\n"
+            f"• Изменений оценок за сутки: {changes['events']} у {changes['students']} студентов\n"
+        )
+        await query.message.reply_text(
+            message,
+            parse_mode='HTML',
+            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("« Назад", callback_data='settings')]])
+        )
+        return
+
+    elif callback_data == 'backup_status':
+        if not is_superadmin:
+            await query.message.reply_text(
+                "У вас нет прав для выполнения этого действия.",
+                reply_markup=REPLY_KEYBOARD_MARKUP
+            )
+            return
+        report = await run_db(backup_report)
+        message = "💾 <b>Резервные копии базы</b>\n\n"
+        last_success = report['last_success']
+        if last_success:
+            finished_at = datetime.fromisoformat(last_success['finished_at'])
+            message += (
+                f"• Последняя копия: {finished_at.strftime('%d.%m.%Y %H:%M:%S')}\n"
+                f"• Файл: {html.escape(os.path.basename(last_success['file']))}\n"
+                f"• Размер: {last_success['size'] / 1024 / 1024:.1f} МБ\n"
+                f"• Длительность: {last_success['duration']:.1f} с "
+                f"(шагов {last_success['steps']}, перезапусков {last_success['restarts']})\n"
+                f"• Проверка целостности: {html.escape(last_success['integrity'] or '-')}\n"
+            )
+        else:
+            message += "• Копий еще не было\n"
+        last = report['last']
+        if last and last['error']:
+            started_at = datetime.fromisoformat(last['started_at'])
+            message += f"• ❌ Ошибка {started_at.strftime('%d.%m.%Y %H:%M')}: {html.escape(last['error'][:300])}\n"
+        message += (
+            f"\n• Хранится копий: {report['files']} из {BACKUP_SETTINGS['keep']}, "
+            f"всего {report['total_size'] / 1024 / 1024:.1f} МБ\n"
+            f"• Интервал: {BACKUP_SETTINGS['interval_hours']} ч\n"
+        )
+        await query.message.reply_text(
+            message,
+            parse_mode='HTML',
+            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("« Назад", callback_data='settings')]])
+        )
+        return
+
     elif callback_data == 'notification_settings':
         keyboard = InlineKeyboardMarkup([
             [
@@ -2953,12 +2915,9 @@ async def handle_inline_buttons(update, context):
         return
 
     elif callback_data in ['notifications_on', 'notifications_off']:
-        conn = get_db_connection()
-        cursor = conn.cursor()
         try:
             new_value = 1 if callback_data == 'notifications_on' else 0
-            cursor.execute('UPDATE students SET notifications=? WHERE telegram_id=?', (new_value, telegram_id))
-            conn.commit()
+            await set_notifications(telegram_id, new_value)
             status = "включены" if new_value else "отключены"
             back_keyboard = InlineKeyboardMarkup([[
                 InlineKeyboardButton("« Назад", callback_data="notifications_menu")
@@ -2974,8 +2933,6 @@ async def handle_inline_buttons(update, context):
                 "❌ Произошла ошибка при сохранении настроек.",
                 reply_markup=REPLY_KEYBOARD_MARKUP
             )
-        finally:
-            conn.close()
         return
 
     elif callback_data == 'send_notification':
@@ -3016,13 +2973,10 @@ async def handle_inline_buttons(update, context):
                 reply_markup=REPLY_KEYBOARD_MARKUP
             )
             return
-        conn = get_db_connection()
-        cursor = conn.cursor()
         try:
-            cursor.execute('SELECT DISTINCT student_group FROM students WHERE student_group IS NOT NULL ORDER BY student_group')
-            groups = cursor.fetchall()
+            groups = await get_student_groups()
             keyboard = []
-            for (group,) in groups:
+            for group in groups:
                 keyboard.append([InlineKeyboardButton(group, callback_data=f'notify_group_{group}')])
             keyboard.append([InlineKeyboardButton("« Назад", callback_data='send_notification')])
             await query.message.reply_text(
@@ -3035,8 +2989,6 @@ async def handle_inline_buttons(update, context):
                 "Произошла ошибка при получении списка групп.",
                 reply_markup=REPLY_KEYBOARD_MARKUP
             )
-        finally:
-            conn.close()
         return
 
     elif callback_data.startswith('notify_group_'):
@@ -3103,28 +3055,78 @@ async def handle_inline_buttons(update, context):
         return
 
     elif callback_data.startswith('student_'):
-        student_id = callback_data.split('_')[1]
-        conn = get_db_connection()
-        cursor = conn.cursor()
+        own_student_id, student_id = student_id, callback_data.split('_')[1]
         try:
-            cursor.execute("SELECT * FROM students WHERE student_id=?", (student_id,))
-            row = cursor.fetchone()
-            if not row:
+            view = await get_student_rating_view(student_id)
+            if not view:
                 await query.message.reply_text(
                     "Студент не найден.",
                     reply_markup=REPLY_KEYBOARD_MARKUP
                 )
                 return
-            columns = [desc[0] for desc in cursor.description]
-            student_data = dict(zip(columns, row))
-            name = student_data.get('name', 'Неизвестно')
-            message = format_ratings_table(name, student_data)
-            await query.message.reply_text(message, parse_mode='HTML', reply_markup=REPLY_KEYBOARD_MARKUP)
+            name, rated_group, grades = view
+            message = format_ratings_table(name or 'Неизвестно', grades)
+            # Обновить оценки может сам студент и администратор его группы
+            can_refresh = (
+                student_id == own_student_id or is_superadmin
+                or (is_admin and rated_group == student_group)
+            )
+            reply_markup = rating_refresh_markup(student_id) if can_refresh else REPLY_KEYBOARD_MARKUP
+            await query.message.reply_text(message, parse_mode='HTML', reply_markup=reply_markup)
         except Exception as e:
             logger.error(f"Database error: {e}")
             await query.message.reply_text("Произошла ошибка при получении данных.\n\nВы можете вернуться в главное меню командой /cancel.")
-        finally:
-            conn.close()
+        return
+
+    elif callback_data == 'refreshgroup':
+        if not (is_admin or is_superadmin):
+            await query.message.reply_text(
+                "У вас нет прав для выполнения этого действия.",
+                reply_markup=REPLY_KEYBOARD_MARKUP
+            )
+            return
+        if await _reply_if_vuz2_down(query.message):
+            return
+        try:
+            count = await run_db(request_group_refresh, student_group, query.message.chat_id, query.message.message_id)
+            # Список группы в этом сообщении обновит бот, когда будут проверены все студенты
+            students = await get_group_students(student_group)
+            await query.edit_message_text(
+                f"Студенты вашей группы ({student_group}):\n⏳ Обновляю оценки {count} студентов...",
+                reply_markup=group_students_markup(students, is_admin=True, refresh_in_progress=True)
+            )
+        except Exception as e:
+            logger.error(f"Ошибка при обновлении группы {student_group}: {e}")
+            await query.message.reply_text("Произошла ошибка при обработке запроса.\n\nВы можете вернуться в главное меню командой /cancel.")
+        return
+
+    elif callback_data.startswith('refresh_'):
+        target_id = callback_data[len('refresh_'):]
+        try:
+            target_group = await get_student_group(target_id)
+            if not (target_id == student_id or is_superadmin or (is_admin and target_group == student_group)):
+                await query.message.reply_text(
+                    "У вас нет прав для выполнения этого действия.",
+                    reply_markup=REPLY_KEYBOARD_MARKUP
+                )
+                return
+            if await _reply_if_vuz2_down(query.message):
+                return
+            status = await run_db(request_refresh, target_id, query.message.chat_id, query.message.message_id)
+            if status == REFRESH_FRESH:
+                # Оценки только что проверены - показываем сохраненные без запроса к VUZ2
+                text = await run_db(
+                    render_student_rating, target_id, f"🕒 Данные актуальны на {datetime.now().strftime('%H:%M')}"
+                )
+                await query.edit_message_text(text, parse_mode='HTML', reply_markup=rating_refresh_markup(target_id))
+            else:
+                # Таблицу в этом сообщении обновит бот, когда задача будет выполнена
+                await query.edit_message_reply_markup(reply_markup=rating_refresh_markup(target_id, in_progress=True))
+        except Exception as e:
+            if 'not modified' in str(e).lower():
+                return
+            logger.error(f"Ошибка при запросе обновления студента {target_id}: {e}")
+            await query.message.reply_text("Произошла ошибка при обработке запроса.\n\nВы можете вернуться в главное меню командой /cancel.")
         return
 
     elif callback_data == 'set_week_type':
@@ -3136,12 +3138,8 @@ async def handle_inline_buttons(update, context):
             return
             
         # Получаем текущие настройки из базы данных
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute('SELECT value FROM bot_settings WHERE key=?', ('week_type',))
-            result = cursor.fetchone()
-            settings = json.loads(result[0]) if result else {'current_type': 'UP', 'auto_switch': True}
-            
+        settings = await get_week_settings()
+
         current_type = settings['current_type']
         auto_switch = settings.get('auto_switch', True)
         last_change = settings.get('last_change', 'Неизвестно')
@@ -3172,7 +3170,7 @@ async def handle_inline_buttons(update, context):
             return
             
         new_type = 'UP' if callback_data == 'set_week_up' else 'DOWN'
-        set_week_type_settings(new_type=new_type)
+        await set_week_type(new_type=new_type)
         
         keyboard = [
             [
@@ -3196,11 +3194,7 @@ async def settings_menu(update, context):
         await update.message.reply_text("У вас нет доступа к этому разделу.")
         return
 
-    with get_db_connection() as conn:
-        cursor = conn.cursor()
-        cursor.execute('SELECT value FROM bot_settings WHERE key=?', ('week_type',))
-        result = cursor.fetchone()
-        settings = json.loads(result[0]) if result else {'current_type': 'UP', 'auto_switch': True}
+    settings = await get_week_settings()
 
     current_type = settings['current_type']
     auto_switch = settings.get('auto_switch', True)
@@ -3235,21 +3229,12 @@ async def handle_settings_callback(update, context):
         return
 
     if query.data == 'toggle_week_type':
-        current_settings = set_week_type_settings(
-            new_type='DOWN' if get_week_type() == 'UP' else 'UP'
-        )
+        current_settings = await toggle_week_type()
         new_type = current_settings['current_type']
         auto_switch = current_settings['auto_switch']
 
     elif query.data == 'toggle_auto_switch':
-        current_settings = set_week_type_settings(
-            auto_switch=not json.loads(
-                get_db_connection().execute(
-                    'SELECT value FROM bot_settings WHERE key=?', 
-                    ('week_type',)
-                ).fetchone()[0]
-            )['auto_switch']
-        )
+        current_settings = await toggle_auto_switch()
         new_type = current_settings['current_type']
         auto_switch = current_settings['auto_switch']
 
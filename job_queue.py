@@ -0,0 +1,262 @@
+import os
+import socket
+import asyncio
+import random
+import datetime
+from utils import logger, config, get_db_connection
+
+# Настройки очереди задач парсинга (переопределяются секцией "job_queue" в config.json)
+JOB_QUEUE_SETTINGS = {
+    'visibility_timeout_seconds': 600,  # Задача, не завершенная за это время (обработчик упал), выдается снова
+    'max_attempts': 3,                  # Попыток на одну задачу, после - задача считается неудачной
+    'retry_base_seconds': 60,           # Пауза перед повторной попыткой, растет вдвое с каждой попыткой
+    'retry_max_seconds': 1800,          # Максимальная пауза перед повторной попыткой
+    'poll_seconds': 5,                  # Как часто свободный обработчик проверяет очередь
+    'keep_finished_days': 7,            # Сколько хранить завершенные задачи
+    'defer_jitter_seconds': 120,        # Разброс времени возврата задач, отложенных из-за недоступности VUZ2
+    **config.get('job_queue', {})
+}
+
+PENDING, RUNNING, DONE, FAILED = 'pending', 'running', 'done', 'failed'
+
+# Виды задач: оценки (страница рейтинга) и курсовые работы (страница портфолио)
+GRADES_JOB, PORTFOLIO_JOB = 'grades', 'portfolio'
+
+class ScrapeJobQueue:
+    """
+    Очередь задач парсинга в таблице scrape_jobs: переживает перезапуск бота.
+    Обработчик забирает задачу (claim) с арендой на visibility_timeout_seconds и
+    завершает ее (complete), возвращает с ошибкой (fail) или откладывает (defer).
+    Если аренда истекла, задача возвращается в очередь как неудачная попытка.
+    Задачи выдаются по убыванию priority, затем по available_at.
+    """
+
+    def __init__(self, settings=None):
+        self.settings = settings or JOB_QUEUE_SETTINGS
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self._available = None
+        self._loop = None
+
+    @staticmethod
+    def _now():
+        return datetime.datetime.now()
+
+    def _retry_delay(self, attempts):
+        delay = min(self.settings['retry_base_seconds'] * 2 ** max(0, attempts - 1), self.settings['retry_max_seconds'])
+        return datetime.timedelta(seconds=delay * random.uniform(1, 1.25))
+
+    def enqueue_many(self, student_ids, kind=GRADES_JOB, priority=0, available_at=None):
+        """
+        Ставит задачи в очередь. Если у студента уже есть незавершенная задача того же вида,
+        новая не создается, а приоритет существующей повышается до priority (и ожидающая
+        повторной попытки задача становится доступной к available_at).
+        student_ids - список student_id или пар (student_id, available_at).
+        Returns: число созданных задач и задач с повышенным приоритетом
+        """
+        now = self._now().isoformat()
+        rows = []
+        for item in student_ids:
+            student_id, item_available_at = item if isinstance(item, tuple) else (item, available_at)
+            rows.append((kind, student_id, priority, item_available_at or now, now))
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            before = conn.total_changes
+            cursor.executemany('''
+                INSERT INTO scrape_jobs (kind, student_id, priority, status, available_at, created_at)
+                VALUES (?, ?, ?, 'pending', ?, ?)
+                ON CONFLICT(kind, student_id) WHERE status IN ('pending', 'running')
+                DO UPDATE SET priority=excluded.priority, available_at=MIN(available_at, excluded.available_at)
+                WHERE excluded.priority > priority
+            ''', rows)
+            created = conn.total_changes - before
+            conn.commit()
+        if rows:
+            self._wake_up()
+        return created
+
+    def enqueue(self, student_id, kind=GRADES_JOB, priority=0, available_at=None):
+        return self.enqueue_many([student_id], kind=kind, priority=priority, available_at=available_at)
+
+    def claim(self, kinds=None):
+        """
+        Забирает следующую доступную задачу.
+        kinds - виды задач, которые берет этот обработчик (None - любые).
+        Returns: dict задачи (id, kind, student_id, attempts, priority, telegram_id, student_group) или None
+        """
+        now = self._now()
+        kind_filter = ''
+        params = [now.isoformat()]
+        if kinds:
+            kind_filter = f"AND j.kind IN ({','.join('?' * len(kinds))})"
+            params.extend(kinds)
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            # BEGIN IMMEDIATE: задачу не заберут два обработчика, даже из разных процессов
+            cursor.execute('BEGIN IMMEDIATE')
+            cursor.execute(f'''
+                SELECT j.id, j.kind, j.student_id, j.attempts, j.priority, st.telegram_id, st.student_group
+                FROM scrape_jobs j
+                JOIN students st ON st.student_id = j.student_id
+                WHERE j.status = 'pending' AND j.available_at <= ? {kind_filter}
+                ORDER BY j.priority DESC, j.available_at
+                LIMIT 1
+            ''', params)
+            row = cursor.fetchone()
+            if row is None:
+                conn.commit()
+                return None
+            lease_until = now + datetime.timedelta(seconds=self.settings['visibility_timeout_seconds'])
+            cursor.execute('''
+                UPDATE scrape_jobs
+                SET status='running', attempts=attempts + 1, lease_owner=?, lease_until=?, started_at=?
+                WHERE id=?
+            ''', (self.owner, lease_until.isoformat(), now.isoformat(), row[0]))
+            conn.commit()
+        return {
+            'id': row[0], 'kind': row[1], 'student_id': row[2], 'attempts': row[3] + 1,
+            'priority': row[4], 'telegram_id': row[5], 'student_group': row[6]
+        }
+
+    @staticmethod
+    def _execute(conn, query, params):
+        # conn - открытое соединение вызывающего (commit делает он), иначе отдельная транзакция
+        if conn is not None:
+            conn.execute(query, params)
+            return
+        with get_db_connection() as conn:
+            conn.execute(query, params)
+            conn.commit()
+
+    def complete(self, job, conn=None):
+        """Задача выполнена. conn - записать в транзакции вызывающего"""
+        self._execute(conn, '''
+            UPDATE scrape_jobs SET status='done', lease_owner=NULL, lease_until=NULL, finished_at=?
+            WHERE id=?
+        ''', (self._now().isoformat(), job['id']))
+
+    def fail(self, job, error, conn=None):
+        """
+        Попытка не удалась: задача возвращается в очередь с паузой или,
+        если попытки кончились, помечается неудачной. conn - записать в транзакции вызывающего.
+        Returns: True, если будет повторная попытка
+        """
+        now = self._now()
+        retry = job['attempts'] < self.settings['max_attempts']
+        if retry:
+            self._execute(conn, '''
+                UPDATE scrape_jobs
+                SET status='pending', available_at=?, lease_owner=NULL, lease_until=NULL, last_error=?
+                WHERE id=?
+            ''', ((now + self._retry_delay(job['attempts'])).isoformat(), str(error)[:500], job['id']))
+        else:
+            self._execute(conn, '''
+                UPDATE scrape_jobs
+                SET status='failed', lease_owner=NULL, lease_until=NULL, last_error=?, finished_at=?
+                WHERE id=?
+            ''', (str(error)[:500], now.isoformat(), job['id']))
+        if retry:
+            self._wake_up()
+        return retry
+
+    def defer(self, job, delay_seconds, conn=None):
+        """Возвращает задачу в очередь без расхода попытки (VUZ2 недоступен). conn - как в complete"""
+        # Разброс, чтобы после восстановления VUZ2 задачи не пошли одной пачкой
+        delay_seconds += random.uniform(0, self.settings['defer_jitter_seconds'])
+        self._execute(conn, '''
+            UPDATE scrape_jobs
+            SET status='pending', attempts=MAX(0, attempts - 1), available_at=?, lease_owner=NULL, lease_until=NULL
+            WHERE id=?
+        ''', ((self._now() + datetime.timedelta(seconds=delay_seconds)).isoformat(), job['id']))
+
+    def requeue_expired(self):
+        """
+        Возвращает в очередь задачи с истекшей арендой (обработчик упал или процесс был убит).
+        Такая попытка считается неудачной: повтор с паузой или статус failed.
+        Returns: число возвращенных задач
+        """
+        now = self._now()
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT id, attempts FROM scrape_jobs
+                WHERE status='running' AND lease_until <= ?
+            ''', (now.isoformat(),))
+            expired = cursor.fetchall()
+            for job_id, attempts in expired:
+                if attempts < self.settings['max_attempts']:
+                    cursor.execute('''
+                        UPDATE scrape_jobs
+                        SET status='pending', available_at=?, lease_owner=NULL, lease_until=NULL, last_error='аренда истекла'
+                        WHERE id=? AND status='running'
+                    ''', ((now + self._retry_delay(attempts)).isoformat(), job_id))
+                else:
+                    cursor.execute('''
+                        UPDATE scrape_jobs
+                        SET status='failed', lease_owner=NULL, lease_until=NULL, last_error='аренда истекла', finished_at=?
+                        WHERE id=? AND status='running'
+                    ''', (now.isoformat(), job_id))
+            conn.commit()
+        if expired:
+            logger.warning(f"Возвращено в очередь задач парсинга с истекшей арендой: {len(expired)}")
+        return len(expired)
+
+    def release_owned(self):
+        """Возвращает в очередь задачи этого процесса без расхода попытки (при остановке бота)"""
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE scrape_jobs
+                SET status='pending', attempts=MAX(0, attempts - 1), lease_owner=NULL, lease_until=NULL
+                WHERE status='running' AND lease_owner=?
+            ''', (self.owner,))
+            conn.commit()
+            return cursor.rowcount
+
+    def purge_finished(self):
+        """Удаляет старые завершенные задачи"""
+        cutoff = self._now() - datetime.timedelta(days=self.settings['keep_finished_days'])
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "DELETE FROM scrape_jobs WHERE status IN ('done', 'failed') AND finished_at < ?",
+                (cutoff.isoformat(),)
+            )
+            conn.commit()
+            return cursor.rowcount
+
+    def pending_count(self, kind=None):
+        """Число ожидающих задач (kind - только этого вида)"""
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            if kind is None:
+                cursor.execute("SELECT COUNT(*) FROM scrape_jobs WHERE status='pending'")
+            else:
+                cursor.execute("SELECT COUNT(*) FROM scrape_jobs WHERE status='pending' AND kind=?", (kind,))
+            return cursor.fetchone()[0]
+
+    def counts(self):
+        """Returns: {status: число задач}"""
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT status, COUNT(*) FROM scrape_jobs GROUP BY status')
+            counts = dict(cursor.fetchall())
+        return {status: counts.get(status, 0) for status in (PENDING, RUNNING, DONE, FAILED)}
+
+    def _wake_up(self):
+        # Может вызываться из потока BLOCKING_EXECUTOR
+        if self._available is not None:
+            self._loop.call_soon_threadsafe(self._available.set)
+
+    async def wait_for_jobs(self):
+        """Ждет новых задач в этом процессе или poll_seconds (задачи могли появиться из другого процесса)"""
+        if self._available is None:
+            self._loop = asyncio.get_running_loop()
+            self._available = asyncio.Event()
+        try:
+            await asyncio.wait_for(self._available.wait(), timeout=self.settings['poll_seconds'])
+        except asyncio.TimeoutError:
+            pass
+        self._available.clear()
+
+# Общая очередь задач парсинга
+scrape_jobs = ScrapeJobQueue()
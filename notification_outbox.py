@@ -0,0 +1,122 @@
+import asyncio
+import datetime
+from telegram.error import Forbidden, BadRequest, RetryAfter
+from utils import logger, config, get_db_connection, run_db
+from user_activity import mark_user_blocked
+
+# Настройки отправки уведомлений (переопределяются секцией "outbox" в config.json)
+OUTBOX_SETTINGS = {
+    'poll_seconds': 2,          # Как часто бот проверяет новые уведомления от обработчиков парсинга
+    'batch_size': 20,           # Сколько уведомлений отправляется за один проход
+    'send_interval': 0.05,      # Пауза между отправками (ограничения Telegram)
+    'max_attempts': 5,          # Попыток отправки, после - уведомление остается неотправленным с ошибкой
+    'keep_sent_days': 7,        # Сколько хранить отправленные уведомления
+    **config.get('outbox', {})
+}
+
+# Уведомления пользователям пишутся в таблицу notification_outbox и отправляются ботом.
+# Так обработчики парсинга могут работать в отдельных процессах (scrape_worker.py)
+# без доступа к Telegram, а уведомление не теряется при перезапуске бота.
+
+def queue_notification(telegram_id, text, conn=None):
+    """
+    Ставит уведомление в очередь на отправку.
+    conn - открытое соединение, чтобы уведомление записалось в одной транзакции
+    с изменениями, о которых оно сообщает (commit делает вызывающий).
+    """
+    params = (str(telegram_id), text, datetime.datetime.now().isoformat())
+    query = 'INSERT INTO notification_outbox (telegram_id, text, created_at) VALUES (?, ?, ?)'
+    if conn is not None:
+        conn.execute(query, params)
+        return
+    with get_db_connection() as conn:
+        conn.execute(query, params)
+        conn.commit()
+
+class NotificationDispatcher:
+    """Отправляет уведомления из notification_outbox через бота"""
+
+    def __init__(self, application, settings=None):
+        self.application = application
+        self.settings = settings or OUTBOX_SETTINGS
+
+    def _take_batch(self):
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT id, telegram_id, text, attempts FROM notification_outbox
+                WHERE sent_at IS NULL AND attempts < ?
+                ORDER BY id
+                LIMIT ?
+            ''', (self.settings['max_attempts'], self.settings['batch_size']))
+            return cursor.fetchall()
+
+    def _mark_sent(self, notification_id):
+        with get_db_connection() as conn:
+            conn.execute(
+                'UPDATE notification_outbox SET sent_at=?, attempts=attempts + 1 WHERE id=?',
+                (datetime.datetime.now().isoformat(), notification_id)
+            )
+            conn.commit()
+
+    def _mark_failed(self, notification_id, error, final=False):
+        """final - повторять бесполезно (бот заблокирован, чат не найден)"""
+        with get_db_connection() as conn:
+            if final:
+                conn.execute(
+                    'UPDATE notification_outbox SET attempts=?, last_error=? WHERE id=?',
+                    (self.settings['max_attempts'], str(error)[:500], notification_id)
+                )
+            else:
+                conn.execute(
+                    'UPDATE notification_outbox SET attempts=attempts + 1, last_error=? WHERE id=?',
+                    (str(error)[:500], notification_id)
+                )
+            conn.commit()
+
+    def purge_sent(self):
+        cutoff = datetime.datetime.now() - datetime.timedelta(days=self.settings['keep_sent_days'])
+        with get_db_connection() as conn:
+            conn.execute('DELETE FROM notification_outbox WHERE sent_at < ?', (cutoff.isoformat(),))
+            conn.commit()
+
+    async def send_pending(self):
+        """Отправляет накопившиеся уведомления. Returns: число отправленных"""
+        sent = 0
+        for notification_id, telegram_id, text, attempts in await run_db(self._take_batch):
+            try:
+                await self.application.bot.send_message(chat_id=telegram_id, text=text)
+                await run_db(self._mark_sent, notification_id)
+                sent += 1
+            except RetryAfter as e:
+                # Лимит Telegram: попытка не засчитывается, продолжим после паузы
+                logger.warning(f"Лимит Telegram при отправке уведомлений, пауза {e.retry_after} с")
+                await asyncio.sleep(float(e.retry_after))
+                break
+            except (Forbidden, BadRequest) as e:
+                logger.warning(f"Уведомление {notification_id} пользователю {telegram_id} не доставлено: {e}")
+                await run_db(self._mark_failed, notification_id, e, final=True)
+                if isinstance(e, Forbidden):
+                    await run_db(mark_user_blocked, telegram_id)
+            except Exception as e:
+                logger.error(f"Ошибка при отправке уведомления {notification_id} пользователю {telegram_id}: {e}")
+                await run_db(self._mark_failed, notification_id, e)
+            await asyncio.sleep(self.settings['send_interval'])
+        return sent
+
+    async def run(self, is_running):
+        """Цикл отправки; is_running - функция, возвращающая False для остановки"""
+        next_purge_at = datetime.datetime.now()
+        while is_running():
+            try:
+                if datetime.datetime.now() >= next_purge_at:
+                    await run_db(self.purge_sent)
+                    next_purge_at = datetime.datetime.now() + datetime.timedelta(hours=1)
+                if await self.send_pending():
+                    continue
+                await asyncio.sleep(self.settings['poll_seconds'])
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"Ошибка при отправке уведомлений из очереди: {e}")
+                await asyncio.sleep(60)
@@ -0,0 +1,227 @@
+import asyncio
+import datetime
+from telegram.error import BadRequest, Forbidden, RetryAfter
+from utils import (
+    logger, config, get_db_connection, run_db, format_ratings_table,
+    rating_refresh_markup, group_students_markup
+)
+from job_queue import scrape_jobs, GRADES_JOB
+from grade_store import load_student_grades
+
+# Настройки обновления по кнопке (переопределяются секцией "refresh" в config.json)
+REFRESH_SETTINGS = {
+    'priority': 10,             # Приоритет задачи оценок по кнопке «Обновить» (плановые задачи - 0)
+    'group_priority': 5,        # Приоритет задач при обновлении группы администратором
+    'min_interval_seconds': 60, # Оценки проверялись недавно - показываем сохраненные, VUZ2 не запрашиваем
+    'timeout_seconds': 300,     # Не дождались обновления - показываем сохраненные данные
+    'poll_seconds': 1,          # Как часто бот проверяет завершенные обновления
+    'keep_days': 7,             # Сколько хранить записи об обновлениях
+    **config.get('refresh', {})
+}
+
+# Результат request_refresh
+REFRESH_QUEUED, REFRESH_FRESH = 'queued', 'fresh'
+
+# Обновление по кнопке ставит задачу оценок с высоким приоритетом - она обходит плановые задачи.
+# Незавершенная задача студента не дублируется (см. ScrapeJobQueue.enqueue_many), а поднимается
+# в очереди, так что повторные нажатия и обновление группы не создают лишних запросов к VUZ2.
+# Сообщение, которое нужно отредактировать, записывается в refresh_requests: задачу может выполнить
+# отдельный процесс scrape_worker.py, а сообщение редактирует бот (RefreshDispatcher).
+
+def _checked_recently(cursor, student_id, now):
+    cursor.execute('SELECT checked_at FROM scrape_state WHERE student_id=?', (student_id,))
+    row = cursor.fetchone()
+    if not row or not row[0]:
+        return False
+    age = now - datetime.datetime.fromisoformat(row[0])
+    return age < datetime.timedelta(seconds=REFRESH_SETTINGS['min_interval_seconds'])
+
+def request_refresh(student_id, chat_id, message_id):
+    """
+    Обновление оценок студента по кнопке; по завершении бот отредактирует сообщение message_id.
+    Returns: REFRESH_FRESH, если оценки проверялись меньше min_interval_seconds назад
+    (сообщение можно обновить сразу), иначе REFRESH_QUEUED
+    """
+    now = datetime.datetime.now()
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        if _checked_recently(cursor, student_id, now):
+            return REFRESH_FRESH
+        cursor.execute('''
+            INSERT OR IGNORE INTO refresh_requests (student_id, chat_id, message_id, requested_at)
+            VALUES (?, ?, ?, ?)
+        ''', (student_id, str(chat_id), message_id, now.isoformat()))
+        conn.commit()
+    scrape_jobs.enqueue(student_id, kind=GRADES_JOB, priority=REFRESH_SETTINGS['priority'])
+    logger.info(f"Запрошено обновление оценок студента {student_id}")
+    return REFRESH_QUEUED
+
+def request_group_refresh(student_group, chat_id, message_id):
+    """
+    Обновление оценок всех студентов группы (администратор); по завершении бот
+    отредактирует список группы в сообщении message_id.
+    Returns: число студентов, поставленных в очередь
+    """
+    now = datetime.datetime.now()
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT student_id FROM students WHERE student_group=?', (student_group,))
+        student_ids = [row[0] for row in cursor.fetchall()]
+        cursor.execute('''
+            INSERT OR IGNORE INTO refresh_requests (student_group, chat_id, message_id, requested_at)
+            VALUES (?, ?, ?, ?)
+        ''', (student_group, str(chat_id), message_id, now.isoformat()))
+        conn.commit()
+    if student_ids:
+        scrape_jobs.enqueue_many(student_ids, kind=GRADES_JOB, priority=REFRESH_SETTINGS['group_priority'])
+    logger.info(f"Запрошено обновление оценок группы {student_group}: {len(student_ids)} студентов")
+    return len(student_ids)
+
+def finish_refresh_requests(student_id, succeeded, conn=None):
+    """
+    Отмечает завершение обновления оценок студента. Вызывается обработчиком задачи оценок
+    (в том числе в scrape_worker.py) при окончательном результате.
+    conn - открытое соединение, чтобы записать в транзакции вызывающего (commit делает он).
+    """
+    query = '''
+        UPDATE refresh_requests SET finished_at=?, succeeded=?
+        WHERE student_id=? AND finished_at IS NULL
+    '''
+    params = (datetime.datetime.now().isoformat(), int(bool(succeeded)), student_id)
+    if conn is not None:
+        conn.execute(query, params)
+        return
+    with get_db_connection() as conn:
+        conn.execute(query, params)
+        conn.commit()
+
+def render_student_rating(student_id, note=None):
+    """Таблица оценок студента из базы для сообщения (note - строка о результате обновления)"""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT name FROM students WHERE student_id=?', (student_id,))
+        row = cursor.fetchone()
+        if not row:
+            return "Студент не найден."
+    message = format_ratings_table(row[0] or 'Неизвестно', load_student_grades(student_id))
+    return f"{message}\n{note}" if note else message
+
+def _result_note(succeeded):
+    if succeeded:
+        return f"🕒 Обновлено в {datetime.datetime.now().strftime('%H:%M')}"
+    return "⚠️ Не удалось обновить данные с VUZ2, показаны сохраненные"
+
+class RefreshDispatcher:
+    """Редактирует сообщения с оценками, когда обновление по кнопке завершено"""
+
+    def __init__(self, application, settings=None):
+        self.application = application
+        self.settings = settings or REFRESH_SETTINGS
+
+    def _take_ready(self):
+        """
+        Отмечает завершенными обновления групп без незавершенных задач оценок и
+        возвращает обновления, по которым пора редактировать сообщение
+        (завершены или истек timeout_seconds).
+        """
+        now = datetime.datetime.now()
+        cutoff = now - datetime.timedelta(seconds=self.settings['timeout_seconds'])
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            # Пишем, только если есть незавершенные обновления групп: запись ждет
+            # транзакций обработчиков парсинга, а проверка выполняется каждые poll_seconds
+            cursor.execute('SELECT 1 FROM refresh_requests WHERE student_group IS NOT NULL AND finished_at IS NULL LIMIT 1')
+            if cursor.fetchone():
+                cursor.execute('''
+                    UPDATE refresh_requests SET finished_at=?, succeeded=1
+                    WHERE student_group IS NOT NULL AND finished_at IS NULL
+                      AND NOT EXISTS (
+                          SELECT 1 FROM scrape_jobs j
+                          JOIN students st ON st.student_id = j.student_id
+                          WHERE st.student_group = refresh_requests.student_group
+                            AND j.kind = ? AND j.status IN ('pending', 'running')
+                      )
+                ''', (now.isoformat(), GRADES_JOB))
+                conn.commit()
+            cursor.execute('''
+                SELECT id, student_id, student_group, chat_id, message_id, finished_at, succeeded
+                FROM refresh_requests
+                WHERE edited_at IS NULL AND (finished_at IS NOT NULL OR requested_at < ?)
+                ORDER BY id
+                LIMIT 20
+            ''', (cutoff.isoformat(),))
+            return cursor.fetchall()
+
+    def _mark_edited(self, request_id):
+        with get_db_connection() as conn:
+            conn.execute(
+                'UPDATE refresh_requests SET edited_at=? WHERE id=?',
+                (datetime.datetime.now().isoformat(), request_id)
+            )
+            conn.commit()
+
+    def _render(self, student_id, student_group, note):
+        """Returns: (текст, клавиатура) обновленного сообщения"""
+        if student_group is not None:
+            return self._render_group(student_group, note)
+        return render_student_rating(student_id, note), rating_refresh_markup(student_id)
+
+    def _render_group(self, student_group, note):
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT student_id, name FROM students WHERE student_group=? ORDER BY name', (student_group,))
+            students = cursor.fetchall()
+        return f"Студенты вашей группы ({student_group}):\n{note}", group_students_markup(students, is_admin=True)
+
+    def purge(self):
+        """Удаляет старые записи об обновлениях"""
+        cutoff = datetime.datetime.now() - datetime.timedelta(days=self.settings['keep_days'])
+        with get_db_connection() as conn:
+            conn.execute('DELETE FROM refresh_requests WHERE requested_at < ?', (cutoff.isoformat(),))
+            conn.commit()
+
+    async def edit_finished(self):
+        """Редактирует сообщения по завершенным обновлениям. Returns: число обработанных"""
+        handled = 0
+        for request_id, student_id, student_group, chat_id, message_id, finished_at, succeeded in await run_db(self._take_ready):
+            note = _result_note(finished_at is not None and succeeded)
+            try:
+                text, markup = await run_db(self._render, student_id, student_group, note)
+                await self.application.bot.edit_message_text(
+                    chat_id=chat_id, message_id=message_id, text=text,
+                    parse_mode='HTML', reply_markup=markup
+                )
+                await run_db(self._mark_edited, request_id)
+                handled += 1
+            except RetryAfter as e:
+                logger.warning(f"Лимит Telegram при обновлении сообщений, пауза {e.retry_after} с")
+                await asyncio.sleep(float(e.retry_after))
+                break
+            except (Forbidden, BadRequest) as e:
+                # Сообщение удалено, не изменилось или бот заблокирован - повторять бесполезно
+                logger.warning(f"Сообщение {message_id} в чате {chat_id} не обновлено: {e}")
+                await run_db(self._mark_edited, request_id)
+                handled += 1
+            except Exception as e:
+                # Пользователь может нажать «Обновить» еще раз
+                logger.error(f"Ошибка при обновлении сообщения {message_id} в чате {chat_id}: {e}")
+                await run_db(self._mark_edited, request_id)
+                handled += 1
+        return handled
+
+    async def run(self, is_running):
+        """Цикл редактирования сообщений; is_running - функция, возвращающая False для остановки"""
+        next_purge_at = datetime.datetime.now()
+        while is_running():
+            try:
+                if datetime.datetime.now() >= next_purge_at:
+                    await run_db(self.purge)
+                    next_purge_at = datetime.datetime.now() + datetime.timedelta(hours=1)
+                if await self.edit_finished():
+                    continue
+                await asyncio.sleep(self.settings['poll_seconds'])
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"Ошибка при обновлении сообщений с оценками: {e}")
+                await asyncio.sleep(60)
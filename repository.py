@@ -0,0 +1,212 @@
+import json
+from utils import logger, get_db_connection, run_db, get_week_type, set_week_type_settings, discipline_key
+from grade_store import load_student_grades, load_student_subjects, load_discipline_grades
+from refresh_requests import render_student_rating
+from user_activity import touch_user
+from schema import WEEKDAYS, LESSONS_PER_DAY
+
+# Запросы частых обработчиков кнопок. Каждая функция выполняет все свои запросы одним
+# вызовом в DB_EXECUTOR (utils.run_db) на соединении из пула потока, поэтому обработчик
+# не останавливает event loop, пока ждет базу (парсинг в это время пишет оценки).
+
+def _profile(telegram_id, touch_activity):
+    if touch_activity:
+        touch_user(telegram_id)
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            'SELECT student_id, student_group, is_admin, is_superadmin FROM students WHERE telegram_id=?',
+            (telegram_id,)
+        )
+        return cursor.fetchone()
+
+async def get_profile(telegram_id, touch_activity=False):
+    """
+    Returns: (student_id, student_group, is_admin, is_superadmin) или None, если пользователь
+    не зарегистрирован. touch_activity=True - заодно отмечает активность (user_activity.touch_user)
+    """
+    return await run_db(_profile, str(telegram_id), touch_activity)
+
+async def touch(telegram_id):
+    """user_activity.touch_user вне event loop"""
+    await run_db(touch_user, telegram_id)
+
+async def get_student_rating(student_id):
+    """Returns: таблица оценок студента (HTML)"""
+    return await run_db(render_student_rating, student_id)
+
+def _student_rating_view(student_id):
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT name, student_group FROM students WHERE student_id=?', (student_id,))
+        row = cursor.fetchone()
+    if not row:
+        return None
+    return row[0], row[1], load_student_grades(student_id)
+
+async def get_student_rating_view(student_id):
+    """Returns: (имя, группа, {дисциплина: {модуль: оценка}}) или None, если студента нет в базе"""
+    return await run_db(_student_rating_view, student_id)
+
+def _group_students(student_group):
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT student_id, name FROM students WHERE student_group=? ORDER BY name', (student_group,))
+        return cursor.fetchall()
+
+async def get_group_students(student_group):
+    """Returns: [(student_id, name)] студентов группы по алфавиту"""
+    return await run_db(_group_students, student_group)
+
+def _student_group_of(student_id):
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT student_group FROM students WHERE student_id=?', (student_id,))
+        row = cursor.fetchone()
+        return row[0] if row else None
+
+async def get_student_group(student_id):
+    """Returns: группа студента или None"""
+    return await run_db(_student_group_of, student_id)
+
+def _student_subjects(student_id):
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT 1 FROM students WHERE student_id=?', (student_id,))
+        if not cursor.fetchone():
+            return None
+    return load_student_subjects(student_id)
+
+async def get_student_subjects(student_id):
+    """Returns: дисциплины студента по алфавиту или None, если студента нет в базе"""
+    return await run_db(_student_subjects, student_id)
+
+def _discipline_view(student_group, discipline):
+    group_data = load_discipline_grades(student_group, discipline)
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT 1 FROM course_works WHERE discipline_key=? LIMIT 1', (discipline_key(discipline),))
+        has_course_works = cursor.fetchone() is not None
+    return group_data, has_course_works
+
+async def get_discipline_view(student_group, discipline):
+    """
+    Returns: (оценки группы по дисциплине [(имя, {модуль: оценка})],
+    есть ли курсовые работы по дисциплине у любой группы)
+    """
+    return await run_db(_discipline_view, student_group, discipline)
+
+def _discipline_course_works(discipline):
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT cw.name, cw.discipline, cw.file_path, cw.semester, cw.student_group, f.original_name
+            FROM course_works cw
+            LEFT JOIN course_work_files f
+                ON f.student_id = cw.student_id AND f.discipline = cw.discipline AND f.semester = cw.semester
+            WHERE cw.discipline_key=?
+        ''', (discipline_key(discipline),))
+        return cursor.fetchall()
+
+async def get_discipline_course_works(discipline):
+    """Returns: [(имя, дисциплина, файл, семестр, группа, исходное имя файла)] курсовых работ всех групп"""
+    return await run_db(_discipline_course_works, discipline)
+
+def _schedule(telegram_id, weekday=None, opposite_week=False):
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT student_group, subgroup FROM students WHERE telegram_id=?', (telegram_id,))
+        result = cursor.fetchone()
+        if not result:
+            return None
+        group, subgroup = result
+        subgroup = subgroup or 1  # По умолчанию первая подгруппа
+        week_type = get_week_type()
+        if opposite_week:
+            week_type = 'DOWN' if week_type == 'UP' else 'UP'
+        group_full_name = f"{group}_sub{subgroup}_{week_type}"
+        if weekday is None:
+            cursor.execute('SELECT * FROM raspisanie WHERE group_full_name=?', (group_full_name,))
+            row = cursor.fetchone()
+            lessons = dict(zip([desc[0] for desc in cursor.description], row)) if row else None
+        else:
+            if weekday not in WEEKDAYS:
+                raise ValueError(f"Неизвестный день недели: {weekday}")
+            columns = ', '.join(f'{weekday}_{n}' for n in range(1, LESSONS_PER_DAY + 1))
+            cursor.execute(f'SELECT {columns} FROM raspisanie WHERE group_full_name=?', (group_full_name,))
+            lessons = cursor.fetchone()
+    return group, subgroup, week_type, lessons
+
+async def get_schedule(telegram_id, weekday=None, opposite_week=False):
+    """
+    Расписание пользователя на текущую неделю (opposite_week=True - на противоположную).
+    Returns: (группа, подгруппа, тип недели, пары) или None, если пользователь не найден.
+    Пары - кортеж LESSONS_PER_DAY значений дня weekday, без weekday - {колонка: значение}
+    строки raspisanie; None, если расписания нет.
+    """
+    return await run_db(_schedule, str(telegram_id), weekday, opposite_week)
+
+def _archive_parts(discipline):
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT archive_parts FROM course_work_archives WHERE discipline=?', (discipline,))
+        result = cursor.fetchone()
+    if not result or not result[0]:
+        return None
+    try:
+        return json.loads(result[0])
+    except json.JSONDecodeError:
+        logger.error(f"Ошибка при декодировании JSON для archive_parts: {result[0]}")
+        return []
+
+async def get_archive_parts(discipline):
+    """Returns: пути частей архива курсовых работ дисциплины или None, если частей не записано"""
+    return await run_db(_archive_parts, discipline)
+
+def _set_notifications(telegram_id, enabled):
+    with get_db_connection() as conn:
+        conn.execute('UPDATE students SET notifications=? WHERE telegram_id=?', (int(enabled), telegram_id))
+        conn.commit()
+
+async def set_notifications(telegram_id, enabled):
+    """Включает или отключает системные уведомления пользователя"""
+    await run_db(_set_notifications, str(telegram_id), enabled)
+
+def _student_groups():
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT DISTINCT student_group FROM students WHERE student_group IS NOT NULL ORDER BY student_group')
+        return [row[0] for row in cursor.fetchall()]
+
+async def get_student_groups():
+    """Returns: все группы студентов по алфавиту"""
+    return await run_db(_student_groups)
+
+def _week_settings():
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT value FROM bot_settings WHERE key=?', ('week_type',))
+        result = cursor.fetchone()
+    return json.loads(result[0]) if result else {'current_type': 'UP', 'auto_switch': True}
+
+async def get_week_settings():
+    """Returns: настройки типа недели {'current_type', 'auto_switch', 'last_change'}"""
+    return await run_db(_week_settings)
+
+def _toggle_week_type():
+    return set_week_type_settings(new_type='DOWN' if get_week_type() == 'UP' else 'UP')
+
+def _toggle_auto_switch():
+    return set_week_type_settings(auto_switch=not _week_settings().get('auto_switch', True))
+
+async def set_week_type(new_type=None, auto_switch=None):
+    """utils.set_week_type_settings вне event loop. Returns: новые настройки типа недели"""
+    return await run_db(set_week_type_settings, new_type=new_type, auto_switch=auto_switch)
+
+async def toggle_week_type():
+    """Переключает тип недели на противоположный. Returns: новые настройки типа недели"""
+    return await run_db(_toggle_week_type)
+
+async def toggle_auto_switch():
+    """Переключает авто-смену типа недели. Returns: новые настройки типа недели"""
+    return await run_db(_toggle_auto_switch)
@@ -0,0 +1,107 @@
+import time
+import asyncio
+from utils import logger, config, get_db_connection, run_blocking
+
+# Настройки записи результатов парсинга (переопределяются секцией "result_writer" в config.json)
+RESULT_WRITER_SETTINGS = {
+    'batch_size': 100,              # Результатов (студентов) в одной транзакции
+    'flush_interval_seconds': 0.5,  # Неполная пачка записывается не позже, чем через столько секунд
+    'queue_size': 1000,             # Результатов в очереди записи; при переполнении обработчики ждут
+    **config.get('result_writer', {})
+}
+
+class ResultWriter:
+    """
+    Единственный пишущий в базу для результатов обработчиков парсинга этого процесса.
+    Обработчики отдают результаты (submit), а ResultWriter записывает их пачками по
+    batch_size или раз в flush_interval_seconds: apply_batch(conn, results) выполняется
+    в одной транзакции BEGIN IMMEDIATE вместо нескольких транзакций на каждого студента.
+    Если пачка не записалась, результаты записываются по одному, чтобы ошибка одного
+    студента не потеряла результаты остальных.
+    """
+
+    def __init__(self, apply_batch, settings=None):
+        self.apply_batch = apply_batch
+        self.settings = settings or RESULT_WRITER_SETTINGS
+        self._queue = None
+        self._task = None
+        self.stats = self._new_stats()
+
+    @staticmethod
+    def _new_stats():
+        return {'commits': 0, 'results': 0, 'rows': 0, 'write_seconds': 0.0, 'started': time.monotonic()}
+
+    def start(self):
+        """Запускает запись в текущем event loop"""
+        if self._task is None:
+            self._queue = asyncio.Queue(maxsize=self.settings['queue_size'])
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Записывает уже переданные результаты и останавливает запись"""
+        if self._task is not None:
+            await self._queue.put(None)
+            await self._task
+            self._task = None
+
+    async def submit(self, result):
+        """Передает результат на запись (ждет, если очередь записи заполнена)"""
+        await self._queue.put(result)
+
+    def take_stats(self):
+        """Returns: {'commits', 'results', 'rows', 'write_seconds', 'seconds'} с прошлого вызова (счетчики сбрасываются)"""
+        stats, self.stats = self.stats, self._new_stats()
+        stats['seconds'] = time.monotonic() - stats.pop('started')
+        return stats
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            batch = []
+            result = await self._queue.get()
+            deadline = loop.time() + self.settings['flush_interval_seconds']
+            while True:
+                if result is None:
+                    stopping = True
+                    break
+                batch.append(result)
+                if len(batch) >= self.settings['batch_size']:
+                    break
+                try:
+                    result = self._queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        result = await asyncio.wait_for(self._queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+            if batch:
+                # Пока идет запись, обработчики продолжают складывать результаты в очередь
+                await run_blocking(self._write_batch, batch)
+
+    def _write_batch(self, batch):
+        try:
+            self._write(batch)
+        except Exception as e:
+            if len(batch) == 1:
+                logger.error(f"Ошибка при записи результата парсинга: {e}")
+                return
+            logger.error(f"Ошибка при записи пачки результатов парсинга ({len(batch)}), запись по одному: {e}")
+            for result in batch:
+                self._write_batch([result])
+
+    def _write(self, batch):
+        started = time.perf_counter()
+        with get_db_connection() as conn:
+            before = conn.total_changes
+            conn.execute('BEGIN IMMEDIATE')
+            self.apply_batch(conn, batch)
+            conn.commit()
+            rows = conn.total_changes - before
+        self.stats['commits'] += 1
+        self.stats['results'] += len(batch)
+        self.stats['rows'] += rows
+        self.stats['write_seconds'] += time.perf_counter() - started
@@ -1,35 +1,220 @@
 import asyncio
+import random
 import datetime
-from utils import get_db_connection, parse_student_data, save_to_db, logger
+from utils import (
+    get_db_connection, logger, config, run_blocking, run_db, LoopLagMonitor,
+    get_week_type, set_week_type_settings
+)
+from scraper import (
+    parse_rating, sync_course_works, save_course_works, fetch_rating_page, fetch_portfolio_page,
+    student_last_name, compute_rating_digest, compute_portfolio_digest, vuz2_client, Vuz2Unavailable
+)
 from telegram.ext import Application
 from archive_manager import CourseWorkArchiveManager
+from job_queue import scrape_jobs, GRADES_JOB, PORTFOLIO_JOB
+from notification_outbox import NotificationDispatcher
+from refresh_requests import RefreshDispatcher, finish_refresh_requests
+from user_activity import is_user_active
+from grade_store import load_grades_batch, save_grades_batch, migrate_legacy_grades
+from grade_events import grade_changes, record_events, queue_event_notifications, maintain_grade_events
+from result_writer import ResultWriter
+from backup_service import BackupService
+
+# Настройки планировщика (переопределяются секцией "scheduler" в config.json).
+# Частота запросов к VUZ2 задается ограничителем в scraper.VUZ2_SETTINGS.
+# Каждому студенту назначается время следующего парсинга (scrape_state.next_parse_at):
+# чаще - если оценки недавно менялись и во время сессии, реже - если давно не менялись.
+# Студенты, чьи оценки никто не смотрит (добавлены админом, пользователь заблокировал бота
+# или давно не заходил, см. user_activity.py), проверяются в медленном режиме раз в
+# slow_lane_interval_minutes, а номера, по которым VUZ2 долго отвечает ошибкой, выводятся
+# из парсинга. Когда время наступает, планировщик ставит задачу в очередь scrape_jobs
+# (job_queue.py), которую разбирают обработчики.
+# Оценки (страница рейтинга) и курсовые работы (страница портфолио) проверяются отдельными
+# задачами со своими обработчиками и интервалами: курсовые меняются несколько раз за
+# семестр, поэтому портфолио проверяется раз в portfolio_interval_minutes
+# (scrape_state.portfolio_next_at).
+SCHEDULER_SETTINGS = {
+    'parser_workers': 4,                # Обработчиков оценок в процессе бота (0 - парсят только отдельные scrape_worker.py)
+    'portfolio_workers': 1,             # Обработчиков портфолио (курсовых работ) в процессе бота
+    'base_interval_minutes': 120,       # Обычный интервал между проверками студента
+    'min_interval_minutes': 30,         # Нижняя граница интервала
+    'max_interval_minutes': 720,        # Верхняя граница интервала
+    'recent_change_days': 3,            # Оценки менялись за это время - проверяем с минимальным интервалом
+    'stale_after_days': 30,             # Оценки не менялись дольше - проверяем с максимальным интервалом
+    'slow_lane_interval_minutes': 1440, # Интервал для студентов, чьи оценки никто не смотрит
+    'portfolio_interval_minutes': 1440, # Интервал между проверками портфолио студента
+    'portfolio_slow_interval_minutes': 10080,  # Интервал проверки портфолио в медленном режиме
+    'exam_factor': 0.5,                 # Множитель интервала во время сессии
+    'exam_windows': [                   # Периоды сессий, ММ-ДД (конец может быть в следующем году)
+        {'start': '12-15', 'end': '02-10'},
+        {'start': '05-20', 'end': '07-10'}
+    ],
+    'jitter': 0.2,                      # Случайный разброс интервала (доля), чтобы проверки не шли пачками
+    'failure_retry_minutes': 30,        # Через сколько повторить после ошибки (удваивается с каждой следующей)
+    'retire_after_failures': 10,        # После стольких ошибок подряд номер выводится из парсинга
+    'planner_batch': 100,               # Сколько задач каждого вида может ждать в очереди, остальные студенты ждут в scrape_state
+    'planner_idle_seconds': 60,         # Максимальная пауза планировщика, когда никто не ждет проверки
+    'archive_interval_minutes': 120,    # Как часто пересобирать архивы курсовых работ
+    'stats_interval_minutes': 60,       # Как часто писать в лог статистику парсинга
+    'loop_lag_interval_seconds': 0.1,   # Период замера задержки event loop (в статистике парсинга)
+    **config.get('scheduler', {})
+}
+
+# Колонка scrape_state со временем следующей проверки для каждого вида задач
+JOB_SCHEDULE_COLUMNS = {GRADES_JOB: 'next_parse_at', PORTFOLIO_JOB: 'portfolio_next_at'}
+
+def _month_day(value):
+    month, day = value.split('-')
+    return int(month), int(day)
+
+def in_exam_window(now, settings=SCHEDULER_SETTINGS):
+    """Проверяет, попадает ли дата в один из периодов сессии"""
+    today = (now.month, now.day)
+    for window in settings['exam_windows']:
+        start, end = _month_day(window['start']), _month_day(window['end'])
+        if start <= end:
+            if start <= today <= end:
+                return True
+        elif today >= start or today <= end:
+            return True
+    return False
+
+def parse_interval_minutes(now, changed_at, is_active, settings=SCHEDULER_SETTINGS):
+    """
+    Интервал до следующей проверки студента в минутах, без случайного разброса.
+    changed_at - когда в последний раз менялись страницы студента (datetime или None),
+    is_active - оценки студента кто-то смотрит (см. user_activity.is_user_active).
+    """
+    if not is_active:
+        return settings['slow_lane_interval_minutes']
+    minutes = settings['base_interval_minutes']
+    if changed_at is not None:
+        if now - changed_at <= datetime.timedelta(days=settings['recent_change_days']):
+            minutes = settings['min_interval_minutes']
+        elif now - changed_at >= datetime.timedelta(days=settings['stale_after_days']):
+            minutes = settings['max_interval_minutes']
+    if in_exam_window(now, settings):
+        minutes *= settings['exam_factor']
+    return min(max(minutes, settings['min_interval_minutes']), settings['max_interval_minutes'])
+
+def portfolio_interval_minutes(is_active, settings=SCHEDULER_SETTINGS):
+    """Интервал до следующей проверки портфолио студента в минутах, без случайного разброса"""
+    return settings['portfolio_interval_minutes' if is_active else 'portfolio_slow_interval_minutes']
+
+def _with_jitter(minutes, settings):
+    jitter = settings['jitter']
+    return datetime.timedelta(minutes=minutes * random.uniform(1 - jitter, 1 + jitter))
+
+def compute_parse_interval(now, changed_at, is_active, settings=SCHEDULER_SETTINGS):
+    """Интервал до следующей проверки студента со случайным разбросом jitter"""
+    return _with_jitter(parse_interval_minutes(now, changed_at, is_active, settings), settings)
+
+def compute_portfolio_interval(is_active, settings=SCHEDULER_SETTINGS):
+    """Интервал до следующей проверки портфолио со случайным разбросом jitter"""
+    return _with_jitter(portfolio_interval_minutes(is_active, settings), settings)
+
+def scrape_load_report(period_minutes=None, now=None, settings=SCHEDULER_SETTINGS):
+    """
+    Сколько студентов в обычном и медленном режиме и выведено из парсинга, и сколько
+    проверок VUZ2 ожидается за period_minutes (по умолчанию stats_interval_minutes)
+    по сравнению с проверкой всех студентов в обычном режиме.
+    scrapes - проверки оценок, portfolio_scrapes - проверки портфолио.
+    """
+    period_minutes = period_minutes or settings['stats_interval_minutes']
+    now = now or datetime.datetime.now()
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT st.telegram_id, a.last_seen_at, a.blocked_at, s.changed_at, s.retired_at
+            FROM students st
+            LEFT JOIN user_activity a ON a.telegram_id = st.telegram_id
+            LEFT JOIN scrape_state s ON s.student_id = st.student_id
+        ''')
+        rows = cursor.fetchall()
+    report = {'active': 0, 'slow': 0, 'retired': 0, 'scrapes': 0.0, 'portfolio_scrapes': 0.0, 'scrapes_without_lanes': 0.0}
+    for telegram_id, last_seen_at, blocked_at, changed_at, retired_at in rows:
+        changed_at = datetime.datetime.fromisoformat(changed_at) if changed_at else None
+        report['scrapes_without_lanes'] += period_minutes / parse_interval_minutes(now, changed_at, True, settings)
+        if retired_at:
+            report['retired'] += 1
+            continue
+        is_active = is_user_active(telegram_id, last_seen_at, blocked_at, now)
+        report['active' if is_active else 'slow'] += 1
+        report['scrapes'] += period_minutes / parse_interval_minutes(now, changed_at, is_active, settings)
+        report['portfolio_scrapes'] += period_minutes / portfolio_interval_minutes(is_active, settings)
+    return report
 
 class StudentParserScheduler:
     def __init__(self, application: Application):
         self.application = application
-        self.parsing_queue = asyncio.Queue()
         self.is_running = False
-        self.parser_task = None
+        self.parser_tasks = []
         self.archive_manager = CourseWorkArchiveManager()
+        self.background_tasks = []
+        # Счетчики за интервал stats_interval_minutes: полные обновления / пропуски по неизменному хешу / ошибки
+        # (portfolio_* - то же для портфолио)
+        self.cycle_stats = self._new_cycle_stats()
+        self.last_cycle_stats = None
+        self.loop_lag = LoopLagMonitor(SCHEDULER_SETTINGS['loop_lag_interval_seconds'])
+        # Результаты обработчиков записываются пачками (result_writer.py)
+        self.result_writer = ResultWriter(self._apply_results)
 
     async def start(self):
-        """Запускает планировщик парсинга и авто-смену недели"""
+        """
+        Запускает планировщик парсинга, обработчики очереди, отправку уведомлений,
+        обновление сообщений по кнопке «Обновить», авто-смену недели и резервное копирование базы
+        """
         if not self.is_running:
-            self.is_running = True
-            self.parser_task = asyncio.create_task(self._parser_worker())
-            asyncio.create_task(self._schedule_parser())
-            asyncio.create_task(self._auto_switch_week_type())
+            await self.start_workers(
+                max(0, SCHEDULER_SETTINGS['parser_workers']),
+                max(0, SCHEDULER_SETTINGS['portfolio_workers'])
+            )
+            dispatcher = NotificationDispatcher(self.application)
+            self.background_tasks = [
+                asyncio.create_task(self._schedule_parser()),
+                asyncio.create_task(self._archive_updater()),
+                asyncio.create_task(self._auto_switch_week_type()),
+                asyncio.create_task(dispatcher.run(lambda: self.is_running)),
+                asyncio.create_task(RefreshDispatcher(self.application).run(lambda: self.is_running)),
+                asyncio.create_task(migrate_legacy_grades(lambda: self.is_running)),
+                asyncio.create_task(maintain_grade_events(lambda: self.is_running)),
+                asyncio.create_task(self.loop_lag.run(lambda: self.is_running)),
+                asyncio.create_task(BackupService().run(lambda: self.is_running))
+            ]
+
+    async def start_workers(self, worker_count, portfolio_worker_count=0):
+        """
+        Запускает только обработчики очереди задач парсинга (без планировщика и Telegram):
+        worker_count - оценок, portfolio_worker_count - портфолио.
+        Используется ботом и отдельным процессом scrape_worker.py.
+        """
+        self.is_running = True
+        self.result_writer.start()
+        self.parser_tasks = [
+            asyncio.create_task(self._parser_worker(worker_num, GRADES_JOB))
+            for worker_num in range(worker_count)
+        ] + [
+            asyncio.create_task(self._parser_worker(worker_num, PORTFOLIO_JOB))
+            for worker_num in range(portfolio_worker_count)
+        ]
+        logger.info(f"Запущено обработчиков очереди парсинга: оценок {worker_count}, портфолио {portfolio_worker_count}")
 
     async def stop(self):
         """Останавливает планировщик парсинга"""
         if self.is_running:
             self.is_running = False
-            if self.parser_task:
-                self.parser_task.cancel()
-                try:
-                    await self.parser_task
-                except asyncio.CancelledError:
-                    pass
+            tasks = self.parser_tasks + self.background_tasks
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            self.parser_tasks = []
+            self.background_tasks = []
+            # Дописываем результаты, которые обработчики уже передали на запись
+            await self.result_writer.stop()
+            # Прерванные задачи сразу возвращаем в очередь, не дожидаясь истечения аренды
+            released = await run_db(scrape_jobs.release_owned)
+            if released:
+                logger.info(f"Возвращено в очередь незавершенных задач парсинга: {released}")
 
     def _get_all_disciplines(self):
         """Получает список всех уникальных дисциплин из базы данных"""
@@ -41,7 +226,7 @@ class StudentParserScheduler:
     async def _update_course_work_archives(self):
         """Обновляет архивы курсовых работ"""
         try:
-            disciplines = self._get_all_disciplines()
+            disciplines = await run_db(self._get_all_disciplines)
             logger.info(f"Начало обновления архивов курсовых работ. Найдено {len(disciplines)} дисциплин")
 
             for discipline in disciplines:
@@ -66,45 +251,260 @@ class StudentParserScheduler:
         except Exception as e:
             logger.error(f"Ошибка при обновлении архивов курсовых работ: {e}")
 
+    def _seed_scrape_state(self):
+        """
+        Назначает время первой проверки оценок и портфолио студентам, у которых его нет
+        (кроме выведенных из парсинга), и удаляет состояние удаленных студентов.
+        """
+        now = datetime.datetime.now()
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT st.student_id, st.telegram_id, st.last_parsed_time, a.last_seen_at, a.blocked_at
+                FROM students st
+                LEFT JOIN scrape_state s ON s.student_id = st.student_id
+                LEFT JOIN user_activity a ON a.telegram_id = st.telegram_id
+                WHERE (s.student_id IS NULL OR s.next_parse_at IS NULL) AND s.retired_at IS NULL
+            ''')
+            rows = cursor.fetchall()
+            seeded = []
+            for student_id, telegram_id, last_parsed_time, last_seen_at, blocked_at in rows:
+                if last_parsed_time:
+                    # Уже парсились: продолжаем от последнего парсинга
+                    last_parsed = datetime.datetime.fromisoformat(last_parsed_time)
+                    is_active = is_user_active(telegram_id, last_seen_at, blocked_at, now)
+                    next_parse_at = max(last_parsed + compute_parse_interval(now, None, is_active), now)
+                else:
+                    next_parse_at = now
+                # Разносим первые проверки по времени, чтобы не начинать с одной пачки
+                next_parse_at += datetime.timedelta(seconds=random.uniform(0, SCHEDULER_SETTINGS['base_interval_minutes'] * 60 / 4))
+                seeded.append((student_id, next_parse_at.isoformat()))
+            cursor.executemany('''
+                INSERT INTO scrape_state (student_id, next_parse_at) VALUES (?, ?)
+                ON CONFLICT(student_id) DO UPDATE SET next_parse_at=excluded.next_parse_at
+            ''', seeded)
+            # Первые проверки портфолио разносим на весь интервал: при регистрации
+            # курсовые работы уже скачаны, а при обновлении бота не нужна одна большая пачка
+            cursor.execute('''
+                SELECT student_id FROM scrape_state
+                WHERE portfolio_next_at IS NULL AND retired_at IS NULL
+            ''')
+            portfolio_interval = SCHEDULER_SETTINGS['portfolio_interval_minutes'] * 60
+            portfolio_seeded = [
+                ((now + datetime.timedelta(seconds=random.uniform(0, portfolio_interval))).isoformat(), student_id)
+                for (student_id,) in cursor.fetchall()
+            ]
+            cursor.executemany('UPDATE scrape_state SET portfolio_next_at=? WHERE student_id=?', portfolio_seeded)
+            cursor.execute('''
+                DELETE FROM scrape_state
+                WHERE student_id NOT IN (SELECT student_id FROM students)
+            ''')
+            cursor.execute('''
+                DELETE FROM scrape_jobs
+                WHERE status = 'pending' AND student_id NOT IN (SELECT student_id FROM students)
+            ''')
+            conn.commit()
+        if seeded:
+            logger.info(f"Назначено время первой проверки для {len(seeded)} студентов")
+
+    def _enqueue_due_students(self, limit, kind=GRADES_JOB):
+        """
+        Ставит в очередь задач вида kind до limit студентов с наступившим временем проверки
+        (next_parse_at или portfolio_next_at, по индексу), у которых еще нет незавершенной задачи этого вида.
+        Returns: (число поставленных задач, время ближайшей следующей проверки)
+        """
+        column = JOB_SCHEDULE_COLUMNS[kind]
+        now = datetime.datetime.now().isoformat()
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'''
+                SELECT s.student_id, s.{column}
+                FROM scrape_state s
+                WHERE s.{column} <= ?
+                  AND NOT EXISTS (
+                      SELECT 1 FROM scrape_jobs j
+                      WHERE j.student_id = s.student_id AND j.kind = ? AND j.status IN ('pending', 'running')
+                  )
+                ORDER BY s.{column}
+                LIMIT ?
+            ''', (now, kind, limit))
+            due = cursor.fetchall()
+            cursor.execute(f'SELECT MIN({column}) FROM scrape_state WHERE {column} > ?', (now,))
+            next_due = cursor.fetchone()[0]
+        if due:
+            scrape_jobs.enqueue_many(due, kind=kind)
+        return len(due), datetime.datetime.fromisoformat(next_due) if next_due else None
+
+    def _schedule_next_parse(self, student_id, telegram_id, failed=False, conn=None):
+        """
+        Назначает время следующей проверки студента после обработки.
+        После ошибки пауза удваивается с каждой следующей ошибкой подряд, а после
+        retire_after_failures ошибок подряд номер выводится из парсинга вместе с проверкой
+        портфолио (вернется, когда его владелец снова зайдет в бот).
+        conn - открытое соединение, чтобы записать в транзакции вызывающего (commit делает он).
+        """
+        if conn is None:
+            with get_db_connection() as conn:
+                self._schedule_next_parse(student_id, telegram_id, failed, conn)
+                conn.commit()
+            return
+        now = datetime.datetime.now()
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT s.changed_at, s.failures, a.last_seen_at, a.blocked_at
+            FROM students st
+            LEFT JOIN scrape_state s ON s.student_id = st.student_id
+            LEFT JOIN user_activity a ON a.telegram_id = st.telegram_id
+            WHERE st.student_id = ?
+        ''', (student_id,))
+        row = cursor.fetchone() or (None, 0, None, None)
+        changed_at, failures, last_seen_at, blocked_at = row
+        failures = (failures or 0) + 1 if failed else 0
+        if failures >= SCHEDULER_SETTINGS['retire_after_failures']:
+            cursor.execute('''
+                UPDATE scrape_state SET next_parse_at=NULL, portfolio_next_at=NULL, failures=?, retired_at=?
+                WHERE student_id=?
+            ''', (failures, now.isoformat(), student_id))
+            self.cycle_stats['retired'] += 1
+            logger.warning(f"Студент {student_id} выведен из парсинга после {failures} ошибок подряд")
+            return
+        if failed:
+            minutes = min(
+                SCHEDULER_SETTINGS['failure_retry_minutes'] * 2 ** (failures - 1),
+                SCHEDULER_SETTINGS['slow_lane_interval_minutes']
+            )
+            interval = datetime.timedelta(minutes=minutes * random.uniform(1, 1.5))
+        else:
+            changed_at = datetime.datetime.fromisoformat(changed_at) if changed_at else None
+            is_active = is_user_active(telegram_id, last_seen_at, blocked_at, now)
+            interval = compute_parse_interval(now, changed_at, is_active)
+        cursor.execute('''
+            INSERT INTO scrape_state (student_id, next_parse_at, failures) VALUES (?, ?, ?)
+            ON CONFLICT(student_id) DO UPDATE SET next_parse_at=excluded.next_parse_at, failures=excluded.failures
+        ''', (student_id, (now + interval).isoformat(), failures))
+
+    def _schedule_next_portfolio(self, student_id, telegram_id, failed=False, conn=None):
+        """
+        Назначает время следующей проверки портфолио студента.
+        После ошибки - тот же интервал: недоступные номера выводит из парсинга проверка оценок.
+        conn - как в _schedule_next_parse.
+        """
+        if conn is None:
+            with get_db_connection() as conn:
+                self._schedule_next_portfolio(student_id, telegram_id, failed, conn)
+                conn.commit()
+            return
+        now = datetime.datetime.now()
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT a.last_seen_at, a.blocked_at
+            FROM students st
+            LEFT JOIN user_activity a ON a.telegram_id = st.telegram_id
+            WHERE st.student_id = ?
+        ''', (student_id,))
+        last_seen_at, blocked_at = cursor.fetchone() or (None, None)
+        interval = compute_portfolio_interval(is_user_active(telegram_id, last_seen_at, blocked_at, now))
+        cursor.execute('''
+            UPDATE scrape_state SET portfolio_next_at=? WHERE student_id=? AND retired_at IS NULL
+        ''', ((now + interval).isoformat(), student_id))
+
+    async def _roll_stats(self):
+        self.last_cycle_stats = self.cycle_stats
+        self.cycle_stats = self._new_cycle_stats()
+        job_counts = await run_db(scrape_jobs.counts)
+        load = await run_db(scrape_load_report)
+        lag = self.loop_lag.take()
+        writes = self.result_writer.take_stats()
+        logger.info(
+            f"Парсинг за {SCHEDULER_SETTINGS['stats_interval_minutes']} мин: полных обновлений {self.last_cycle_stats['full']}, "
+            f"без изменений {self.last_cycle_stats['skipped']}, ошибок {self.last_cycle_stats['failed']}, "
+            f"отложено из-за недоступности VUZ2 {self.last_cycle_stats['deferred']}, "
+            f"выведено из парсинга {self.last_cycle_stats['retired']}; "
+            f"портфолио: обновлено {self.last_cycle_stats['portfolio_full']}, "
+            f"без изменений {self.last_cycle_stats['portfolio_skipped']}; "
+            f"задач в очереди {job_counts['pending']}, выполняется {job_counts['running']}; "
+            f"студентов в обычном режиме {load['active']}, в медленном {load['slow']}, выведено {load['retired']}, "
+            f"ожидается проверок оценок {load['scrapes']:.0f} вместо {load['scrapes_without_lanes']:.0f}, "
+            f"портфолио {load['portfolio_scrapes']:.0f}; "
+            f"задержка event loop p50 {lag['p50'] * 1000:.1f} мс, p99 {lag['p99'] * 1000:.1f} мс, max {lag['max'] * 1000:.0f} мс; "
+            f"запись результатов: {writes['results']} в {writes['commits']} транзакциях, "
+            f"{writes['commits'] / writes['seconds']:.2f} commit/с, {writes['rows'] / writes['seconds']:.1f} строк/с"
+        )
+
+    def _plan_tick(self, maintain):
+        """
+        Один проход планировщика (в DB_EXECUTOR, не в event loop): при maintain - назначение
+        первой проверки новым студентам, возврат задач с истекшей арендой и удаление старых задач;
+        затем постановка в очередь студентов, у которых наступило время проверки.
+        Returns: (поставлено задач, время ближайшей следующей проверки, очередь заполнена)
+        """
+        if maintain:
+            self._seed_scrape_state()
+            scrape_jobs.requeue_expired()
+            scrape_jobs.purge_finished()
+        # Держим в очереди не больше planner_batch ожидающих задач каждого вида:
+        # остальные подождут в scrape_state
+        enqueued, next_due, queue_full = 0, None, False
+        for kind in JOB_SCHEDULE_COLUMNS:
+            free_slots = SCHEDULER_SETTINGS['planner_batch'] - scrape_jobs.pending_count(kind)
+            if free_slots <= 0:
+                queue_full = True
+                continue
+            kind_enqueued, kind_next_due = self._enqueue_due_students(free_slots, kind)
+            enqueued += kind_enqueued
+            if kind_next_due is not None and (next_due is None or kind_next_due < next_due):
+                next_due = kind_next_due
+        return enqueued, next_due, queue_full
+
     async def _schedule_parser(self):
-        """Планирует парсинг студентов каждые 2 часа"""
+        """
+        Планировщик парсинга: непрерывно ставит в очередь задач студентов, у которых наступило
+        время проверки (next_parse_at), по мере ее разбора обработчиками.
+        """
+        stats_interval = datetime.timedelta(minutes=SCHEDULER_SETTINGS['stats_interval_minutes'])
+        seed_interval = datetime.timedelta(seconds=SCHEDULER_SETTINGS['planner_idle_seconds'])
+        next_seed_at = datetime.datetime.now()
+        next_stats_at = next_seed_at + stats_interval
         while self.is_running:
             try:
-                # Получаем студентов, которых нужно распарсить
-                with get_db_connection() as conn:
-                    cursor = conn.cursor()
-                    current_time = datetime.datetime.now()
-                    # Находим студентов, которых нужно распарсить
-                    cursor.execute('''
-                        SELECT student_id, telegram_id, student_group 
-                        FROM students 
-                        WHERE last_parsed_time IS NULL 
-                        OR datetime(last_parsed_time) <= datetime(?)
-                    ''', (current_time - datetime.timedelta(hours=2),))
-                    students = cursor.fetchall()
-
-                if students:
-                    logger.info(f"Найдено {len(students)} студентов для обновления")
-                    # Добавляем студентов в очередь
-                    for student in students:
-                        await self.parsing_queue.put(student)
-
-                    # Ждем завершения обработки всех студентов
-                    await self.parsing_queue.join()
-                    
-                    # После обновления данных студентов обновляем архивы
-                    logger.info("Начало обновления архивов после обновления данных студентов")
-                    await self._update_course_work_archives()
-                else:
-                    logger.info("Нет студентов для обновления")
-
-                # Ждем 2 часа перед следующей проверкой
-                await asyncio.sleep(2 * 60 * 60)  # 2 часа в секундах
+                now = datetime.datetime.now()
+                maintain = now >= next_seed_at
+                if maintain:
+                    next_seed_at = now + seed_interval
+                if now >= next_stats_at:
+                    await self._roll_stats()
+                    next_stats_at = now + stats_interval
+
+                enqueued, next_due, queue_full = await run_db(self._plan_tick, maintain)
+                if enqueued:
+                    await asyncio.sleep(0)
+                    continue
+                # Никто не ждет проверки - спим до ближайшего времени проверки
+                wait_seconds = SCHEDULER_SETTINGS['planner_idle_seconds']
+                if queue_full:
+                    wait_seconds = scrape_jobs.settings['poll_seconds']
+                elif next_due is not None:
+                    wait_seconds = min(wait_seconds, max(1.0, (next_due - datetime.datetime.now()).total_seconds()))
+                await asyncio.sleep(wait_seconds)
 
+            except asyncio.CancelledError:
+                break
             except Exception as e:
                 logger.error(f"Ошибка в планировщике парсинга: {e}")
                 await asyncio.sleep(60)  # Ждем минуту перед повторной попыткой
 
+    async def _archive_updater(self):
+        """Периодически пересобирает архивы курсовых работ"""
+        while self.is_running:
+            try:
+                await asyncio.sleep(SCHEDULER_SETTINGS['archive_interval_minutes'] * 60)
+                logger.info("Начало планового обновления архивов курсовых работ")
+                await self._update_course_work_archives()
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"Ошибка при плановом обновлении архивов: {e}")
+
     async def _auto_switch_week_type(self):
         """Автоматически переключает тип недели каждую неделю в понедельник в 00:00"""
         while self.is_running:
@@ -119,178 +519,286 @@ class StudentParserScheduler:
             await asyncio.sleep(wait_seconds)
             # Переключить тип недели
             try:
-                current_type = get_week_type()
+                current_type = await run_db(get_week_type)
                 new_type = 'DOWN' if current_type == 'UP' else 'UP'
-                set_week_type_settings(new_type=new_type)
+                await run_db(set_week_type_settings, new_type=new_type)
                 logger.info(f"Тип недели автоматически переключён на {new_type} ({'верхняя' if new_type == 'UP' else 'нижняя'})")
             except Exception as e:
                 logger.error(f"Ошибка при авто-переключении типа недели: {e}")
             # Ждать ещё неделю до следующего переключения
             await asyncio.sleep(7 * 24 * 60 * 60)
 
-    def _is_system_telegram_id(self, telegram_id):
-        """Проверяет, является ли telegram_id системным (добавлен админом или суперадмином)"""
-        return telegram_id in ["added by admin", "added_by_superadmin"]
+    @staticmethod
+    def _new_cycle_stats():
+        return {
+            'full': 0, 'skipped': 0, 'failed': 0, 'deferred': 0, 'retired': 0,
+            'portfolio_full': 0, 'portfolio_skipped': 0
+        }
 
-    def _get_existing_course_works(self, student_id):
-        """Получает список существующих курсовых работ студента"""
+    def _get_page_digest(self, student_id, column='page_digest'):
+        """Получает сохраненный хеш страницы рейтинга (column='portfolio_digest' - портфолио) студента"""
         with get_db_connection() as conn:
             cursor = conn.cursor()
-            cursor.execute('''
-                SELECT discipline, semester, file_path 
-                FROM course_works 
-                WHERE student_id = ?
-            ''', (student_id,))
-            return {(row[0], row[1]): row[2] for row in cursor.fetchall()}
-
-    def _get_student_ratings(self, student_id):
-        """Получает текущие оценки студента из базы данных"""
+            cursor.execute(f'SELECT {column} FROM scrape_state WHERE student_id=?', (student_id,))
+            row = cursor.fetchone()
+            return row[0] if row else None
+
+    def _save_page_digests(self, cursor, digests):
+        """
+        Сохраняет хеши страниц рейтинга [(student_id, хеш)] после полного обновления.
+        changed_at меняется, только если хеш уже был и изменился (первый парсинг - не изменение).
+        """
+        now = datetime.datetime.now().isoformat()
+        cursor.executemany('''
+            INSERT INTO scrape_state (student_id, page_digest, checked_at, changed_at)
+            VALUES (?, ?, ?, NULL)
+            ON CONFLICT(student_id) DO UPDATE SET
+                page_digest=excluded.page_digest,
+                checked_at=excluded.checked_at,
+                changed_at=CASE WHEN scrape_state.page_digest IS NULL THEN scrape_state.changed_at ELSE ? END
+        ''', [(student_id, digest, now, now) for student_id, digest in digests])
+
+    def _save_portfolio_digests(self, cursor, digests):
+        """Отмечает проверку портфолио студентов и сохраняет хеши списков курсовых работ [(student_id, хеш)]"""
+        now = datetime.datetime.now().isoformat()
+        cursor.executemany(
+            'UPDATE scrape_state SET portfolio_digest=?, portfolio_checked_at=? WHERE student_id=?',
+            [(digest, now, student_id) for student_id, digest in digests]
+        )
+
+    def _mark_unchanged(self, cursor, student_ids):
+        """Отмечает проверку студентов, у которых страница рейтинга не изменилась"""
+        now = datetime.datetime.now().isoformat()
+        params = [(now, student_id) for student_id in student_ids]
+        cursor.executemany('UPDATE students SET last_parsed_time=? WHERE student_id=?', params)
+        cursor.executemany('UPDATE scrape_state SET checked_at=? WHERE student_id=?', params)
+
+    def _get_student_name(self, student_id):
         with get_db_connection() as conn:
             cursor = conn.cursor()
-            cursor.execute("SELECT * FROM students WHERE student_id=?", (student_id,))
+            cursor.execute('SELECT name FROM students WHERE student_id=?', (student_id,))
+            row = cursor.fetchone()
+            return row[0] if row else None
+
+    def _finish_job(self, job, error=None, defer_seconds=None, conn=None):
+        """
+        Завершает задачу парсинга. При окончательном результате (успех или исчерпаны
+        попытки) назначает студенту время следующей проверки оценок или портфолио.
+        conn - открытое соединение, чтобы записать в транзакции вызывающего (commit делает он).
+        """
+        if defer_seconds is not None:
+            scrape_jobs.defer(job, defer_seconds, conn=conn)
+            return
+        if error is None:
+            scrape_jobs.complete(job, conn=conn)
+        elif scrape_jobs.fail(job, error, conn=conn):
+            return  # Будет повторная попытка с паузой
+        if job['kind'] == PORTFOLIO_JOB:
+            self._schedule_next_portfolio(job['student_id'], job['telegram_id'], failed=error is not None, conn=conn)
+        else:
+            self._schedule_next_parse(job['student_id'], job['telegram_id'], failed=error is not None, conn=conn)
+            # Обновление по кнопке «Обновить»: сообщение отредактирует бот
+            finish_refresh_requests(job['student_id'], succeeded=error is None, conn=conn)
+
+    def _save_grade_updates(self, cursor, updates):
+        """
+        Записывает полные обновления оценок {student_id: результат} (студент встречается один раз):
+        студентов, оценки и группу в курсовых работах - по одному executemany на всю пачку.
+        Изменения считаются в памяти по оценкам из базы, прочитанным перед записью, и пишутся
+        в историю grade_events; уведомления по ним ставятся в очередь в той же транзакции:
+        каждое изменение дает ровно одно уведомление, даже если пачку придется записать повторно.
+        """
+        student_ids = list(updates)
+        old_groups = {}
+        for student_id in student_ids:
+            cursor.execute('SELECT student_group FROM students WHERE student_id=?', (student_id,))
             row = cursor.fetchone()
-            if not row:
-                return None
-            columns = [desc[0] for desc in cursor.description]
-            return dict(zip(columns, row))
-
-    def _compare_ratings(self, old_ratings, new_ratings):
-        """Сравнивает старые и новые оценки, возвращает список изменений"""
-        changes = []
-        if not old_ratings or not new_ratings:
-            return changes
-
-        # Проверяем изменение группы
-        old_group = old_ratings.get('student_group')
-        new_group = new_ratings.get('student_group')
-        if old_group != new_group and new_group is not None:
-            changes.append({
-                'type': 'group',
-                'old_value': old_group,
-                'new_value': new_group
-            })
-
-        # Проверяем изменения в оценках
-        for key, new_value in new_ratings.items():
-            if "(модуль" in str(key):
-                old_value = old_ratings.get(key)
-                if old_value != new_value and new_value not in ["не изучает", None, "None"]:
-                    subject = key.split(' (модуль')[0]
-                    module = key.split(' (модуль ')[1].replace(')', '')
-                    changes.append({
-                        'type': 'grade',
-                        'subject': subject,
-                        'module': module,
-                        'old_value': old_value,
-                        'new_value': new_value
-                    })
-        return changes
-
-    def _format_changes_message(self, name, changes):
-        """Форматирует сообщение об изменениях в успеваемости"""
-        if not changes:
-            return None
-
-        message = f"📊 Изменения в данных {name}:\n\n"
-        
-        # Сначала выводим изменение группы, если оно есть
-        group_changes = [c for c in changes if c['type'] == 'group']
-        if group_changes:
-            change = group_changes[0]
-            message += f"👥 Изменение группы:\n"
-            message += f"   Было: {change['old_value'] if change['old_value'] else '-'}\n"
-            message += f"   Стало: {change['new_value']}\n\n"
-
-        # Затем выводим изменения в оценках
-        grade_changes = [c for c in changes if c['type'] == 'grade']
-        if grade_changes:
-            message += "📚 Изменения в успеваемости:\n\n"
-            for change in grade_changes:
-                message += f"📚 {change['subject']} (модуль {change['module']}):\n"
-                message += f"   Было: {change['old_value'] if change['old_value'] not in ['не изучает', None, 'None'] else '-'}\n"
-                message += f"   Стало: {change['new_value']}\n\n"
-        
-        return message
-
-    async def _parser_worker(self):
-        """Обрабатывает очередь студентов для парсинга"""
+            if row:
+                old_groups[student_id] = row[0]
+        old_grades = load_grades_batch(cursor, student_ids)
+
+        now = datetime.datetime.now()
+        cursor.executemany('''
+            INSERT INTO students (student_id, name, update_date, last_parsed_time, notifications, telegram_id, student_group)
+            VALUES (?, ?, ?, ?, 1, ?, ?)
+            ON CONFLICT(student_id) DO UPDATE SET
+                name=excluded.name,
+                update_date=excluded.update_date,
+                last_parsed_time=excluded.last_parsed_time,
+                notifications=1,
+                telegram_id=COALESCE(excluded.telegram_id, students.telegram_id),
+                student_group=COALESCE(excluded.student_group, students.student_group)
+        ''', [
+            (student_id, result['update']['name'], now.strftime('%Y-%m-%d %H:%M:%S'), now.isoformat(),
+             result['job']['telegram_id'] or None, result['job']['student_group'])
+            for student_id, result in updates.items()
+        ])
+        save_grades_batch(cursor, [
+            (student_id, result['update']['subjects'], result['update']['grades'])
+            for student_id, result in updates.items()
+        ], now)
+        cursor.executemany(
+            'UPDATE course_works SET student_group = ? WHERE student_id = ?',
+            [(result['job']['student_group'], student_id) for student_id, result in updates.items()]
+        )
+
+        events = 0
+        for student_id, result in updates.items():
+            update = result['update']
+            # Первый парсинг студента, которого еще не было в базе, - не изменение
+            if student_id in old_groups:
+                old_group, new_group = old_groups[student_id], result['job']['student_group']
+                group_change = (old_group, new_group) if new_group is not None and new_group != old_group else None
+                changes = grade_changes(old_grades[student_id], update['subjects'], update['grades'])
+                events += record_events(cursor, student_id, group_change, changes, now.isoformat())
+            logger.info(f"Успешно обновлены данные для студента {update['name']} (ID: {student_id})")
+        if events:
+            queue_event_notifications(cursor.connection)
+
+        self._save_page_digests(cursor, [
+            (student_id, result['update']['digest'])
+            for student_id, result in updates.items() if result['update']['digest']
+        ])
+
+    def _save_portfolios(self, cursor, results):
+        """Записывает результаты проверки портфолио: владельца и новые курсовые работы, хеши страниц"""
+        synced = [result for result in results if result['update']['records'] is not None]
+        cursor.executemany('''
+            UPDATE course_works SET telegram_id = ?
+            WHERE student_id = ? AND telegram_id IS NOT ?
+        ''', [
+            (result['job']['telegram_id'], result['job']['student_id'], result['job']['telegram_id'])
+            for result in synced if result['job']['telegram_id']
+        ])
+        records = [record for result in synced for record in result['update']['records']]
+        if records:
+            save_course_works(cursor, records)
+        self._save_portfolio_digests(cursor, [
+            (result['job']['student_id'], result['update']['digest']) for result in results
+        ])
+
+    def _apply_results(self, conn, results):
+        """
+        Записывает пачку результатов обработчиков в транзакции conn (вызывается ResultWriter
+        вне event loop): оценки и уведомления об изменениях, курсовые работы, хеши страниц,
+        завершение задач и время следующей проверки.
+        """
+        cursor = conn.cursor()
+        rounds, unchanged, portfolios = [], [], []
+        for result in results:
+            update = result['update']
+            if update is None:
+                continue
+            student_id = result['job']['student_id']
+            if result['job']['kind'] == PORTFOLIO_JOB:
+                portfolios.append(result)
+            elif update.get('unchanged'):
+                unchanged.append(student_id)
+            else:
+                # Повторное обновление того же студента - в следующем раунде, чтобы сравнить с предыдущим
+                for updates in rounds:
+                    if student_id not in updates:
+                        updates[student_id] = result
+                        break
+                else:
+                    rounds.append({student_id: result})
+        for updates in rounds:
+            self._save_grade_updates(cursor, updates)
+        if unchanged:
+            self._mark_unchanged(cursor, unchanged)
+        if portfolios:
+            self._save_portfolios(cursor, portfolios)
+        for result in results:
+            self._finish_job(result['job'], result['error'], result['defer_seconds'], conn=conn)
+
+    async def _process_grades_job(self, job):
+        """
+        Проверяет оценки студента по странице рейтинга. В базу результат записывает
+        ResultWriter (_apply_results).
+        Returns: (None, данные для записи) при успехе или (текст ошибки, None)
+        """
+        student_id, telegram_id, student_group = job['student_id'], job['telegram_id'], job['student_group']
+
+        # Загружаем страницу и сравниваем хеш значимых фрагментов с сохраненным:
+        # если ничего не изменилось, разбор, запись оценок и сравнение не нужны
+        rating_content = await fetch_rating_page(student_id)
+        digest = compute_rating_digest(rating_content, student_group, telegram_id)
+        if digest and digest == await run_blocking(self._get_page_digest, student_id):
+            self.cycle_stats['skipped'] += 1
+            logger.info(f"Страница рейтинга студента {student_id} не изменилась, обновление пропущено")
+            return None, {'unchanged': True}
+
+        # Парсим данные студента
+        rating = await parse_rating(student_id, content=rating_content)
+        if rating is None:
+            self.cycle_stats['failed'] += 1
+            logger.warning(f"Не удалось получить данные для студента {student_id}")
+            return "не удалось получить данные студента", None
+        full_name, grades, subjects = rating
+        self.cycle_stats['full'] += 1
+        return None, {'name': student_last_name(full_name), 'grades': grades, 'subjects': subjects, 'digest': digest}
+
+    async def _process_portfolio_job(self, job):
+        """
+        Проверяет портфолио студента и скачивает новые курсовые работы. Записи о них
+        сохраняет ResultWriter (_apply_results).
+        Returns: (None, данные для записи) при успехе или (текст ошибки, None)
+        """
+        student_id, telegram_id, student_group = job['student_id'], job['telegram_id'], job['student_group']
+
+        portfolio_content = await fetch_portfolio_page(student_id)
+        digest = compute_portfolio_digest(portfolio_content, student_group, telegram_id)
+        if digest == await run_blocking(self._get_page_digest, student_id, 'portfolio_digest'):
+            self.cycle_stats['portfolio_skipped'] += 1
+            logger.info(f"Портфолио студента {student_id} не изменилось, проверка курсовых работ пропущена")
+            return None, {'digest': digest, 'records': None}
+
+        records = []
+        course_works = await sync_course_works(
+            student_id, await run_blocking(self._get_student_name, student_id), telegram_id, student_group,
+            content=portfolio_content, records=records
+        )
+        self.cycle_stats['portfolio_full'] += 1
+        logger.info(f"Проверено портфолио студента {student_id}: курсовых работ {len(course_works)}, новых {len(records)}")
+        return None, {'digest': digest, 'records': records}
+
+    async def _parser_worker(self, worker_num=0, kind=GRADES_JOB):
+        """
+        Разбирает задачи вида kind из очереди scrape_jobs (один из обработчиков оценок или портфолио).
+        Результаты записывает пачками ResultWriter.
+        """
+        process_job = self._process_portfolio_job if kind == PORTFOLIO_JOB else self._process_grades_job
         while self.is_running:
             try:
-                # Получаем студента из очереди
-                student = await self.parsing_queue.get()
-                student_id, telegram_id, student_group = student
+                # Пока VUZ2 недоступен, задачи не берем (пробные запросы делает предохранитель)
+                await vuz2_client.breaker.wait_until_available()
+                job = await run_blocking(scrape_jobs.claim, [kind])
+                if job is None:
+                    await scrape_jobs.wait_for_jobs()
+                    continue
+                student_id = job['student_id']
+                result = {'job': job, 'error': None, 'defer_seconds': None, 'update': None}
 
                 try:
-                    # Получаем текущие оценки студента
-                    old_ratings = self._get_student_ratings(student_id)
-
-                    # Получаем существующие курсовые работы
-                    existing_course_works = self._get_existing_course_works(student_id)
-
-                    # Парсим данные студента
-                    name, grades, subjects, course_works = parse_student_data(
-                        student_id, 
-                        telegram_id=telegram_id,
-                        student_group=student_group,
-                        skip_existing_course_works=existing_course_works
-                    )
+                    result['error'], result['update'] = await process_job(job)
 
-                    if name != "Unknown":
-                        # Сохраняем данные в базу
-                        save_to_db(
-                            student_id=student_id,
-                            name=name,
-                            grades=grades,
-                            subjects=subjects,
-                            telegram_id=telegram_id,
-                            student_group=student_group
-                        )
-
-                        # Обновляем группу в таблице course_works
-                        with get_db_connection() as conn:
-                            cursor = conn.cursor()
-                            cursor.execute('''
-                                UPDATE course_works 
-                                SET student_group = ? 
-                                WHERE student_id = ?
-                            ''', (student_group, student_id))
-                            conn.commit()
-                            if cursor.rowcount > 0:
-                                logger.info(f"Обновлена группа в курсовых работах для студента {name} (ID: {student_id})")
-
-                        # Получаем новые оценки после сохранения
-                        new_ratings = self._get_student_ratings(student_id)
-
-                        # Сравниваем оценки и отправляем уведомление если есть изменения
-                        if telegram_id and not self._is_system_telegram_id(telegram_id):
-                            changes = self._compare_ratings(old_ratings, new_ratings)
-                            if changes:
-                                message = self._format_changes_message(name, changes)
-                                if message:
-                                    try:
-                                        await self.application.bot.send_message(
-                                            chat_id=telegram_id,
-                                            text=message
-                                        )
-                                        logger.info(f"Отправлено уведомление об изменениях студенту {name} (ID: {student_id})")
-                                    except Exception as e:
-                                        logger.error(f"Ошибка при отправке уведомления студенту {student_id}: {e}")
-
-                        logger.info(f"Успешно обновлены данные для студента {name} (ID: {student_id})")
-                    else:
-                        logger.warning(f"Не удалось получить данные для студента {student_id}")
+                except Vuz2Unavailable as e:
+                    # Не ошибка студента: проверим его снова, когда VUZ2 поднимется
+                    self.cycle_stats['deferred'] += 1
+                    result['defer_seconds'] = e.retry_after
+                    logger.info(f"Парсинг студента {student_id} ({kind}) отложен: {e}")
 
                 except Exception as e:
-                    logger.error(f"Ошибка при парсинге студента {student_id}: {e}")
+                    self.cycle_stats['failed'] += 1
+                    result['error'] = f"{type(e).__name__}: {e}"
+                    logger.error(f"Ошибка при парсинге студента {student_id} ({kind}, обработчик {worker_num}): {e}")
 
-                finally:
-                    # Отмечаем задачу как выполненную
-                    self.parsing_queue.task_done()
-                    # Делаем небольшую паузу между парсингом студентов
-                    await asyncio.sleep(5)
+                # Прерванную задачу (CancelledError) не передаем: при остановке ее вернет release_owned.
+                # Паузы между студентами не нужны: темп запросов к VUZ2 задает ограничитель в Vuz2Client
+                await self.result_writer.submit(result)
 
             except asyncio.CancelledError:
                 break
             except Exception as e:
                 logger.error(f"Ошибка в обработчике парсинга: {e}")
-                await asyncio.sleep(60)  # Ждем минуту перед повторной попыткой 
\ No newline at end of file
+                await asyncio.sleep(60)  # Ждем минуту перед повторной попыткой
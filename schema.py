@@ -0,0 +1,473 @@
+import re
+import json
+import time
+import sqlite3
+import datetime
+from utils import logger, config, get_db_connection, discipline_key, invalidate_table_columns
+
+# Схема базы данных задается упорядоченным списком миграций MIGRATIONS. Номер последней
+# примененной миграции хранится в таблице schema_version, поэтому при запуске бота и
+# отдельных обработчиков парсинга (scrape_worker.py) init_db выполняет один SELECT и
+# не трогает схему, если она актуальна. Миграции идемпотентны (CREATE ... IF NOT EXISTS,
+# проверка колонок перед ALTER TABLE): базы, созданные до schema_version, проходят их все.
+# Изменение схемы - только новой миграцией в конце списка, старые не редактируются.
+
+# Настройки миграций (переопределяются секцией "migrations" в config.json)
+MIGRATION_SETTINGS = {
+    'batch_size': 1000,     # Строк за одну транзакцию в миграциях, переписывающих таблицы по частям
+    'pause_seconds': 0.05,  # Пауза между частями, чтобы запись бота и обработчиков не ждала миграцию
+    **config.get('migrations', {})
+}
+
+# Индексы для частых запросов: (имя, таблица, колонки). Создаются миграцией после таблиц
+# (новый индекс - новая миграция, вызывающая _create_indexes); план запросов проверяет
+# benchmarks/check_query_plans.py
+INDEXES = (
+    # Каждое нажатие кнопки ищет студента по telegram_id
+    ('idx_students_telegram_id', 'students', 'telegram_id'),
+    # Список группы и оценки группы по дисциплине (ORDER BY name без сортировки)
+    ('idx_students_group', 'students', 'student_group, name'),
+    ('idx_course_works_student', 'course_works', 'student_id, discipline, semester'),
+    ('idx_course_works_discipline_key', 'course_works', 'discipline_key'),
+    ('idx_course_work_files_source_url', 'course_work_files', 'source_url'),
+    ('idx_scrape_state_next_parse_at', 'scrape_state', 'next_parse_at'),
+    ('idx_scrape_state_portfolio_next_at', 'scrape_state', 'portfolio_next_at'),
+    ('idx_scrape_jobs_claim', 'scrape_jobs', 'status, priority DESC, available_at'),
+    ('idx_scrape_jobs_student', 'scrape_jobs', 'student_id'),
+    ('idx_notification_outbox_unsent', 'notification_outbox', 'sent_at, id'),
+    ('idx_refresh_requests_student', 'refresh_requests', 'student_id, finished_at'),
+    ('idx_grades_subject', 'grades', 'subject_id, student_id'),
+)
+
+WEEKDAYS = ('monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday')
+LESSONS_PER_DAY = 5
+
+def _columns(cursor, table):
+    cursor.execute(f'PRAGMA table_info({table})')
+    return [col[1] for col in cursor.fetchall()]
+
+def _table_exists(cursor, table):
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (table,))
+    return cursor.fetchone() is not None
+
+def _add_columns(cursor, table, columns):
+    """Добавляет колонки [(имя, тип)], которых еще нет в таблице"""
+    existing = _columns(cursor, table)
+    for name, definition in columns:
+        if name not in existing:
+            cursor.execute(f'ALTER TABLE {table} ADD COLUMN {name} {definition}')
+
+def _create_indexes(cursor):
+    for name, table, columns in INDEXES:
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {table}({columns})')
+
+def _base_tables(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS students (
+            student_id TEXT PRIMARY KEY,
+            name TEXT,
+            update_date TEXT,
+            telegram_id TEXT,
+            student_group TEXT,
+            is_admin INTEGER DEFAULT 0,
+            backup_telegram_ids TEXT DEFAULT '[]',
+            last_parsed_time TEXT,
+            is_superadmin INTEGER DEFAULT 0,
+            notifications INTEGER DEFAULT 1
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS course_works (
+            discipline TEXT,
+            student_id TEXT,
+            telegram_id TEXT,
+            name TEXT,
+            student_group TEXT,
+            semester INTEGER,
+            file_path TEXT,
+            parsing_time TEXT
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS course_work_archives (
+            discipline TEXT PRIMARY KEY,
+            archive_parts TEXT DEFAULT '[]',
+            last_updated TEXT NOT NULL,
+            file_count INTEGER DEFAULT 0,
+            total_size INTEGER DEFAULT 0
+        )
+    ''')
+    disc_columns = ',\n'.join(f'            disc_{n} TEXT' for n in range(1, 31))
+    cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS disciplines (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            group_name TEXT NOT NULL,
+{disc_columns},
+            UNIQUE(group_name)
+        )
+    ''')
+
+def _schedule_tables(cursor):
+    """
+    Расписание и настройки бота (раньше создавались только migrate.py).
+    Строка raspisanie - группа, подгруппа и тип недели: group_full_name "<группа>_sub<N>_<UP|DOWN>",
+    те же значения лежат в колонках subgroup и week_type.
+    """
+    _add_columns(cursor, 'students', [('subgroup', 'INTEGER DEFAULT 1')])
+    lesson_columns = ',\n'.join(
+        f'            {day}_{n} TEXT' for day in WEEKDAYS for n in range(1, LESSONS_PER_DAY + 1)
+    )
+    cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS raspisanie (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            group_full_name TEXT NOT NULL,
+            subgroup INTEGER,
+            week_type TEXT,
+{lesson_columns},
+            UNIQUE(group_full_name)
+        )
+    ''')
+    _add_columns(cursor, 'raspisanie', [('subgroup', 'INTEGER'), ('week_type', 'TEXT')])
+    cursor.execute('SELECT id, group_full_name FROM raspisanie WHERE week_type IS NULL')
+    updates = []
+    for row_id, group_full_name in cursor.fetchall():
+        match = re.fullmatch(r'.+_sub(\d+)_(UP|DOWN)', group_full_name or '')
+        if match:
+            updates.append((int(match.group(1)), match.group(2), row_id))
+    cursor.executemany('UPDATE raspisanie SET subgroup=?, week_type=? WHERE id=?', updates)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS bot_settings (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL,
+            updated_at TEXT NOT NULL
+        )
+    ''')
+    now = datetime.datetime.now().isoformat()
+    cursor.execute(
+        'INSERT OR IGNORE INTO bot_settings (key, value, updated_at) VALUES (?, ?, ?)',
+        ('week_type', json.dumps({'current_type': 'UP', 'last_change': now, 'auto_switch': True}), now)
+    )
+
+def _blackmarket_tables(cursor):
+    """Объявления Black Market. Создавать объявления можно всем, пока суперадмин не запретит"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS blackmarket (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            student_id TEXT NOT NULL,
+            is_anon INTEGER NOT NULL DEFAULT 0,
+            title TEXT NOT NULL,
+            content TEXT NOT NULL,
+            contacts TEXT,
+            publication_time TEXT NOT NULL
+        )
+    ''')
+    _add_columns(cursor, 'students', [
+        ('blackmarket_allowed', 'INTEGER DEFAULT 1'),
+        ('blackmarket_announcements', 'INTEGER DEFAULT 1')
+    ])
+
+def _scrape_tables(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS scrape_state (
+            student_id TEXT PRIMARY KEY,
+            page_digest TEXT,
+            checked_at TEXT,
+            changed_at TEXT
+        )
+    ''')
+    _add_columns(cursor, 'scrape_state', [
+        ('next_parse_at', 'TEXT'),
+        ('failures', 'INTEGER NOT NULL DEFAULT 0'),
+        ('retired_at', 'TEXT'),
+        ('portfolio_digest', 'TEXT'),
+        ('portfolio_checked_at', 'TEXT'),
+        ('portfolio_next_at', 'TEXT')
+    ])
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS scrape_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            student_id TEXT NOT NULL,
+            priority INTEGER NOT NULL DEFAULT 0,
+            status TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            available_at TEXT NOT NULL,
+            lease_owner TEXT,
+            lease_until TEXT,
+            last_error TEXT,
+            created_at TEXT NOT NULL,
+            started_at TEXT,
+            finished_at TEXT
+        )
+    ''')
+    # Не больше одной незавершенной задачи каждого вида на студента
+    cursor.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_scrape_jobs_active
+        ON scrape_jobs(kind, student_id) WHERE status IN ('pending', 'running')
+    ''')
+    # Задачи общего парсинга (до разделения на оценки и портфолио) становятся задачами оценок
+    cursor.execute("UPDATE scrape_jobs SET kind='grades' WHERE kind='scrape'")
+
+def _outbox_tables(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS notification_outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            telegram_id TEXT NOT NULL,
+            text TEXT NOT NULL,
+            created_at TEXT NOT NULL,
+            sent_at TEXT,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            last_error TEXT
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS refresh_requests (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            student_id TEXT,
+            student_group TEXT,
+            chat_id TEXT NOT NULL,
+            message_id INTEGER NOT NULL,
+            requested_at TEXT NOT NULL,
+            finished_at TEXT,
+            succeeded INTEGER,
+            edited_at TEXT
+        )
+    ''')
+    # Одно открытое обновление на сообщение: повторные нажатия кнопки не создают новых
+    cursor.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_refresh_requests_open
+        ON refresh_requests(chat_id, message_id) WHERE edited_at IS NULL
+    ''')
+
+def _grades_tables(cursor):
+    """
+    Оценки: справочник дисциплин и по строке на (студент, дисциплина, модуль).
+    Строка есть, только если студент изучает дисциплину; value NULL - оценки еще нет.
+    Оценки из старых колонок students переносятся не здесь, а в фоне по частям
+    (grade_store.migrate_legacy_grades), чтобы бот не ждал перезаписи таблицы.
+    """
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS subjects (
+            id INTEGER PRIMARY KEY,
+            name TEXT UNIQUE NOT NULL
+        )
+    ''')
+    grades_exists = _table_exists(cursor, 'grades')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS grades (
+            student_id TEXT NOT NULL,
+            subject_id INTEGER NOT NULL,
+            module INTEGER NOT NULL,
+            value TEXT,
+            updated_at TEXT NOT NULL,
+            PRIMARY KEY (student_id, subject_id, module)
+        ) WITHOUT ROWID
+    ''')
+    # Студенты, оценки которых еще лежат в старых колонках students "<дисциплина> (модуль N)"
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS legacy_grades_pending (
+            student_id TEXT PRIMARY KEY
+        )
+    ''')
+    if not grades_exists and any(' (модуль ' in column for column in _columns(cursor, 'students')):
+        cursor.execute('INSERT OR IGNORE INTO legacy_grades_pending (student_id) SELECT student_id FROM students')
+
+def _user_activity_table(cursor):
+    user_activity_exists = _table_exists(cursor, 'user_activity')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS user_activity (
+            telegram_id TEXT PRIMARY KEY,
+            last_seen_at TEXT,
+            blocked_at TEXT
+        )
+    ''')
+    if not user_activity_exists:
+        # Пользователи, зарегистрированные до учета активности, считаются заходившими сейчас
+        cursor.execute('''
+            INSERT OR IGNORE INTO user_activity (telegram_id, last_seen_at)
+            SELECT DISTINCT telegram_id, ? FROM students
+            WHERE telegram_id IS NOT NULL AND telegram_id NOT IN ('added by admin', 'added_by_superadmin')
+        ''', (datetime.datetime.now().isoformat(),))
+
+def _course_work_file_tables(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS course_work_downloads (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            student_id TEXT,
+            url TEXT NOT NULL,
+            file_path TEXT,
+            bytes INTEGER,
+            duration REAL,
+            status TEXT NOT NULL,
+            error TEXT,
+            downloaded_at TEXT NOT NULL
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS course_work_blobs (
+            sha256 TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            created_at TEXT NOT NULL
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS course_work_files (
+            student_id TEXT NOT NULL,
+            discipline TEXT NOT NULL,
+            semester TEXT NOT NULL,
+            sha256 TEXT NOT NULL,
+            original_name TEXT NOT NULL,
+            source_url TEXT,
+            linked_at TEXT NOT NULL,
+            PRIMARY KEY (student_id, discipline, semester)
+        )
+    ''')
+
+def _discipline_key_column(cursor):
+    _add_columns(cursor, 'course_works', [('discipline_key', 'TEXT')])
+
+def _backfill_discipline_keys(cursor, batch_size):
+    """Заполняет course_works.discipline_key у записей, сохраненных до появления колонки"""
+    cursor.execute(
+        'SELECT rowid, discipline FROM course_works WHERE discipline_key IS NULL AND discipline IS NOT NULL LIMIT ?',
+        (batch_size,)
+    )
+    rows = cursor.fetchall()
+    cursor.executemany(
+        'UPDATE course_works SET discipline_key=? WHERE rowid=?',
+        [(discipline_key(discipline), rowid) for rowid, discipline in rows]
+    )
+    return len(rows)
+
+def _backups_table(cursor):
+    """Журнал резервных копий базы (backup_service.py)"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS backups (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            file TEXT,
+            started_at TEXT NOT NULL,
+            finished_at TEXT NOT NULL,
+            duration REAL,
+            size INTEGER,
+            pages INTEGER,
+            steps INTEGER,
+            restarts INTEGER,
+            integrity TEXT,
+            error TEXT
+        )
+    ''')
+
+def _grade_events_table(cursor):
+    """История изменений оценок и группы студентов (grade_events.py), строки только добавляются"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS grade_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            student_id TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            subject_id INTEGER,
+            module INTEGER,
+            old_value TEXT,
+            new_value TEXT,
+            changed_at TEXT NOT NULL,
+            notified_at TEXT
+        )
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_grade_events_student
+        ON grade_events(student_id, kind, subject_id, module, id)
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_grade_events_changed_at ON grade_events(changed_at)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_grade_events_unnotified ON grade_events(notified_at, id)')
+
+# (номер, описание, функция, по частям). Обычная миграция - функция(cursor) в одной транзакции.
+# Миграция по частям - функция(cursor, batch_size), которая обрабатывает не больше batch_size
+# строк и возвращает их число: каждая часть - отдельная транзакция, пока функция не вернет 0.
+MIGRATIONS = (
+    (1, 'студенты, курсовые работы, архивы, дисциплины групп', _base_tables, False),
+    (2, 'расписание (raspisanie), настройки бота, students.subgroup', _schedule_tables, False),
+    (3, 'Black Market: blackmarket, students.blackmarket_allowed/blackmarket_announcements', _blackmarket_tables, False),
+    (4, 'состояние парсинга и очередь задач', _scrape_tables, False),
+    (5, 'очередь уведомлений и обновления по кнопке', _outbox_tables, False),
+    (6, 'таблицы оценок', _grades_tables, False),
+    (7, 'активность пользователей', _user_activity_table, False),
+    (8, 'файлы курсовых работ', _course_work_file_tables, False),
+    (9, 'колонка course_works.discipline_key', _discipline_key_column, False),
+    (10, 'заполнение course_works.discipline_key', _backfill_discipline_keys, True),
+    (11, 'индексы частых запросов', _create_indexes, False),
+    (12, 'журнал резервных копий', _backups_table, False),
+    (13, 'история изменений оценок', _grade_events_table, False),
+)
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+def schema_version(cursor):
+    """Returns: номер последней примененной миграции (0 - база без schema_version)"""
+    try:
+        cursor.execute('SELECT MAX(version) FROM schema_version')
+    except sqlite3.OperationalError as e:
+        if 'no such table' not in str(e):
+            raise
+        return 0
+    return cursor.fetchone()[0] or 0
+
+def _record_version(cursor, version, name):
+    cursor.execute(
+        'INSERT OR IGNORE INTO schema_version (version, name, applied_at) VALUES (?, ?, ?)',
+        (version, name, datetime.datetime.now().isoformat())
+    )
+
+def _apply(conn, version, name, migrate, chunked, settings):
+    """
+    Применяет миграцию, если ее еще не применил другой процесс (бот и scrape_worker.py
+    могут запускаться одновременно: проверка и запись версии - под BEGIN IMMEDIATE).
+    Returns: True, если миграция применена этим вызовом
+    """
+    cursor = conn.cursor()
+    while chunked:
+        conn.execute('BEGIN IMMEDIATE')
+        if schema_version(cursor) >= version:
+            conn.commit()
+            return False
+        rows = migrate(cursor, settings['batch_size'])
+        conn.commit()
+        if not rows:
+            break
+        time.sleep(settings['pause_seconds'])
+    conn.execute('BEGIN IMMEDIATE')
+    if schema_version(cursor) >= version:
+        conn.commit()
+        return False
+    if not chunked:
+        migrate(cursor)
+    _record_version(cursor, version, name)
+    conn.commit()
+    return True
+
+def init_db(settings=MIGRATION_SETTINGS):
+    """
+    Приводит схему базы к последней версии (при запуске бота и scrape_worker.py).
+    Если схема актуальна - один запрос без DDL.
+    Returns: список номеров миграций, примененных этим вызовом
+    """
+    applied = []
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        version = schema_version(cursor)
+        if version >= LATEST_VERSION:
+            return applied
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                applied_at TEXT NOT NULL
+            )
+        ''')
+        conn.commit()
+        for number, name, migrate, chunked in MIGRATIONS:
+            if number <= version:
+                continue
+            started = time.perf_counter()
+            if _apply(conn, number, name, migrate, chunked, settings):
+                applied.append(number)
+                logger.info(f"Применена миграция базы {number} ({name}) за {time.perf_counter() - started:.2f} с")
+    invalidate_table_columns()
+    return applied
@@ -0,0 +1,74 @@
+"""
+Отдельный процесс парсинга VUZ2.
+
+Забирает задачи из общей очереди scrape_jobs (аренда в базе, поэтому один
+студент не обрабатывается двумя процессами одновременно), сохраняет
+результаты в базу, а уведомления об изменениях пишет в notification_outbox -
+их отправляет бот. Планировщик (постановка задач) работает в процессе бота.
+
+Запуск из каталога бота (рядом config.json и students.db), процессов может быть несколько:
+
+    python scrape_worker.py --workers 4 --portfolio-workers 1
+
+--workers - обработчики оценок, --portfolio-workers - обработчики портфолио (курсовых работ).
+Чтобы весь парсинг шел в отдельных процессах, в config.json укажите
+"scheduler": {"parser_workers": 0, "portfolio_workers": 0}. Ограничение vuz2.requests_per_second
+действует на каждый процесс отдельно (--rps задает его для этого процесса).
+"""
+import signal
+import asyncio
+import argparse
+import traceback
+from utils import logger
+from schema import init_db
+from scheduler import StudentParserScheduler, SCHEDULER_SETTINGS
+from scraper import vuz2_client, VUZ2_SETTINGS
+from job_queue import scrape_jobs
+
+async def _log_stats(parser, stop_event):
+    """Периодически пишет в лог статистику парсинга этого процесса"""
+    while not stop_event.is_set():
+        try:
+            await asyncio.wait_for(stop_event.wait(), timeout=SCHEDULER_SETTINGS['stats_interval_minutes'] * 60)
+        except asyncio.TimeoutError:
+            await parser._roll_stats()
+
+async def main(worker_count, portfolio_worker_count):
+    init_db()
+    parser = StudentParserScheduler(application=None)
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:
+            # Windows: остановка по KeyboardInterrupt
+            pass
+
+    await parser.start_workers(worker_count, portfolio_worker_count)
+    logger.info(f"Процесс парсинга {scrape_jobs.owner} запущен")
+    try:
+        await _log_stats(parser, stop_event)
+    finally:
+        logger.info("Остановка процесса парсинга...")
+        await parser.stop()
+        await vuz2_client.close()
+        logger.info("Процесс парсинга остановлен")
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description='Отдельный процесс парсинга VUZ2')
+    arg_parser.add_argument('--workers', type=int, default=SCHEDULER_SETTINGS['parser_workers'] or 4,
+                            help='число обработчиков оценок в этом процессе')
+    arg_parser.add_argument('--portfolio-workers', type=int, default=SCHEDULER_SETTINGS['portfolio_workers'] or 1,
+                            help='число обработчиков портфолио в этом процессе')
+    arg_parser.add_argument('--rps', type=float, help='запросов к VUZ2 в секунду для этого процесса')
+    args = arg_parser.parse_args()
+    if args.rps is not None:
+        VUZ2_SETTINGS['requests_per_second'] = args.rps
+    try:
+        asyncio.run(main(max(0, args.workers), max(0, args.portfolio_workers)))
+    except KeyboardInterrupt:
+        logger.info("Процесс парсинга остановлен пользователем")
+    except Exception as e:
+        logger.error(f"Критическая ошибка процесса парсинга: {type(e).__name__} - {str(e)}")
+        logger.error(f"Traceback: {traceback.format_exc()}")
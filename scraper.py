@@ -0,0 +1,750 @@
+import os
+import re
+import time
+import collections
+import datetime
+import tempfile
+import asyncio
+import hashlib
+import httpx
+from extractor import (
+    FastPathError, extract_rating_fast, extract_rating_full,
+    extract_portfolio_fast, extract_portfolio_full, rating_fragments, portfolio_fragment
+)
+from utils import (
+    logger, config, get_db_connection, COURSE_WORKS_DIR,
+    validate_student_id, save_course_work_to_db, run_blocking, discipline_key
+)
+from course_work_store import find_blob_by_url, store_blob, link_course_work, original_name_from_url
+
+# Настройки доступа к VUZ2 (переопределяются секцией "vuz2" в config.json)
+VUZ2_SETTINGS = {
+    'base_url': 'http://vuz2.bru.by',
+    'connect_timeout': 5.0,             # Таймаут установки соединения
+    'read_timeout': 10.0,               # Таймаут чтения страницы
+    'download_timeout': 60.0,           # Таймаут чтения при скачивании курсовых работ
+    'max_download_bytes': 50 * 1024 * 1024,  # Максимальный размер файла курсовой работы
+    'download_chunk_size': 64 * 1024,   # Размер части при потоковом скачивании
+    'max_connections': 10,              # Максимум одновременных соединений в пуле
+    'max_keepalive_connections': 5,     # Сколько соединений держать открытыми
+    'keepalive_expiry': 30.0,           # Время жизни простаивающего соединения
+    'requests_per_second': 2.0,         # Средняя частота запросов к одному хосту (0 - без ограничения)
+    'burst': 2,                         # Сколько запросов можно отправить подряд без ожидания
+    'max_in_flight': 4,                 # Максимум одновременных запросов к одному хосту
+    'fast_extraction': True,            # Разбирать только нужные фрагменты страниц (см. extractor.py)
+    'page_cache_ttl': 60.0,             # Сколько секунд страница из кеша считается свежей (регистрация)
+    'page_cache_max_entries': 256,      # Максимум страниц в кеше
+    'breaker_window': 20,               # По скольким последним запросам считается доля ошибок
+    'breaker_min_requests': 5,          # Минимум запросов в окне, чтобы разомкнуть цепь
+    'breaker_error_rate': 0.5,          # Доля ошибок (и медленных ответов), при которой цепь размыкается
+    'breaker_slow_seconds': 8.0,        # Ответ дольше этого считается ошибкой
+    'breaker_open_seconds': 60.0,       # Пауза перед пробным запросом
+    'breaker_max_open_seconds': 600.0,  # Максимальная пауза (растет вдвое после неудачной пробы)
+    **config.get('vuz2', {})
+}
+
+class DownloadTooLarge(Exception):
+    """Скачиваемый файл больше допустимого размера"""
+
+    def __init__(self, url, size, max_bytes):
+        super().__init__(f"файл {url} больше {max_bytes} байт (получено {size})")
+        self.size = size
+
+class Vuz2Unavailable(Exception):
+    """VUZ2 считается недоступным: цепь разомкнута, запрос не отправлялся"""
+
+    def __init__(self, retry_after):
+        super().__init__(f"VUZ2 недоступен, повторная попытка через {retry_after:.0f} с")
+        self.retry_after = retry_after
+
+class CircuitBreaker:
+    """
+    Предохранитель для запросов к VUZ2.
+    closed - запросы идут как обычно, в скользящем окне считаются ошибки и медленные ответы;
+    open - при высокой доле ошибок запросы сразу отклоняются (Vuz2Unavailable) на open_seconds;
+    half_open - после паузы пропускается один пробный запрос: успех замыкает цепь,
+    ошибка снова размыкает ее с удвоенной паузой.
+    Ошибками считаются сетевые сбои, таймауты и ответы 5xx; 4xx - это ответ живого сервера.
+    """
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+    def __init__(self, window, min_requests, error_rate, slow_seconds, open_seconds, max_open_seconds):
+        self.min_requests = min_requests
+        self.error_rate_threshold = error_rate
+        self.slow_seconds = slow_seconds
+        self.base_open_seconds = open_seconds
+        self.max_open_seconds = max_open_seconds
+        self.state = self.CLOSED
+        self.open_seconds = open_seconds
+        self.opened_at = None
+        self.open_until = 0.0
+        self.last_error = None
+        self.rejected = 0
+        self._results = collections.deque(maxlen=window)    # (ok, latency)
+        self._probe_in_flight = False
+
+    def _retry_after(self):
+        return max(0.0, self.open_until - time.monotonic())
+
+    @property
+    def is_open(self):
+        """Запросы сейчас отклоняются (пробный запрос еще не разрешен или уже выполняется)"""
+        if self.state == self.OPEN:
+            return self._retry_after() > 0
+        return self.state == self.HALF_OPEN and self._probe_in_flight
+
+    def before_call(self):
+        """Вызывается перед запросом. Raises: Vuz2Unavailable, если цепь разомкнута"""
+        if self.state == self.OPEN:
+            if self._retry_after() > 0:
+                self.rejected += 1
+                raise Vuz2Unavailable(self._retry_after())
+            self.state = self.HALF_OPEN
+            logger.info("VUZ2: пробный запрос после паузы")
+        if self.state == self.HALF_OPEN:
+            if self._probe_in_flight:
+                self.rejected += 1
+                raise Vuz2Unavailable(1.0)
+            self._probe_in_flight = True
+
+    def record_success(self, latency=None):
+        """latency=None - не проверять время ответа (скачивание файлов)"""
+        if latency is not None and latency > self.slow_seconds:
+            self._record_failure(f"медленный ответ {latency:.1f} с")
+            return
+        if self.state == self.HALF_OPEN:
+            logger.info("VUZ2 снова доступен, цепь замкнута")
+            self.state = self.CLOSED
+            self.open_seconds = self.base_open_seconds
+            self.opened_at = None
+            self._results.clear()
+        self._probe_in_flight = False
+        self._results.append((True, latency))
+
+    def record_error(self, error):
+        """Учитывает исключение запроса; отмену и ошибки клиента (4xx) ошибкой VUZ2 не считает"""
+        if isinstance(error, httpx.HTTPStatusError) and error.response.status_code < 500:
+            self.record_success()
+        elif isinstance(error, (httpx.TransportError, httpx.HTTPStatusError)):
+            self._record_failure(f"{type(error).__name__}: {error}")
+        else:
+            self._probe_in_flight = False
+
+    def _record_failure(self, description):
+        self.last_error = description
+        self._probe_in_flight = False
+        if self.state == self.HALF_OPEN:
+            self.open_seconds = min(self.open_seconds * 2, self.max_open_seconds)
+            self._open()
+            return
+        self._results.append((False, None))
+        if self.state == self.CLOSED and len(self._results) >= self.min_requests and self.error_rate >= self.error_rate_threshold:
+            self._open()
+
+    def _open(self):
+        self.state = self.OPEN
+        self.opened_at = self.opened_at or datetime.datetime.now()
+        self.open_until = time.monotonic() + self.open_seconds
+        logger.warning(f"VUZ2 недоступен ({self.last_error}), запросы приостановлены на {self.open_seconds:.0f} с")
+
+    @property
+    def error_rate(self):
+        if not self._results:
+            return 0.0
+        return sum(1 for ok, _ in self._results if not ok) / len(self._results)
+
+    async def wait_until_available(self):
+        """Ждет, пока цепь не позволит отправить запрос (используется обработчиками очереди)"""
+        while self.is_open:
+            await asyncio.sleep(max(1.0, self._retry_after()))
+
+    def status(self):
+        """Состояние предохранителя для суперадминов"""
+        latencies = [latency for ok, latency in self._results if ok and latency is not None]
+        return {
+            'state': self.state,
+            'error_rate': self.error_rate,
+            'requests_in_window': len(self._results),
+            'avg_latency': sum(latencies) / len(latencies) if latencies else None,
+            'retry_after': self._retry_after() if self.state == self.OPEN else 0.0,
+            'opened_at': self.opened_at,
+            'last_error': self.last_error,
+            'rejected': self.rejected
+        }
+
+class RateLimiter:
+    """
+    Ограничитель запросов к одному хосту: token bucket (rate запросов в секунду,
+    не более burst подряд) плюс лимит одновременных запросов max_in_flight.
+    Используется как async context manager вокруг запроса.
+    """
+
+    def __init__(self, rate, burst=1, max_in_flight=1):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = self.burst
+        self.updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+        self._in_flight = asyncio.Semaphore(max(1, max_in_flight))
+
+    async def _take_token(self):
+        if self.rate <= 0:
+            return
+        # Лок выстраивает ожидающих в очередь, чтобы токены выдавались по порядку
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    async def __aenter__(self):
+        await self._in_flight.acquire()
+        try:
+            await self._take_token()
+        except BaseException:
+            self._in_flight.release()
+            raise
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self._in_flight.release()
+
+class PageCache:
+    """
+    Кеш страниц VUZ2 на короткое время, ключ - URL.
+    Одновременные запросы одного URL объединяются в одну загрузку.
+    Ошибки не кешируются.
+    """
+
+    def __init__(self, ttl, max_entries):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = {}      # url -> (expires_at, content)
+        self._pending = {}      # url -> asyncio.Future
+
+    def _get_fresh(self, url):
+        entry = self._entries.get(url)
+        if entry is None:
+            return None
+        expires_at, content = entry
+        if expires_at < time.monotonic():
+            del self._entries[url]
+            return None
+        return content
+
+    def _put(self, url, content):
+        if len(self._entries) >= self.max_entries:
+            now = time.monotonic()
+            self._entries = {key: value for key, value in self._entries.items() if value[0] >= now}
+            # Если все записи свежие, вытесняем самую старую
+            while len(self._entries) >= self.max_entries:
+                del self._entries[next(iter(self._entries))]
+        self._entries[url] = (time.monotonic() + self.ttl, content)
+
+    async def fetch(self, url, loader):
+        """Возвращает страницу из кеша или загружает ее через loader()"""
+        content = self._get_fresh(url)
+        if content is not None:
+            return content
+        pending = self._pending.get(url)
+        if pending is not None:
+            return await asyncio.shield(pending)
+
+        future = asyncio.get_running_loop().create_future()
+        self._pending[url] = future
+        try:
+            content = await loader()
+            self._put(url, content)
+            future.set_result(content)
+            return content
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Помечаем исключение полученным, даже если ожидающих нет
+            future.exception()
+            raise
+        finally:
+            del self._pending[url]
+
+    def clear(self):
+        self._entries.clear()
+
+class Vuz2Client:
+    """Асинхронный HTTP-клиент VUZ2 с общим пулом keep-alive соединений"""
+
+    def __init__(self, settings=None):
+        self.settings = settings or VUZ2_SETTINGS
+        self.base_url = self.settings['base_url'].rstrip('/')
+        self._client = None
+        self._limiters = {}
+        self.breaker = CircuitBreaker(
+            window=self.settings['breaker_window'],
+            min_requests=self.settings['breaker_min_requests'],
+            error_rate=self.settings['breaker_error_rate'],
+            slow_seconds=self.settings['breaker_slow_seconds'],
+            open_seconds=self.settings['breaker_open_seconds'],
+            max_open_seconds=self.settings['breaker_max_open_seconds']
+        )
+        self.cache = PageCache(
+            ttl=self.settings['page_cache_ttl'],
+            max_entries=self.settings['page_cache_max_entries']
+        )
+
+    def _get_limiter(self, url):
+        """Возвращает ограничитель запросов для хоста из url"""
+        host = httpx.URL(url).host
+        limiter = self._limiters.get(host)
+        if limiter is None:
+            limiter = RateLimiter(
+                rate=self.settings['requests_per_second'],
+                burst=self.settings['burst'],
+                max_in_flight=self.settings['max_in_flight']
+            )
+            self._limiters[host] = limiter
+        return limiter
+
+    def _get_client(self):
+        """Лениво создает httpx-клиент в текущем event loop"""
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                headers={
+                    'Accept-Encoding': 'gzip, deflate',
+                    'User-Agent': 'brumarks-bot'
+                },
+                timeout=httpx.Timeout(
+                    self.settings['read_timeout'],
+                    connect=self.settings['connect_timeout']
+                ),
+                limits=httpx.Limits(
+                    max_connections=self.settings['max_connections'],
+                    max_keepalive_connections=self.settings['max_keepalive_connections'],
+                    keepalive_expiry=self.settings['keepalive_expiry']
+                ),
+                follow_redirects=True
+            )
+        return self._client
+
+    def rating_url(self, student_id):
+        return f"{self.base_url}/rate/{student_id}/"
+
+    def portfolio_url(self, student_id):
+        return f"{self.base_url}/rate/{student_id}/portfolio/1/"
+
+    def absolute_url(self, url):
+        """Приводит относительную ссылку со страницы VUZ2 к абсолютной"""
+        if url.startswith('http'):
+            return url
+        return f"{self.base_url}{url}"
+
+    async def get(self, url, timeout=None, use_cache=False):
+        """
+        Выполняет GET-запрос и возвращает тело ответа.
+        timeout - таймаут чтения для этого запроса (по умолчанию read_timeout).
+        use_cache - взять страницу из короткоживущего кеша, если она уже загружалась
+        (регистрация и добавление студентов; планировщику нужны свежие страницы).
+        """
+        if use_cache:
+            return await self.cache.fetch(url, lambda: self._get(url, timeout))
+        return await self._get(url, timeout)
+
+    async def _get(self, url, timeout=None):
+        request_timeout = httpx.Timeout(
+            timeout or self.settings['read_timeout'],
+            connect=self.settings['connect_timeout']
+        )
+        self.breaker.before_call()
+        try:
+            async with self._get_limiter(url):
+                started_at = time.monotonic()
+                response = await self._get_client().get(url, timeout=request_timeout)
+                response.raise_for_status()
+        except BaseException as e:
+            self.breaker.record_error(e)
+            raise
+        self.breaker.record_success(time.monotonic() - started_at)
+        return response.content
+
+    async def download(self, url, directory, timeout=None, max_bytes=None):
+        """
+        Скачивает файл по частям во временный файл в directory и считает его sha256.
+        Файл сохраняется на диск (fsync) до возврата; вызывающий код перемещает его
+        на место атомарным os.replace или удаляет.
+        max_bytes - максимальный размер файла (None - без ограничения).
+        Returns: (tmp_path, size, sha256)
+        Raises: DownloadTooLarge, если файл больше max_bytes
+        """
+        request_timeout = httpx.Timeout(
+            timeout or self.settings['read_timeout'],
+            connect=self.settings['connect_timeout']
+        )
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.', suffix=PARTIAL_DOWNLOAD_SUFFIX)
+        # Разрешение предохранителя берем после создания файла: ошибка диска не должна
+        # оставить занятым пробный запрос
+        try:
+            self.breaker.before_call()
+        except BaseException:
+            os.close(fd)
+            os.remove(tmp_path)
+            raise
+        size = 0
+        digest = hashlib.sha256()
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                async with self._get_limiter(url):
+                    async with self._get_client().stream('GET', url, timeout=request_timeout) as response:
+                        response.raise_for_status()
+                        declared_size = response.headers.get('Content-Length', '')
+                        if max_bytes and declared_size.isdigit() and int(declared_size) > max_bytes:
+                            raise DownloadTooLarge(url, int(declared_size), max_bytes)
+                        async for chunk in response.aiter_bytes(self.settings['download_chunk_size']):
+                            size += len(chunk)
+                            if max_bytes and size > max_bytes:
+                                raise DownloadTooLarge(url, size, max_bytes)
+                            digest.update(chunk)
+                            f.write(chunk)
+                f.flush()
+                await run_blocking(os.fsync, f.fileno())
+        except BaseException as e:
+            self.breaker.record_error(e)
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+        # Время скачивания зависит от размера файла, поэтому его не проверяем
+        self.breaker.record_success()
+        return tmp_path, size, digest.hexdigest()
+
+    async def close(self):
+        """Закрывает пул соединений"""
+        if self._client is not None and not self._client.is_closed:
+            await self._client.aclose()
+        self._client = None
+
+# Суффикс временных файлов недокачанных курсовых работ
+PARTIAL_DOWNLOAD_SUFFIX = '.part'
+
+# Общий клиент для планировщика и обработчиков
+vuz2_client = Vuz2Client()
+
+def record_course_work_download(student_id, url, file_path, size, duration, status, error=None):
+    """Сохраняет в журнал course_work_downloads размер и длительность скачивания"""
+    try:
+        with get_db_connection() as conn:
+            conn.execute('''
+                INSERT INTO course_work_downloads (student_id, url, file_path, bytes, duration, status, error, downloaded_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (student_id, url, file_path, size, duration, status, error, datetime.datetime.now().isoformat()))
+            conn.commit()
+    except Exception as e:
+        logger.error(f"Ошибка при записи журнала скачивания {url}: {e}")
+
+def cleanup_partial_downloads():
+    """Удаляет временные файлы скачиваний, прерванных аварийным завершением"""
+    for filename in os.listdir(COURSE_WORKS_DIR):
+        if filename.startswith('.') and filename.endswith(PARTIAL_DOWNLOAD_SUFFIX):
+            try:
+                os.remove(os.path.join(COURSE_WORKS_DIR, filename))
+                logger.info(f"Удален недокачанный файл: {filename}")
+            except OSError as e:
+                logger.error(f"Не удалось удалить недокачанный файл {filename}: {e}")
+
+async def download_course_work_file(url, student_id, semester):
+    """
+    Download a course work file into the content-addressed store (см. course_work_store.py).
+    Ссылка, уже скачанная ранее, повторно не загружается; файл с уже известным
+    содержимым второй раз не сохраняется.
+    Returns the local file path or None if download fails.
+    """
+    known_path = await run_blocking(find_blob_by_url, url)
+    if known_path:
+        logger.info(f"Курсовая работа {url} уже есть в хранилище: {known_path}")
+        return known_path
+
+    started_at = time.monotonic()
+    file_path, size, status, error = None, None, 'ok', None
+    try:
+        tmp_path, size, sha256 = await vuz2_client.download(
+            url, COURSE_WORKS_DIR,
+            timeout=vuz2_client.settings['download_timeout'],
+            max_bytes=vuz2_client.settings['max_download_bytes']
+        )
+        file_path, deduplicated = await run_blocking(store_blob, tmp_path, sha256, size)
+        if deduplicated:
+            status = 'duplicate'
+        logger.info(f"Downloaded course work file: {file_path} ({size} байт за {time.monotonic() - started_at:.2f} с{', дубликат' if deduplicated else ''})")
+        return file_path
+    except DownloadTooLarge as e:
+        size, status, error = e.size, 'too_large', str(e)
+        logger.error(f"Курсовая работа не скачана: {e}")
+        return None
+    except Exception as e:
+        status, error = 'error', f"{type(e).__name__}: {e}"
+        logger.error(f"Error downloading course work file from {url}: {e}")
+        return None
+    finally:
+        await run_blocking(
+            record_course_work_download, student_id, url, file_path,
+            size, round(time.monotonic() - started_at, 3), status, error
+        )
+
+async def validate_student_group(student_id, group, use_cache=False):
+    """
+    Проверяет существование студента на сайте VUZ2.
+    use_cache - использовать страницу, уже загруженную в рамках регистрации.
+    Returns: (is_valid, error_message)
+    """
+    url = vuz2_client.rating_url(student_id)
+    try:
+        content = await vuz2_client.get(url, use_cache=use_cache)
+        not_found, _, _, _ = await run_blocking(extract_rating, content)
+        if not_found:
+            return False, "Студент не найден в системе VUZ2"
+
+        return True, None
+    except Exception as e:
+        logger.error(f"Ошибка при проверке студента: {e}")
+        return False, "Ошибка при проверке студента"
+
+def extract_rating(content):
+    """
+    Разбирает страницу рейтинга быстрым путем, при неудаче - полным разбором.
+    Returns: (not_found, full_name, subjects, grades)
+    """
+    if VUZ2_SETTINGS['fast_extraction']:
+        try:
+            return extract_rating_fast(content)
+        except FastPathError as e:
+            logger.warning(f"Быстрый разбор рейтинга не подошел, полный разбор: {e}")
+        except Exception as e:
+            logger.error(f"Ошибка быстрого разбора рейтинга, полный разбор: {e}")
+    return extract_rating_full(content)
+
+def extract_portfolio(content):
+    """
+    Разбирает страницу портфолио быстрым путем, при неудаче - полным разбором.
+    Returns: список {'semester', 'discipline', 'href'}
+    """
+    if VUZ2_SETTINGS['fast_extraction']:
+        try:
+            return extract_portfolio_fast(content)
+        except FastPathError as e:
+            logger.warning(f"Быстрый разбор портфолио не подошел, полный разбор: {e}")
+        except Exception as e:
+            logger.error(f"Ошибка быстрого разбора портфолио, полный разбор: {e}")
+    return extract_portfolio_full(content)
+
+def _normalize_fragment(fragment):
+    return re.sub(r'\s+', ' ', fragment).strip()
+
+async def fetch_rating_page(student_id, use_cache=False):
+    """Загружает страницу рейтинга студента. Ошибка загрузки пробрасывается"""
+    return await vuz2_client.get(vuz2_client.rating_url(student_id), use_cache=use_cache)
+
+async def fetch_portfolio_page(student_id, use_cache=False):
+    """Загружает страницу портфолио студента. Ошибка загрузки пробрасывается"""
+    return await vuz2_client.get(vuz2_client.portfolio_url(student_id), use_cache=use_cache)
+
+def _fragments_digest(fragments, extra):
+    digest = hashlib.sha256()
+    for part in (*fragments, *extra):
+        digest.update(_normalize_fragment(str(part)).encode('utf-8'))
+        digest.update(b'\x00')
+    return digest.hexdigest()
+
+def compute_rating_digest(rating_content, *extra):
+    """
+    Считает sha256 от значимых фрагментов страницы рейтинга: заголовка h1 с именем студента
+    и таблицы table#user. Без полного разбора HTML - только поиск фрагментов.
+    extra - дополнительные значения (группа, telegram_id), от которых зависит сохранение.
+    Returns: hex-строку или None, если таблица не найдена и сравнивать нечего.
+    """
+    if rating_content is None:
+        return None
+    fragments = rating_fragments(rating_content)
+    if fragments is None:
+        return None
+    return _fragments_digest(fragments, extra)
+
+def compute_portfolio_digest(portfolio_content, *extra):
+    """
+    Считает sha256 от списка курсовых работ на странице портфолио.
+    Returns: hex-строку или None, если страницы нет.
+    """
+    if portfolio_content is None:
+        return None
+    return _fragments_digest((portfolio_fragment(portfolio_content),), extra)
+
+def load_course_works(student_id):
+    """Returns: {(discipline, semester): file_path} курсовых работ студента, сохраненных в базе"""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT discipline, semester, file_path FROM course_works WHERE student_id = ?', (student_id,))
+        return {(discipline, semester): file_path for discipline, semester, file_path in cursor.fetchall()}
+
+def update_course_works_owner(student_id, telegram_id):
+    """Обновляет telegram_id всех сохраненных курсовых работ студента одним запросом"""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            UPDATE course_works SET telegram_id = ?
+            WHERE student_id = ? AND telegram_id IS NOT ?
+        ''', (telegram_id, student_id, telegram_id))
+        conn.commit()
+        if cursor.rowcount:
+            logger.info(f"Обновлен telegram_id для курсовых работ студента {student_id}: {cursor.rowcount}")
+
+def student_last_name(full_name):
+    """Фамилия из полного имени со страницы рейтинга (сохраняется в students.name)"""
+    return full_name.split()[0] if full_name != "Unknown" and len(full_name.split()) > 0 else "Unknown"
+
+async def parse_rating(student_id, content=None, use_cache=False):
+    """
+    Разбирает страницу рейтинга студента.
+    content - уже загруженная страница, чтобы не скачивать ее повторно.
+    Returns: (full_name, grades, subjects) или None, если студент не найден.
+    Ошибка загрузки страницы пробрасывается.
+    """
+    if content is None:
+        content = await fetch_rating_page(student_id, use_cache=use_cache)
+    not_found, full_name, subjects, grades = await run_blocking(extract_rating, content)
+    if not_found:
+        logger.error(f"Студент с номером {student_id} не найден в системе VUZ2")
+        return None
+    return full_name, grades, subjects
+
+async def sync_course_works(student_id, name, telegram_id=None, student_group=None, content=None, use_cache=False,
+                            records=None):
+    """
+    Сверяет список курсовых работ из портфолио с базой и скачивает новые.
+    Сохраненные работы студента читаются из базы одним запросом.
+    content - уже загруженная страница портфолио, name - имя для новых записей course_works.
+    records - список, в который складываются записи о новых работах вместо записи в базу
+    (их записывает вызывающий через save_course_works, как и telegram_id сохраненных работ).
+    Returns: список {'discipline', 'semester', 'file_path'}. Ошибка загрузки страницы пробрасывается.
+    """
+    if content is None:
+        content = await fetch_portfolio_page(student_id, use_cache=use_cache)
+    entries = await run_blocking(extract_portfolio, content)
+    if not entries:
+        return []
+    existing = await run_blocking(load_course_works, student_id)
+    if telegram_id and existing and records is None:
+        await run_blocking(update_course_works_owner, student_id, telegram_id)
+
+    course_works = []
+    for entry in entries:
+        semester = entry['semester']
+        discipline = entry['discipline']
+
+        if (discipline, semester) in existing:
+            logger.info(f"Пропускаем существующую курсовую работу: {discipline}, семестр {semester}")
+            course_works.append({
+                'discipline': discipline,
+                'semester': semester,
+                'file_path': existing[(discipline, semester)]
+            })
+            continue
+
+        # Если работа не существует, скачиваем её
+        if entry['href']:
+            file_url = vuz2_client.absolute_url(entry['href'])
+            file_path = await download_course_work_file(file_url, student_id, semester)
+            if file_path and records is not None:
+                records.append({
+                    'student_id': student_id, 'name': name, 'telegram_id': telegram_id,
+                    'student_group': student_group, 'discipline': discipline, 'semester': semester,
+                    'file_path': file_path, 'original_name': original_name_from_url(file_url), 'source_url': file_url
+                })
+                course_works.append({
+                    'discipline': discipline,
+                    'semester': semester,
+                    'file_path': file_path
+                })
+            elif file_path:
+                # Сохраняем информацию о курсовой работе в базу данных
+                await run_blocking(
+                    save_course_work_to_db,
+                    student_id=student_id,
+                    name=name,
+                    telegram_id=telegram_id,
+                    student_group=student_group,
+                    discipline=discipline,
+                    file_path=file_path,
+                    semester=semester
+                )
+                await run_blocking(
+                    link_course_work, student_id, discipline, semester,
+                    file_path, original_name_from_url(file_url), file_url
+                )
+                course_works.append({
+                    'discipline': discipline,
+                    'semester': semester,
+                    'file_path': file_path
+                })
+    return course_works
+
+def save_course_works(cursor, records):
+    """
+    Записывает в открытой транзакции курсовые работы, собранные sync_course_works(records=...):
+    строки course_works (кроме уже сохраненных) и course_work_files - по одному executemany
+    """
+    parsing_time = datetime.datetime.now().isoformat()
+    cursor.executemany('''
+        INSERT INTO course_works (discipline, discipline_key, student_id, telegram_id, name, student_group, semester, file_path, parsing_time)
+        SELECT ?, ?, ?, ?, ?, ?, ?, ?, ?
+        WHERE NOT EXISTS (SELECT 1 FROM course_works WHERE student_id = ? AND discipline = ? AND semester = ?)
+    ''', [
+        (r['discipline'], discipline_key(r['discipline']), r['student_id'], r['telegram_id'], r['name'],
+         r['student_group'], r['semester'], os.path.normpath(r['file_path']), parsing_time,
+         r['student_id'], r['discipline'], r['semester'])
+        for r in records
+    ])
+    cursor.executemany('''
+        INSERT OR REPLACE INTO course_work_files
+        (student_id, discipline, semester, sha256, original_name, source_url, linked_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', [
+        (r['student_id'], r['discipline'], r['semester'], os.path.basename(r['file_path']),
+         r['original_name'], r['source_url'], parsing_time)
+        for r in records
+    ])
+
+async def parse_student_data(student_id, telegram_id=None, student_group=None, use_cache=False):
+    """
+    Parse student data and course works from VUZ2 website (регистрация, добавление студентов администратором).
+    Планировщик обрабатывает рейтинг и портфолио отдельными задачами: parse_rating и sync_course_works.
+    use_cache - брать страницы из короткоживущего кеша клиента (регистрация).
+    Returns: (name, grades, subjects, course_works)
+    """
+    # Валидация student_id
+    is_valid, error_message = validate_student_id(student_id)
+    if not is_valid:
+        logger.error(f"Невалидный student_id: {student_id} - {error_message}")
+        return "Unknown", {}, [], []
+
+    # Parse student performance data
+    try:
+        rating = await parse_rating(student_id, use_cache=use_cache)
+    except Exception as e:
+        logger.error(f"Ошибка при парсинге данных студента для ID {student_id}: {e}")
+        return "Unknown", {}, [], []
+    if rating is None:
+        return "Unknown", {}, [], []
+    full_name, grades, subjects = rating
+    last_name = student_last_name(full_name)
+
+    # Parse course work data
+    try:
+        course_works = await sync_course_works(student_id, full_name, telegram_id, student_group, use_cache=use_cache)
+    except Exception as e:
+        logger.error(f"Ошибка при парсинге курсовых работ для ID {student_id}: {e}")
+        course_works = []
+
+    return last_name, grades, subjects, course_works
@@ -0,0 +1,69 @@
+import time
+import datetime
+from utils import logger, config, get_db_connection
+
+# Настройки учета активности пользователей (переопределяются секцией "activity" в config.json)
+ACTIVITY_SETTINGS = {
+    'touch_interval_seconds': 600,  # last_seen_at пользователя обновляется не чаще этого
+    'active_days': 30,              # Пользователь заходил в бот за это время - его оценки проверяются в обычном режиме
+    **config.get('activity', {})
+}
+
+# Когда last_seen_at пользователя последний раз записывался в базу (telegram_id -> time.monotonic())
+_last_touch = {}
+
+def touch_user(telegram_id):
+    """
+    Отмечает, что пользователь пользуется ботом (вызывается из обработчиков сообщений и кнопок).
+    В базу пишется не чаще touch_interval_seconds. Снимает отметку о блокировке бота
+    и возвращает в парсинг выведенного из него студента этого пользователя.
+    """
+    telegram_id = str(telegram_id)
+    now = time.monotonic()
+    last_touch = _last_touch.get(telegram_id)
+    if last_touch is not None and now - last_touch < ACTIVITY_SETTINGS['touch_interval_seconds']:
+        return
+    _last_touch[telegram_id] = now
+    seen_at = datetime.datetime.now().isoformat()
+    try:
+        with get_db_connection() as conn:
+            conn.execute('''
+                INSERT INTO user_activity (telegram_id, last_seen_at, blocked_at) VALUES (?, ?, NULL)
+                ON CONFLICT(telegram_id) DO UPDATE SET last_seen_at=excluded.last_seen_at, blocked_at=NULL
+            ''', (telegram_id, seen_at))
+            cursor = conn.execute('''
+                UPDATE scrape_state SET retired_at=NULL, failures=0, next_parse_at=?
+                WHERE retired_at IS NOT NULL
+                  AND student_id IN (SELECT student_id FROM students WHERE telegram_id=?)
+            ''', (seen_at, telegram_id))
+            conn.commit()
+        if cursor.rowcount:
+            logger.info(f"Студент пользователя {telegram_id} возвращен в парсинг")
+    except Exception as e:
+        logger.error(f"Ошибка при обновлении активности пользователя {telegram_id}: {e}")
+
+def mark_user_blocked(telegram_id):
+    """Пользователь заблокировал бота (Forbidden при отправке сообщения)"""
+    telegram_id = str(telegram_id)
+    _last_touch.pop(telegram_id, None)
+    try:
+        with get_db_connection() as conn:
+            conn.execute('''
+                INSERT INTO user_activity (telegram_id, last_seen_at, blocked_at) VALUES (?, NULL, ?)
+                ON CONFLICT(telegram_id) DO UPDATE SET blocked_at=excluded.blocked_at
+            ''', (telegram_id, datetime.datetime.now().isoformat()))
+            conn.commit()
+        logger.info(f"Пользователь {telegram_id} заблокировал бота")
+    except Exception as e:
+        logger.error(f"Ошибка при отметке блокировки бота пользователем {telegram_id}: {e}")
+
+def is_user_active(telegram_id, last_seen_at, blocked_at, now, settings=ACTIVITY_SETTINGS):
+    """
+    Пользователь с настоящим Telegram ID, не заблокировавший бота и заходивший
+    в него за последние active_days.
+    """
+    if not telegram_id or not str(telegram_id).isdigit() or blocked_at:
+        return False
+    if not last_seen_at:
+        return False
+    return now - datetime.datetime.fromisoformat(last_seen_at) <= datetime.timedelta(days=settings['active_days'])
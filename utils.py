@@ -1,7 +1,5 @@
 import sqlite3
-import requests
 import os
-from bs4 import BeautifulSoup
 import datetime
 import json
 import logging
@@ -10,9 +8,11 @@ import re
 from functools import wraps
 import asyncio
 import functools
-from telegram.error import TimedOut, NetworkError
+from telegram.error import TimedOut, NetworkError, Forbidden
 import random
+import threading
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 
 # Logging configuration
 console_handler = logging.StreamHandler()
@@ -168,18 +168,200 @@ REPLY_KEYBOARD_MARKUP = ReplyKeyboardMarkup(REPLY_KEYBOARD, resize_keyboard=True
 CANCEL_KEYBOARD = [[InlineKeyboardButton("Отмена", callback_data='cancel_registration')]]
 CANCEL_KEYBOARD_MARKUP = InlineKeyboardMarkup(CANCEL_KEYBOARD)
 
+def rating_refresh_markup(student_id, in_progress=False):
+    """Кнопка обновления оценок под таблицей рейтинга студента"""
+    text = "⏳ Обновляю..." if in_progress else "🔄 Обновить"
+    return InlineKeyboardMarkup([[InlineKeyboardButton(text, callback_data=f'refresh_{student_id}')]])
+
+def group_students_markup(students, is_admin=False, refresh_in_progress=False):
+    """Список студентов группы; администратору - кнопки обновления группы и добавления студента"""
+    keyboard = [[InlineKeyboardButton(name, callback_data=f"student_{student_id}")] for student_id, name in students]
+    if is_admin:
+        keyboard.append([InlineKeyboardButton(
+            "⏳ Обновляю группу..." if refresh_in_progress else "🔄 Обновить группу",
+            callback_data='refreshgroup'
+        )])
+        keyboard.append([InlineKeyboardButton("Добавить студента", callback_data='add_student')])
+    return InlineKeyboardMarkup(keyboard)
+
+# Пул потоков для блокирующих операций (SQLite, разбор HTML), чтобы не останавливать event loop
+BLOCKING_EXECUTOR = ThreadPoolExecutor(
+    max_workers=config.get('blocking_workers', 4),
+    thread_name_prefix='blocking'
+)
+
+async def run_blocking(func, *args, **kwargs):
+    """Выполняет синхронную функцию в BLOCKING_EXECUTOR и возвращает ее результат"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(BLOCKING_EXECUTOR, functools.partial(func, *args, **kwargs))
+
 # Directory for course work files
 COURSE_WORKS_DIR = 'course_works'
 if not os.path.exists(COURSE_WORKS_DIR):
     os.makedirs(COURSE_WORKS_DIR)
 
 # Database functions
+
+# Настройки SQLite (переопределяются секцией "database" в config.json)
+DB_SETTINGS = {
+    'path': 'students.db',
+    'journal_mode': 'WAL',          # Читатели не ждут пишущего: парсинг не блокирует обработчики
+    'synchronous': 'NORMAL',        # В режиме WAL при сбое питания теряется не больше последних транзакций, база цела
+    'busy_timeout_ms': 10000,       # Сколько ждать блокировку другого соединения до "database is locked"
+    'mmap_size': 256 * 1024 * 1024, # Чтение файла базы через отображение в память
+    'cache_size_kb': 16384,         # Кэш страниц на соединение
+    'temp_store': 'MEMORY',         # Временные таблицы и сортировки - в памяти
+    'pool_size': 4,                 # Свободных соединений на поток (0 - новое соединение на каждый вызов)
+    'executor_workers': 4,          # Потоков DB_EXECUTOR для запросов обработчиков (run_db)
+    **config.get('database', {})
+}
+
+# Свободные соединения хранятся отдельно для каждого потока: sqlite3.Connection
+# нельзя использовать из другого потока
+_db_local = threading.local()
+
+def _open_db_connection():
+    conn = sqlite3.connect(DB_SETTINGS['path'], timeout=DB_SETTINGS['busy_timeout_ms'] / 1000)
+    conn.execute(f"PRAGMA busy_timeout={int(DB_SETTINGS['busy_timeout_ms'])}")
+    conn.execute(f"PRAGMA journal_mode={DB_SETTINGS['journal_mode']}")
+    conn.execute(f"PRAGMA synchronous={DB_SETTINGS['synchronous']}")
+    conn.execute(f"PRAGMA mmap_size={int(DB_SETTINGS['mmap_size'])}")
+    conn.execute(f"PRAGMA cache_size={-int(DB_SETTINGS['cache_size_kb'])}")
+    conn.execute(f"PRAGMA temp_store={DB_SETTINGS['temp_store']}")
+    return conn
+
+class PooledConnection:
+    """
+    Соединение из пула текущего потока, ведет себя как sqlite3.Connection.
+    with фиксирует транзакцию (или откатывает при исключении) и возвращает соединение
+    в пул, close() тоже возвращает его в пул. Незафиксированные изменения при возврате
+    откатываются, как при закрытии обычного соединения.
+    """
+
+    def __init__(self, conn, idle):
+        self._conn = conn
+        self._idle = idle
+        self._thread = threading.get_ident()
+
+    def __getattr__(self, name):
+        conn = self.__dict__.get('_conn')
+        if conn is None:
+            raise sqlite3.ProgrammingError("Cannot operate on a closed database.")
+        return getattr(conn, name)
+
+    def __setattr__(self, name, value):
+        if name.startswith('_'):
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self._conn, name, value)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback_):
+        try:
+            if self._conn is not None:
+                if exc_type is None:
+                    self._conn.commit()
+                else:
+                    self._conn.rollback()
+        finally:
+            self.close()
+        return False
+
+    def close(self):
+        conn, self._conn = self._conn, None
+        if conn is None or self._thread != threading.get_ident():
+            # Соединение другого потока в его пул не вернуть - оно закроется сборщиком мусора
+            return
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            conn.row_factory = None
+            if len(self._idle) < DB_SETTINGS['pool_size']:
+                self._idle.append(conn)
+                return
+        except sqlite3.Error as e:
+            logger.warning(f"Соединение с базой не возвращено в пул: {e}")
+        conn.close()
+
 def get_db_connection():
     """
-    Получение соединения с базой данных SQLite.
-    Необходимо закрывать соединение после использования (используйте with).
+    Соединение с базой данных SQLite из пула текущего потока (WAL, настройки DB_SETTINGS).
+    Используйте with (или вызовите close()), чтобы вернуть соединение в пул.
+    """
+    idle = getattr(_db_local, 'idle', None)
+    if idle is None:
+        idle = _db_local.idle = []
+    conn = idle.pop() if idle else _open_db_connection()
+    return PooledConnection(conn, idle)
+
+# Отдельный пул потоков для запросов обработчиков к базе: они не ждут в очереди за разбором
+# HTML и записью файлов в BLOCKING_EXECUTOR, а соединения остаются в пулах этих потоков
+DB_EXECUTOR = ThreadPoolExecutor(
+    max_workers=DB_SETTINGS['executor_workers'],
+    thread_name_prefix='db'
+)
+
+async def run_db(func, *args, **kwargs):
+    """Выполняет синхронную функцию работы с базой в DB_EXECUTOR и возвращает ее результат"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(DB_EXECUTOR, functools.partial(func, *args, **kwargs))
+
+class LoopLagMonitor:
+    """
+    Задержка event loop: насколько позже заданного просыпается asyncio.sleep(interval).
+    Если корутины выполняют блокирующую работу (запросы к базе, разбор HTML) в самом
+    event loop, на это время останавливаются все обработчики, и задержка растет.
     """
-    return sqlite3.connect('students.db')
+
+    def __init__(self, interval=0.1):
+        self.interval = interval
+        self.samples = []
+
+    async def run(self, is_running):
+        """Замеряет задержку, пока is_running() возвращает True"""
+        loop = asyncio.get_running_loop()
+        while is_running():
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, loop.time() - started - self.interval))
+
+    def take(self):
+        """Returns: {'p50', 'p99', 'max'} задержки в секундах с прошлого вызова (замеры сбрасываются)"""
+        samples, self.samples = sorted(self.samples), []
+        if not samples:
+            return {'p50': 0.0, 'p99': 0.0, 'max': 0.0}
+        return {
+            'p50': samples[len(samples) // 2],
+            'p99': samples[min(len(samples) - 1, int(len(samples) * 0.99))],
+            'max': samples[-1]
+        }
+
+# Колонки таблиц для запросов, зависящих от схемы. Схема меняется только в init_db и при
+# удалении старых колонок оценок (grade_store), поэтому PRAGMA table_info выполняется
+# один раз на процесс, а изменяющий схему код сбрасывает кэш
+_table_columns = {}
+
+def get_table_columns(table, cursor=None):
+    """Returns: кортеж имен колонок таблицы в порядке SELECT * (пустой, если таблицы нет)"""
+    columns = _table_columns.get(table)
+    if columns is None:
+        if cursor is None:
+            with get_db_connection() as conn:
+                return get_table_columns(table, conn.cursor())
+        cursor.execute(f'PRAGMA table_info("{table}")')
+        columns = tuple(col[1] for col in cursor.fetchall())
+        if columns:
+            _table_columns[table] = columns
+    return columns
+
+def invalidate_table_columns(table=None):
+    """Сбрасывает кэш колонок таблицы (table=None - всех таблиц) после изменения схемы"""
+    if table is None:
+        _table_columns.clear()
+    else:
+        _table_columns.pop(table, None)
 
 def require_registration(async_func):
     @wraps(async_func)
@@ -196,63 +378,9 @@ def require_registration(async_func):
     return wrapper
 
 def get_all_subjects_from_db():
-    with get_db_connection() as conn:
-        cursor = conn.cursor()
-        cursor.execute("PRAGMA table_info(students)")
-        columns = cursor.fetchall()
-    subjects = []
-    for col in columns:
-        col_name = col[1]
-        if col_name not in ['student_id', 'name', 'update_date', 'telegram_id', 'student_group', 'is_admin', 'backup_telegram_ids', 'last_parsed_time']:
-            subject = col_name.split(' (модуль')[0]
-            if subject not in subjects:
-                subjects.append(subject)
-    return subjects
-
-def update_db_structure(new_subjects):
-    with get_db_connection() as conn:
-        cursor = conn.cursor()
-        cursor.execute("PRAGMA table_info(students)")
-        current_columns = [col[1] for col in cursor.fetchall()]
-        for subject in new_subjects:
-            for module in [' (модуль 1)', ' (модуль 2)']:
-                col_name = f'{subject}{module}'
-                if col_name not in current_columns:
-                    safe_col_name = '"' + col_name.replace('"', '""') + '"'
-                    cursor.execute(f'ALTER TABLE students ADD COLUMN {safe_col_name} TEXT DEFAULT "не изучает"')
-        conn.commit()
-
-def get_subjects(soup):
-    table = soup.find('table', id='user')
-    if not table:
-        return []
-    rows = table.find_all('tr')
-    if not rows or len(rows) < 1:
-        return []
-    headers = [header.text.strip() for header in rows[0].find_all('th')]
-    return headers[1:-1] if len(headers) > 2 else []
-
-def download_course_work_file(url, student_id, semester):
-    """
-    Download a course work file and save it to the course_works directory.
-    Returns the local file path or None if download fails.
-    """
-    try:
-        response = requests.get(url, timeout=10)
-        response.raise_for_status()
-        original_filename = os.path.basename(url)
-        # Create a unique filename to avoid conflicts
-        base, ext = os.path.splitext(original_filename)
-        unique_filename = f"{base}{ext}"
-        file_path = os.path.join(COURSE_WORKS_DIR, unique_filename)
-        file_path = os.path.normpath(file_path)
-        with open(file_path, 'wb') as f:
-            f.write(response.content)
-        logger.info(f"Downloaded course work file: {file_path}")
-        return file_path
-    except Exception as e:
-        logger.error(f"Error downloading course work file from {url}: {e}")
-        return None
+    """Returns: все дисциплины из справочника subjects по алфавиту"""
+    from grade_store import all_subjects
+    return all_subjects()
 
 def save_course_work_to_db(student_id, name, telegram_id, student_group, discipline, file_path, semester):
     """
@@ -273,9 +401,9 @@ def save_course_work_to_db(student_id, name, telegram_id, student_group, discipl
             
         parsing_time = datetime.datetime.now().isoformat()
         cursor.execute('''
-            INSERT INTO course_works (discipline, student_id, telegram_id, name, student_group, semester, file_path, parsing_time)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (discipline, student_id, telegram_id, name, student_group, semester, file_path, parsing_time))
+            INSERT INTO course_works (discipline, discipline_key, student_id, telegram_id, name, student_group, semester, file_path, parsing_time)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (discipline, discipline_key(discipline), student_id, telegram_id, name, student_group, semester, file_path, parsing_time))
         conn.commit()
         logger.info(f"Saved course work for student_id {student_id}, discipline {discipline}")
 
@@ -305,168 +433,6 @@ def validate_group_format(group):
         return False, "Неверный формат группы. Примеры правильного формата: ПМР-231, БИОР-221"
     return True, None
 
-def validate_student_group(student_id, group):
-    """
-    Проверяет существование студента на сайте VUZ2.
-    Returns: (is_valid, error_message)
-    """
-    url = f"http://vuz2.bru.by/rate/{student_id}/"
-    try:
-        response = requests.get(url, timeout=10)
-        response.raise_for_status()
-        soup = BeautifulSoup(response.content, 'html.parser', from_encoding='utf-8')
-        
-        # Проверяем наличие сообщения об ошибке
-        error_message = soup.find('h2')
-        if error_message and "не найден" in error_message.text:
-            return False, "Студент не найден в системе VUZ2"
-            
-        return True, None
-    except Exception as e:
-        logger.error(f"Ошибка при проверке студента: {e}")
-        return False, "Ошибка при проверке студента"
-
-def parse_student_data(student_id, telegram_id=None, student_group=None, skip_existing_course_works=None):
-    """
-    Parse student data and course works from VUZ2 website.
-    Returns: (name, grades, subjects, course_works)
-    """
-    # Валидация student_id
-    is_valid, error_message = validate_student_id(student_id)
-    if not is_valid:
-        logger.error(f"Невалидный student_id: {student_id} - {error_message}")
-        return "Unknown", {}, [], []
-
-    # Parse student performance data
-    url = f"http://vuz2.bru.by/rate/{student_id}/"
-    try:
-        response = requests.get(url, timeout=10)
-        response.raise_for_status()
-        soup = BeautifulSoup(response.content, 'html.parser', from_encoding='utf-8')
-        
-        # Проверяем наличие сообщения об ошибке
-        error_message = soup.find('h2')
-        if error_message and "не найден" in error_message.text:
-            logger.error(f"Студент с номером {student_id} не найден в системе VUZ2")
-            return "Unknown", {}, [], []
-            
-        data_box = soup.find('div', class_='box data')
-        if data_box:
-            name_tag = data_box.find('h1')
-            full_name = name_tag.text.strip() if name_tag else "Unknown"
-        else:
-            full_name = "Unknown"
-        last_name = full_name.split()[0] if full_name != "Unknown" and len(full_name.split()) > 0 else "Unknown"
-        subjects = get_subjects(soup)
-        if not subjects:
-            grades = {}
-        else:
-            table = soup.find('table', id='user')
-            rows = table.find_all('tr')
-            grades = {}
-            module_map = {'1-ый модуль': '1', '2-ой модуль': '2'}
-            for module_label, module_num in module_map.items():
-                module_row = next((row for row in rows if row.find('td') and row.find('td').text.strip() == module_label), None)
-                if module_row:
-                    module_cells = module_row.find_all('td')
-                    if len(module_cells) > 1:
-                        for i, subject in enumerate(subjects):
-                            grade = module_cells[i + 1].text.strip() if i + 1 < len(module_cells) else '-'
-                            grades[f"{subject} (модуль {module_num})"] = int(grade) if grade.isdigit() else None
-    except Exception as e:
-        logger.error(f"Ошибка при парсинге данных студента для ID {student_id}: {e}")
-        return "Unknown", {}, [], []
-
-    # Parse course work data
-    course_works = []
-    portfolio_url = f"http://vuz2.bru.by/rate/{student_id}/portfolio/1/"
-    try:
-        response = requests.get(portfolio_url, timeout=10)
-        response.raise_for_status()
-        soup = BeautifulSoup(response.content, 'html.parser', from_encoding='utf-8')
-        portfolio_section = soup.find('div', class_='box data')
-        if portfolio_section:
-            ul = portfolio_section.find('ul')
-            if ul:
-                for li in ul.find_all('li'):
-                    # Получаем текст до первого <a> (только описание, без имени файла)
-                    li_text = ''
-                    for content in li.contents:
-                        if getattr(content, 'name', None) == 'a':
-                            break
-                        if isinstance(content, str):
-                            li_text += content
-                    semester_match = re.search(r'Семестр: (\d+)', li_text)
-                    discipline_match = re.search(r'Дисциплина: (.*)', li_text)
-                    if semester_match and discipline_match:
-                        semester = semester_match.group(1)
-                        discipline = discipline_match.group(1).strip()
-                        
-                        # Проверяем существование курсовой работы
-                        if skip_existing_course_works and (discipline, semester) in skip_existing_course_works:
-                            logger.info(f"Пропускаем существующую курсовую работу: {discipline}, семестр {semester}")
-                            # Добавляем существующую работу в список без скачивания
-                            course_works.append({
-                                'discipline': discipline,
-                                'semester': semester,
-                                'file_path': skip_existing_course_works[(discipline, semester)]
-                            })
-                            continue
-                            
-                        # Проверяем существование в базе данных
-                        with get_db_connection() as conn:
-                            cursor = conn.cursor()
-                            cursor.execute('''
-                                SELECT file_path FROM course_works 
-                                WHERE student_id = ? AND discipline = ? AND semester = ?
-                            ''', (student_id, discipline, semester))
-                            existing = cursor.fetchone()
-                            if existing:
-                                logger.info(f"Пропускаем скачивание существующей курсовой работы: {discipline}, семестр {semester}")
-                                # Обновляем telegram_id для существующей записи
-                                if telegram_id:
-                                    cursor.execute('''
-                                        UPDATE course_works 
-                                        SET telegram_id = ? 
-                                        WHERE student_id = ? AND discipline = ? AND semester = ?
-                                    ''', (telegram_id, student_id, discipline, semester))
-                                    conn.commit()
-                                    logger.info(f"Обновлен telegram_id для курсовой работы: {discipline}, семестр {semester}")
-                                course_works.append({
-                                    'discipline': discipline,
-                                    'semester': semester,
-                                    'file_path': existing[0]
-                                })
-                                continue
-                            
-                        # Если работа не существует, скачиваем её
-                        file_link = li.find('a')
-                        if file_link and 'href' in file_link.attrs:
-                            file_url = file_link['href']
-                            if not file_url.startswith('http'):
-                                file_url = f"http://vuz2.bru.by{file_url}"
-                            file_path = download_course_work_file(file_url, student_id, semester)
-                            if file_path:
-                                # Сохраняем информацию о курсовой работе в базу данных
-                                save_course_work_to_db(
-                                    student_id=student_id,
-                                    name=full_name,
-                                    telegram_id=telegram_id,
-                                    student_group=student_group,
-                                    discipline=discipline,
-                                    file_path=file_path,
-                                    semester=semester
-                                )
-                                course_works.append({
-                                    'discipline': discipline,
-                                    'semester': semester,
-                                    'file_path': file_path
-                                })
-    except Exception as e:
-        logger.error(f"Ошибка при парсинге курсовых работ для ID {student_id}: {e}")
-
-    return last_name, grades, subjects, course_works
-
 def save_to_db(student_id, name, grades, subjects, telegram_id=None, student_group=None, is_admin=False):
     with get_db_connection() as conn:
         cursor = conn.cursor()
@@ -484,21 +450,6 @@ def save_to_db(student_id, name, grades, subjects, telegram_id=None, student_gro
             data['student_group'] = student_group
         if is_admin:
             data['is_admin'] = 1
-        db_subjects = get_all_subjects_from_db()
-        new_subjects = [s for s in subjects if s not in db_subjects]
-        if new_subjects:
-            update_db_structure(new_subjects)
-        cursor.execute("PRAGMA table_info(students)")
-        for col in cursor.fetchall():
-            col_name = col[1]
-            if col_name in data:
-                continue
-            if "(модуль" in col_name:
-                subject = col_name.split(' (модуль')[0]
-                if subject in subjects:
-                    data[col_name] = grades.get(col_name, None)
-                else:
-                    data[col_name] = "не изучает"
         columns = ['"{}"'.format(k.replace('"', '""')) for k in data.keys()]
         query = f"""
         INSERT INTO students ({','.join(columns)}) 
@@ -506,24 +457,31 @@ def save_to_db(student_id, name, grades, subjects, telegram_id=None, student_gro
         ON CONFLICT(student_id) DO UPDATE SET {','.join(['"{}"=?'.format(k.replace('"', '""')) for k in data.keys()])}
         """
         cursor.execute(query, list(data.values())*2)
+        # Оценки - в таблице grades, в той же транзакции
+        from grade_store import save_grades
+        save_grades(cursor, student_id, subjects, grades)
         conn.commit()
 
 async def save_to_db_async(*args, **kwargs):
-    loop = asyncio.get_event_loop()
-    await loop.run_in_executor(None, save_to_db, *args, **kwargs)
+    return await run_blocking(save_to_db, *args, **kwargs)
+
+def _registration_row(telegram_id):
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT student_id, student_group, is_admin FROM students WHERE telegram_id=?', (telegram_id,))
+        return cursor.fetchone()
 
 async def check_registration(telegram_id):
-    conn = get_db_connection()
-    cursor = conn.cursor()
     try:
-        cursor.execute('SELECT student_id, student_group, is_admin FROM students WHERE telegram_id=?', (telegram_id,))
-        result = cursor.fetchone()
+        result = await run_db(_registration_row, telegram_id)
         return bool(result), result
     except Exception as e:
         logger.error(f"Ошибка при проверке регистрации: {e}")
         return False, None
-    finally:
-        conn.close()
+
+def discipline_key(name):
+    """Ключ дисциплины для поиска без учета регистра и лишних пробелов (course_works.discipline_key)"""
+    return ' '.join((name or '').split()).lower()
 
 def format_discipline_name(name, max_length=25):
     name = name.split(' (модуль')[0].strip()
@@ -531,27 +489,26 @@ def format_discipline_name(name, max_length=25):
         return name[:max_length-3] + '...'
     return name.ljust(max_length)
 
+def _format_grade(value):
+    return str(value) if value not in (None, "None", "-") else " -"
+
 def format_ratings_table(name, data, is_group=False):
+    """
+    data - {дисциплина: {модуль: оценка}} для студента или
+    [(имя студента, {модуль: оценка})] для дисциплины группы (is_group=True)
+    """
     if not is_group:
-        disciplines = {}
-        for key, value in data.items():
-            if "(модуль" in str(key) and value not in ["не изучает", None, "None"]:
-                parts = str(key).split(' (модуль ')
-                if len(parts) == 2:
-                    disc_name = parts[0]
-                    module = parts[1].replace(')', '')
-                    if disc_name not in disciplines:
-                        disciplines[disc_name] = {'1': '-', '2': '-'}
-                    disciplines[disc_name][module] = value
         table = f"<pre>Рейтинг {name}:\n"
         table += "="*45 + "\n"
         table += "Дисциплина".ljust(25) + " | М1 | М2\n"
         table += "-"*45 + "\n"
-        for disc_name in sorted(disciplines.keys()):
-            grades = disciplines[disc_name]
+        for disc_name in sorted(data.keys()):
+            grades = data[disc_name]
+            # Дисциплины без единой оценки не показываем
+            if all(grades.get(module) in (None, "None") for module in (1, 2)):
+                continue
             formatted_name = format_discipline_name(disc_name)
-            m1 = str(grades['1']) if '1' in grades and grades['1'] != '-' else ' -'
-            m2 = str(grades['2']) if '2' in grades and grades['2'] != '-' else ' -'
+            m1, m2 = _format_grade(grades.get(1)), _format_grade(grades.get(2))
             table += f"{formatted_name} | {m1.rjust(2)} | {m2.rjust(2)}\n"
         table += "</pre>"
         return table
@@ -561,26 +518,18 @@ def format_ratings_table(name, data, is_group=False):
         table += "Студент".ljust(25) + " | М1 | М2\n"
         table += "-"*45 + "\n"
         for student_name, grades in data:
-            m1 = str(grades[f"{name} (модуль 1)"]) if grades[f"{name} (модуль 1)"] != "-" else " -"
-            m2 = str(grades[f"{name} (модуль 2)"]) if grades[f"{name} (модуль 2)"] != "-" else " -"
+            m1, m2 = _format_grade(grades.get(1)), _format_grade(grades.get(2))
             formatted_name = student_name[:22] + "..." if len(student_name) > 25 else student_name.ljust(25)
             table += f"{formatted_name} | {m1.rjust(2)} | {m2.rjust(2)}\n"
         table += "</pre>"
         return table
 
 async def show_student_rating(update, student_id):
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    # repository импортирует utils, поэтому импорт здесь
+    from repository import get_student_rating
     try:
-        cursor.execute("SELECT * FROM students WHERE student_id=?", (student_id,))
-        row = cursor.fetchone()
-        if not row:
-            await update.message.reply_text("Студент не найден.")
-            return
-        columns = [desc[0] for desc in cursor.description]
-        student_data = dict(zip(columns, row))
-        name = student_data.get('name', 'Неизвестно')
-        message = format_ratings_table(name, student_data)
+        # Запросы к базе выполняются в DB_EXECUTOR, а не в event loop
+        message = await get_student_rating(student_id)
         if hasattr(update, 'message'):
             await update.message.reply_text(message, parse_mode='HTML', reply_markup=REPLY_KEYBOARD_MARKUP)
         else:
@@ -591,8 +540,6 @@ async def show_student_rating(update, student_id):
             await update.message.reply_text("Произошла ошибка при получении данных.")
         else:
             await update.reply_text("Произошла ошибка при получении данных.")
-    finally:
-        conn.close()
 
 async def retry_on_timeout(func, max_retries=3, base_delay=1):
     """Повторяет выполнение функции при таймауте с экспоненциальной задержкой и случайностью"""
@@ -734,6 +681,9 @@ async def send_notification_to_users(application):
                 await asyncio.sleep(0.1)  # Небольшая задержка между отправками
             except Exception as e:
                 logger.error(f"Ошибка при отправке уведомления пользователю {user_telegram_id}: {e}")
+                if isinstance(e, Forbidden):
+                    from user_activity import mark_user_blocked
+                    await run_db(mark_user_blocked, user_telegram_id)
                 fail_count += 1
                 continue  # Продолжаем со следующим пользователем
 